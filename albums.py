@@ -0,0 +1,165 @@
+# Сборка альбомов из отдельных NewMessage по (chat_id, grouped_id) — вместо events.Album
+# events.Album ждёт фиксированную паузу даже после того, как пришли все элементы, а элемент,
+# опоздавший на эту паузу, уходит отдельным альбомом. Здесь группа отдаётся, как только:
+#   - набралось 10 элементов (больше в альбоме не бывает);
+#   - из того же чата пришло сообщение не из этой группы (Telegram присылает элементы альбома подряд);
+#   - idle сек не было новых элементов (окно продлевается с каждым элементом);
+#   - с первого элемента прошло max_wait сек;
+#   - в буфере больше max_groups групп — тогда отдаётся самая старая.
+# Элементы, опоздавшие к уже отданной группе, не теряются: они уходят досылкой (AssembledAlbum.part > 0).
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+MAX_ALBUM = 10  # лимит Telegram на число элементов альбома
+
+
+class AssembledAlbum:
+    """Собранный альбом — в том же виде, что events.Album (messages, chat_id)"""
+
+    __slots__ = ("messages", "chat_id", "waited", "reason", "part")
+
+    def __init__(self, messages: list, waited: float, reason: str, part: int = 0):
+        self.messages = messages
+        self.chat_id = messages[0].chat_id
+        self.waited = waited  # сек от первого элемента до отдачи
+        self.reason = reason  # full | next | idle | max_wait | overflow | flush
+        self.part = part      # 0 — альбом; n > 0 — n-я досылка элементов, опоздавших к уже отданному альбому
+
+
+class _Group:
+    __slots__ = ("messages", "started", "timer", "part")
+
+    def __init__(self, part: int = 0):
+        self.messages = []
+        self.started = time.monotonic()
+        self.timer = None
+        self.part = part
+
+
+class AlbumAssembler:
+    """Буфер незавершённых альбомов; готовый альбом уходит в await on_album(AssembledAlbum)
+
+    Отдачи альбомов и участки ordered() одного чата выполняются строго в порядке постановки (очередь в _tail),
+    поэтому порядок постов сохраняется, даже если on_album ждёт места в очереди задач.
+    """
+
+    def __init__(self, on_album, idle: float = 0.25, max_wait: float = 2.0, max_groups: int = 1000):
+        self.on_album = on_album
+        self.idle = idle
+        self.max_wait = max_wait
+        self.max_groups = max_groups
+        self._groups = OrderedDict()  # (chat_id, grouped_id) → _Group, старые первыми
+        self._open = {}               # chat_id → ключ собираемой в чате группы (она всегда одна)
+        self._tail = {}               # chat_id → future последнего участка в очереди чата; следующий ждёт его
+        self._emitting = set()        # задачи отдачи: держим ссылки, пока они ждут очереди
+        self._sent = OrderedDict()    # недавно отданные группы → сколько частей отдано (для опоздавших элементов)
+
+    def __len__(self):
+        return len(self._groups)
+
+    async def add(self, msg):
+        """Элемент альбома (сообщение с grouped_id)"""
+        chat_id = msg.chat_id
+        key = (chat_id, msg.grouped_id)
+        # Всё до await: Telethon обрабатывает элементы альбома параллельно, и они должны попасть в одну группу,
+        # даже если отдача предыдущего альбома ждёт места в очереди
+        emitted = []
+        group = self._groups.get(key)
+        if group is None:
+            part = self._sent.get(key, 0)
+            if part:
+                logging.warning("Late album item chat=%s grouped_id=%s msg_id=%s: album already sent, sending part %s",
+                                chat_id, msg.grouped_id, msg.id, part)
+            previous = self._open.get(chat_id)
+            if previous is not None:
+                emitted.append(self._take(previous, "next"))  # новая группа в чате — предыдущая закончилась
+            if len(self._groups) >= self.max_groups:
+                emitted.append(self._take(next(iter(self._groups)), "overflow"))
+            group = self._groups[key] = _Group(part)
+            self._open[chat_id] = key
+        group.messages.append(msg)
+        if len(group.messages) >= MAX_ALBUM:
+            emitted.append(self._take(key, "full"))
+        else:
+            self._arm(key, group)
+        for done in emitted:
+            await asyncio.shield(done)
+
+    @asynccontextmanager
+    async def ordered(self, chat_id, flush: bool = False):
+        """Участок в очереди чата: начинается после всех отданных раньше альбомов и участков этого чата.
+
+        flush=True сначала отдаёт альбом, собираемый в чате (пришло сообщение не из него).
+        """
+        key = self._open.get(chat_id)
+        if flush and key is not None:
+            self._take(key, "next")
+        previous, done = self._link(chat_id)
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            yield
+        finally:
+            self._unlink(chat_id, done)
+
+    async def flush_all(self):
+        for key in list(self._groups):
+            self._take(key, "flush")
+        for done in list(self._tail.values()):
+            await asyncio.shield(done)
+
+    def _arm(self, key, group: _Group):
+        if group.timer is not None:
+            group.timer.cancel()
+        idle = self.idle
+        reason = "idle"
+        left = group.started + self.max_wait - time.monotonic()
+        if left < idle:
+            idle, reason = max(0.0, left), "max_wait"
+        group.timer = asyncio.get_running_loop().call_later(idle, self._take, key, reason)
+
+    def _link(self, chat_id):
+        previous = self._tail.get(chat_id)
+        done = self._tail[chat_id] = asyncio.get_running_loop().create_future()
+        return previous, done
+
+    def _unlink(self, chat_id, done):
+        done.set_result(None)
+        if self._tail.get(chat_id) is done:
+            del self._tail[chat_id]
+
+    def _take(self, key, reason: str):
+        """Закрывает группу и ставит её отдачу в очередь чата; возвращает future окончания отдачи"""
+        group = self._groups.pop(key, None)
+        if group is None:
+            return None
+        chat_id = key[0]
+        if group.timer is not None:
+            group.timer.cancel()
+        if self._open.get(chat_id) == key:
+            del self._open[chat_id]
+        self._sent[key] = group.part + 1
+        self._sent.move_to_end(key)
+        while len(self._sent) > self.max_groups:
+            self._sent.popitem(last=False)
+        messages = sorted(group.messages, key=lambda m: m.id)
+        album = AssembledAlbum(messages, time.monotonic() - group.started, reason, group.part)
+        previous, done = self._link(chat_id)
+        task = asyncio.get_running_loop().create_task(self._emit(previous, done, key, album))
+        self._emitting.add(task)
+        task.add_done_callback(self._emitting.discard)
+        return done
+
+    async def _emit(self, previous, done, key, album: AssembledAlbum):
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            await self.on_album(album)
+        except Exception as e:
+            logging.exception(f"Album handler failed for chat={key[0]} grouped_id={key[1]}: {e}")
+        finally:
+            self._unlink(key[0], done)
@@ -0,0 +1,172 @@
+# Догонялка после простоя
+# Для каждой пары помним id последнего обработанного сообщения источника. При старте
+# забираем пропущенное пачками по 100 (iter_messages), склеиваем альбомы по grouped_id
+# и прогоняем через ту же очередь, что и живые события, — с теми же проверками и заменами.
+
+import time
+import asyncio
+import sqlite3
+import logging
+from datetime import datetime, timezone
+
+
+class BackfillMessage:
+    """Одиночное сообщение из истории — в том же виде, что events.NewMessage"""
+
+    __slots__ = ("message", "chat_id")
+
+    def __init__(self, message):
+        self.message = message
+        self.chat_id = message.chat_id
+
+
+class BackfillAlbum:
+    """Альбом из истории — в том же виде, что events.Album"""
+
+    __slots__ = ("messages", "chat_id")
+
+    def __init__(self, messages: list):
+        self.messages = messages
+        self.chat_id = messages[0].chat_id
+
+
+def group_albums(messages: list) -> list:
+    """Склеивает подряд идущие сообщения с одинаковым grouped_id (вход — по возрастанию id)"""
+    items = []
+    album = []
+    for msg in messages:
+        gid = getattr(msg, "grouped_id", None)
+        if album and gid != album[0].grouped_id:
+            items.append(BackfillAlbum(album))
+            album = []
+        if gid:
+            album.append(msg)
+        else:
+            items.append(BackfillMessage(msg))
+    if album:
+        items.append(BackfillAlbum(album))
+    return items
+
+
+class Progress:
+    """Последний обработанный id по каждому источнику (SQLite)"""
+
+    def __init__(self, db_path: str = None):
+        self.db_path = db_path
+        self._last = {}
+        self._dirty = {}
+        self._db = None
+
+    def get(self, source_id: int):
+        return self._last.get(source_id)
+
+    def advance(self, source_id: int, msg_id: int):
+        if msg_id > self._last.get(source_id, 0):
+            self._last[source_id] = msg_id
+            if self._db is not None:
+                self._dirty[source_id] = msg_id
+
+    def load(self):
+        if not self.db_path:
+            return
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS progress (source_chat INTEGER PRIMARY KEY, last_id INTEGER NOT NULL, ts REAL NOT NULL)"
+        )
+        self._db.commit()
+        for source_chat, last_id in self._db.execute("SELECT source_chat, last_id FROM progress"):
+            self._last[source_chat] = last_id
+
+    def load_chats(self, chat_ids):
+        """Перечитывает прогресс этих источников (пара переехала из другого шарда)"""
+        chat_ids = list(chat_ids)
+        if self._db is None or not chat_ids:
+            return
+        rows = self._db.execute(
+            f"SELECT source_chat, last_id FROM progress WHERE source_chat IN ({','.join('?' * len(chat_ids))})",
+            chat_ids,
+        ).fetchall()
+        for source_chat, last_id in rows:
+            self._last[source_chat] = max(last_id, self._last.get(source_chat, 0))
+
+    def flush(self):
+        if self._db is None:
+            return
+        dirty, self._dirty = self._dirty, {}
+        self._write(dirty)
+
+    def _write(self, dirty: dict):
+        if dirty:
+            now = time.time()
+            self._db.executemany(
+                "INSERT OR REPLACE INTO progress (source_chat, last_id, ts) VALUES (?, ?, ?)",
+                [(chat, last_id, now) for chat, last_id in dirty.items()],
+            )
+            self._db.commit()
+
+    async def run_flusher(self, interval: float = 1.0):
+        if self._db is None:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            if not self._dirty:
+                continue
+            dirty, self._dirty = self._dirty, {}
+            try:
+                await asyncio.to_thread(self._write, dirty)
+            except Exception as e:
+                logging.error(f"Progress flush failed: {repr(e)}")
+
+    def close(self):
+        if self._db is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._db.close()
+            self._db = None
+
+
+async def backfill(client, pairs: list, progress: Progress, submit,
+                   max_messages: int = 500, max_age: float = 6 * 3600, concurrency: int = 4, peers=None):
+    """Забирает пропущенные сообщения всех пар и отдаёт их в submit(pair, item)
+
+    peers — PeerCache: источники запрашиваются по готовому InputPeer, как и в живом пути.
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+    peer = peers.get if peers is not None else (lambda chat_id: chat_id)
+    cutoff = datetime.fromtimestamp(time.time() - max_age, tz=timezone.utc) if max_age else None
+
+    async def one(pair):
+        async with sem:
+            last_id = progress.get(pair.source_id)
+            if last_id is None:
+                # Первый запуск для пары — догонять нечего, запоминаем текущую верхушку
+                top = await client.get_messages(peer(pair.source_id), limit=1)
+                if top:
+                    progress.advance(pair.source_id, top[0].id)
+                return 0
+
+            messages = []
+            # iter_messages сам ходит пачками по 100 id, от новых к старым
+            async for msg in client.iter_messages(peer(pair.source_id), min_id=last_id, limit=max_messages):
+                if cutoff is not None and msg.date and msg.date < cutoff:
+                    break
+                messages.append(msg)
+            messages.reverse()
+
+        for item in group_albums(messages):
+            await submit(pair, item)
+        if messages:
+            logging.info(f"Backfill {pair.source_id} -> {pair.target_id}: {len(messages)} msgs after id={last_id}")
+        return len(messages)
+
+    results = await asyncio.gather(*(one(p) for p in pairs), return_exceptions=True)
+    total = 0
+    for pair, r in zip(pairs, results):
+        if isinstance(r, BaseException):
+            logging.error(f"Backfill failed for {pair.source_id}: {repr(r)}")
+        else:
+            total += r
+    logging.info(f"Backfill done: {total} messages enqueued")
+    return total
@@ -0,0 +1,343 @@
+# Микробенчмарки горячего пути utils.py: извлечение ссылок, whitelist, переписывание текста/entities
+# Синтетические посты: до 4096 символов, сотни entities, 1–200 маппингов, эмодзи, много кнопок.
+# Для каждого сценария — ops/sec и память одного вызова по tracemalloc: peak_bytes — пик вместе с временными
+# объектами, kept_bytes — сколько остаётся занятым результатом. Скорость меряется без tracemalloc.
+# С базой сравнивается не абсолютная скорость, а relative — медиана отношений к эталону reference_work
+# по 15 замерам поочерёдно со сценарием: база с другой машины остаётся пригодной. spread — неопределённость
+# этой медианы; порог замедления — больший из --tolerance и суммы spread прогона и базы. REGRESSION
+# засчитывается, только если замедление повторилось во всех --confirm перезамерах. Сценарий без relative
+# в базе — ошибка прогона: базу нужно перезаписать через --save.
+#
+#   python bench.py              — прогон и сравнение с базой (код выхода 1 при регрессии)
+#   python bench.py --save       — прогон и запись новой базы
+#   python bench.py -k rewrite   — только сценарии, в имени которых есть подстрока
+#   python bench.py --save -k x  — перезаписать в базе только эти сценарии
+#   python bench.py --check      — только проверки поведения (они идут и перед каждым прогоном)
+
+import sys
+import json
+import time
+import math
+import random
+import statistics
+import gc
+import tracemalloc
+import argparse
+
+from telethon.tl.types import (
+    MessageEntityBold, MessageEntityItalic, MessageEntityTextUrl, MessageEntityUrl,
+    ReplyInlineMarkup, KeyboardButtonRow, KeyboardButtonUrl,
+)
+
+from pairs import Pair
+from utils import (
+    extract_links_from_text_and_entities, links_allowed_by_whitelist, rewrite_text_and_entities, Whitelist,
+)
+
+BASELINE_PATH = "bench_baseline.json"
+MAX_TEXT = 4096
+EMOJI = "😀🔥🚀✅📈💎🎉"
+WORDS = ("канал", "новости", "обзор", "пост", "сегодня", "price", "update", "read", "more", "отправитель")
+
+
+def _utf16_len(s: str) -> int:
+    return len(s.encode("utf-16-le")) // 2
+
+
+def make_pair(mappings: int) -> Pair:
+    links = [{"src": f"https://t.me/source_{i}", "tgt": f"https://t.me/target_{i}"} for i in range(mappings)]
+    return Pair({
+        "source_id": -1001,
+        "target_id": -1002,
+        "source_name": "отправитель",
+        "target_name": "получатель",
+        "white_list": [m["src"] for m in links] + ["https://example.com"],
+        "link_mappings": links,
+    })
+
+
+def make_post(rng: random.Random, mappings: int, entities: int, emoji_rate: float) -> tuple:
+    """Текст до MAX_TEXT символов со ссылками на маппинги и entities, размеченными в UTF‑16"""
+    parts, ents = [], []
+    u16 = 0
+    length = 0
+    while length < MAX_TEXT - 64:
+        roll = rng.random()
+        if roll < 0.08:
+            chunk = f"https://t.me/source_{rng.randrange(mappings)}"
+        elif roll < 0.08 + emoji_rate:
+            chunk = rng.choice(EMOJI)
+        else:
+            chunk = rng.choice(WORDS)
+        chunk_u16 = _utf16_len(chunk)
+        if len(ents) < entities and roll > 0.5:
+            if rng.random() < 0.3:
+                ents.append(MessageEntityTextUrl(u16, chunk_u16, f"https://t.me/source_{rng.randrange(mappings)}"))
+            else:
+                ents.append(MessageEntityBold(u16, chunk_u16))
+        elif chunk.startswith("https://") and len(ents) < entities:
+            ents.append(MessageEntityUrl(u16, chunk_u16))
+        parts.append(chunk + " ")
+        u16 += chunk_u16 + 1
+        length += len(chunk) + 1
+    return "".join(parts), ents
+
+
+def make_markup(rng: random.Random, buttons: int, mappings: int):
+    rows = []
+    for r in range(0, buttons, 4):
+        rows.append(KeyboardButtonRow([
+            KeyboardButtonUrl(f"b{i}", f"https://t.me/source_{rng.randrange(mappings)}?start={i}")
+            for i in range(r, min(r + 4, buttons))
+        ]))
+    return ReplyInlineMarkup(rows)
+
+
+def scenarios() -> dict:
+    """Имя → функция без аргументов (входные данные готовятся заранее)"""
+    rng = random.Random(12345)
+    result = {}
+
+    for mappings in (1, 20, 200):
+        pair = make_pair(mappings)
+        text, ents = make_post(rng, mappings, entities=300, emoji_rate=0.05)
+        markup = make_markup(rng, 40, mappings)
+        links = extract_links_from_text_and_entities(text, ents, reply_markup=markup)
+        result[f"extract_links/4k_300ents_40btn/m{mappings}"] = (
+            lambda t=text, e=ents, k=markup: extract_links_from_text_and_entities(t, e, reply_markup=k)
+        )
+        result[f"whitelist/m{mappings}"] = (
+            lambda l=links, w=pair.whitelist: links_allowed_by_whitelist(l, w)
+        )
+        result[f"rewrite/4k_300ents/m{mappings}"] = (
+            lambda t=text, e=ents, p=pair: rewrite_text_and_entities(t, e, p)
+        )
+
+    # Шаблоны вместо перечисления: 1 префикс пути и 1 домен на 1000 ссылок
+    wildcard = Whitelist(["t.me/source_/*", "*.example.com", "https://t.me/boost/*"] + [f"https://t.me/x{i}" for i in range(500)])
+    many = {f"https://t.me/x{i}" for i in range(0, 1000, 2)} | {"https://cdn.example.com/a", "https://t.me/boost/q"}
+    result["whitelist/500_entries_wildcards"] = lambda: links_allowed_by_whitelist(many, wildcard)
+
+    pair = make_pair(20)
+    text, ents = make_post(rng, 20, entities=300, emoji_rate=0.4)
+    result["rewrite/4k_emoji_heavy/m20"] = lambda: rewrite_text_and_entities(text, ents, pair)
+    result["extract_links/4k_emoji_heavy/m20"] = lambda: extract_links_from_text_and_entities(text, ents)
+
+    short, short_ents = "Новый пост от отправитель: https://t.me/source_0", [MessageEntityBold(0, 10)]
+    result["rewrite/short/m20"] = lambda: rewrite_text_and_entities(short, short_ents, pair)
+    return result
+
+
+def _entity_text(text: str, ent) -> str:
+    """Подстрока text, которую размечает entity (offset/length в UTF-16)"""
+    data = text.encode("utf-16-le")
+    return data[ent.offset * 2:(ent.offset + ent.length) * 2].decode("utf-16-le")
+
+
+def checks() -> list:
+    """Проверки rewrite_text_and_entities: список сообщений об ошибках (пустой — всё верно)"""
+    pair = Pair({
+        "source_id": -1001,
+        "target_id": -1002,
+        "source_name": "отправитель",
+        "target_name": "получатель",
+        "white_list": [],
+        "link_mappings": [{"src": "https://t.me/src", "tgt": "https://t.me/longer_target"}],
+    })
+    link = "https://t.me/longer_target"
+    cases = [
+        # (название, текст, entities, ожидаемый текст, ожидаемые (подстрока, url) entities)
+        ("emoji before entity",
+         "😀🔥 https://t.me/src жирный", [MessageEntityBold(_utf16_len("😀🔥 https://t.me/src "), 6)],
+         f"😀🔥 {link} жирный", [("жирный", None)]),
+        ("emoji inside entity",
+         "https://t.me/src а😀б🚀в", [MessageEntityBold(_utf16_len("https://t.me/src "), _utf16_len("а😀б🚀в"))],
+         f"{link} а😀б🚀в", [("а😀б🚀в", None)]),
+        ("emoji after entity",
+         "https://t.me/src жирный 😀🔥", [MessageEntityBold(_utf16_len("https://t.me/src "), 6)],
+         f"{link} жирный 😀🔥", [("жирный", None)]),
+        ("entity overlapping replaced link",
+         "😀 см https://t.me/src сейчас", [MessageEntityItalic(_utf16_len("😀 "), _utf16_len("см https://t.me/"))],
+         f"😀 см {link} сейчас", [(f"см {link}", None)]),
+        ("source name inside TextUrl",
+         "отправитель 😀 отправитель", [MessageEntityTextUrl(_utf16_len("отправитель 😀 "), 11, "https://t.me/src")],
+         "получатель 😀 получатель", [("получатель", link)]),
+    ]
+    # Пара только с именем канала: в регулярке нет группы src
+    name_only = Pair({
+        "source_id": -1001,
+        "target_id": -1002,
+        "source_name": "Канал",
+        "target_name": "Наш канал",
+        "link_mappings": [],
+    })
+    name_cases = [
+        ("name-only pair",
+         "😀 Канал: новости", [MessageEntityBold(_utf16_len("😀 Канал: "), 7)],
+         "😀 Наш канал: новости", [("новости", None)]),
+    ]
+    errors = []
+    for case_pair, name, text, ents, want_text, want_ents in (
+        [(pair, *c) for c in cases] + [(name_only, *c) for c in name_cases]
+    ):
+        new_text, new_ents = rewrite_text_and_entities(text, ents, case_pair)
+        got = [(_entity_text(new_text, e), getattr(e, "url", None)) for e in new_ents]
+        if new_text != want_text or got != want_ents:
+            errors.append(f"{name}: got {new_text!r} {got}, want {want_text!r} {want_ents}")
+    return errors
+
+
+def reference_work(text: str = " ".join(WORDS) * 40):
+    """Эталон скорости машины: чистый Python без кода utils (разбор строки, словарь, кодирование)"""
+    counts = {}
+    for word in text.split():
+        counts[word.lower()] = counts.get(word.lower(), 0) + 1
+    return len(text.encode("utf-16-le")), sorted(counts.items())
+
+
+def _calibrate(func, min_time: float) -> int:
+    """Сколько вызовов подряд занимают не меньше min_time сек"""
+    func()  # прогрев
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        if time.perf_counter() - start >= min_time:
+            return number
+        number *= 2
+
+
+def _ops(func, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+    return number / (time.perf_counter() - start)
+
+
+def measure_memory(func, repeats: int = 3) -> dict:
+    """tracemalloc за один вызов, минимум из repeats:
+    peak_bytes — пик памяти, выделенной вызовом, вместе с временными объектами;
+    kept_bytes — сколько из неё остаётся занятым, пока жив результат"""
+    func()  # прогрев: кэши re и utils не должны попасть в замер
+    peak = kept = None
+    gc.disable()
+    tracemalloc.start()
+    try:
+        for _ in range(repeats):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            result = func()
+            current, top = tracemalloc.get_traced_memory()
+            del result
+            peak = top - before if peak is None else min(peak, top - before)
+            kept = current - before if kept is None else min(kept, current - before)
+    finally:
+        tracemalloc.stop()
+        gc.enable()
+    return {"peak_bytes": max(peak, 0), "kept_bytes": max(kept, 0)}
+
+
+def measure_relative(func, repeats: int = 15, min_time: float = 0.05) -> dict:
+    """Сценарий и эталон поочерёдно repeats раз.
+
+    relative — медиана отношений скорости сценария к скорости эталона, замеренного сразу после него;
+    spread — полуширина ~95% доверительного интервала этой медианы (1.58·IQR/√repeats) в долях медианы.
+    """
+    number = _calibrate(func, min_time)
+    reference = _calibrate(reference_work, min_time)
+    ops = []
+    ratios = []
+    for _ in range(repeats):
+        scenario = _ops(func, number)
+        ops.append(scenario)
+        ratios.append(scenario / _ops(reference_work, reference))
+    relative = statistics.median(ratios)
+    q1, _, q3 = statistics.quantiles(ratios, n=4)
+    median_ops = statistics.median(ops)
+    return {
+        "ops_per_sec": round(median_ops, 1),
+        "us_per_op": round(1e6 / median_ops, 2),
+        "relative": round(relative, 4),
+        "spread": round(1.58 * (q3 - q1) / math.sqrt(repeats) / relative, 4),
+        **measure_memory(func),
+    }
+
+
+def slowdown_limit(result: dict, base: dict, tolerance: float) -> float:
+    """Допустимое замедление: не меньше tolerance и не меньше суммы неопределённостей прогона и базы"""
+    return max(tolerance, result["spread"] + base.get("spread", 0.0))
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--save", action="store_true", help="записать результаты как новую базу")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="допустимое замедление (доля); при шумном прогоне порог шире")
+    parser.add_argument("--confirm", type=int, default=2, help="сколько раз перемерить сценарий перед REGRESSION")
+    parser.add_argument("-k", dest="filter", default="", help="подстрока имени сценария")
+    parser.add_argument("--check", action="store_true", help="только проверки поведения, без замеров")
+    args = parser.parse_args(argv)
+
+    errors = checks()
+    for error in errors:
+        print(f"CHECK FAILED {error}")
+    if errors or args.check:
+        return 1 if errors else 0
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = {}
+
+    results = {}
+    regressions = []
+    missing = []  # нет в базе или запись старого формата без relative
+    print(f"{'scenario':<42} {'ops/sec':>12} {'us/op':>10} {'peak B':>9} {'kept B':>9} {'spread':>7} {'vs base':>8}")
+    for name, func in scenarios().items():
+        if args.filter and args.filter not in name:
+            continue
+        r = results[name] = measure_relative(func)
+        base = baseline.get(name)
+        delta = ""
+        if base and base.get("relative"):
+            # Сравниваются скорости в долях эталона: от машины и её загрузки они почти не зависят
+            ratio = r["relative"] / base["relative"]
+            delta = f"{(ratio - 1) * 100:+.0f}%"
+            limit = slowdown_limit(r, base, args.tolerance)
+            # Замедление засчитывается, только если повторилось во всех --confirm перезамерах
+            for _ in range(args.confirm if ratio < 1 - limit else 0):
+                again = measure_relative(func)
+                ratio = max(ratio, again["relative"] / base["relative"])
+                limit = max(limit, slowdown_limit(again, base, args.tolerance))
+                if ratio >= 1 - limit:
+                    delta += " noise"
+                    break
+            if ratio < 1 - limit:
+                regressions.append((name, ratio, limit))
+        else:
+            delta = "missing"
+            missing.append(name)
+        print(f"{name:<42} {r['ops_per_sec']:>12.1f} {r['us_per_op']:>10.2f} {r['peak_bytes']:>9} {r['kept_bytes']:>9} "
+              f"{r['spread'] * 100:>6.1f}% {delta:>8}")
+
+    if args.save:
+        baseline.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"Baseline saved to {args.baseline}")
+        return 0
+
+    for name in missing:
+        print(f"NO BASELINE {name}: no relative speed in {args.baseline}, run with --save")
+    for name, ratio, limit in regressions:
+        print(f"REGRESSION {name}: {ratio * 100:.0f}% of baseline speed relative to reference_work "
+              f"(allowed slowdown {limit * 100:.0f}%)")
+    return 1 if missing or regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,18 +1,42 @@
 # Инициализация Telegram-клиента через Telethon
 # Используется пользовательская сессия, а не бот
+# Сессия по умолчанию хранится в памяти и периодически пишется в <SESSION_NAME>.json (session.py)
 
 from telethon import TelegramClient
-from config import API_ID, API_HASH, SESSION_NAME
+from telethon.tl.functions.messages import (
+    SendMessageRequest,
+    SendMediaRequest,
+    SendMultiMediaRequest,
+    ForwardMessagesRequest,
+    EditMessageRequest,
+)
+from config import API_ID, API_HASH, SESSION_NAME, SESSION_BACKEND, FLOOD_SLEEP_THRESHOLD
+from session import open_session
+
+# Запросы отправки: их FloodWait пережидает не Telethon, а ratelimit.RateLimiter (пауза только своего target)
+SEND_REQUESTS = (SendMessageRequest, SendMediaRequest, SendMultiMediaRequest, ForwardMessagesRequest, EditMessageRequest)
+
+
+class CopierClient(TelegramClient):
+    """TelegramClient, у которого flood_sleep_threshold действует на всё, кроме отправок"""
+
+    async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+        if flood_sleep_threshold is None and isinstance(request, SEND_REQUESTS):
+            # Иначе короткий FloodWait отправки Telethon проспит сам, держа воркер, и RateLimiter его не увидит
+            flood_sleep_threshold = 0
+        return await super()._call(sender, request, ordered=ordered, flood_sleep_threshold=flood_sleep_threshold)
+
 
 # Создаём клиент, который будет авторизован как пользователь
 # Добавляем параметры устройства, чтобы сессия выглядела как реальное устройство
-client = TelegramClient(
-    SESSION_NAME,
+client = CopierClient(
+    open_session(SESSION_NAME, SESSION_BACKEND),
     API_ID,
     API_HASH,
     device_model="Windows 10 PC",       # модель устройства
     system_version="10.0",              # версия ОС
     app_version="4.16.30 x64",          # версия Telegram (можно взять с десктопа/мобилки)
     lang_code="ru",                     # язык интерфейса
-    system_lang_code="ru-RU"            # системный язык
+    system_lang_code="ru-RU",           # системный язык
+    flood_sleep_threshold=FLOOD_SLEEP_THRESHOLD  # короткие FloodWait ждёт Telethon, кроме отправок (CopierClient)
 )
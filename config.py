@@ -8,4 +8,124 @@ API_HASH = os.getenv('API_HASH')
 # BOT_TOKEN = os.getenv('BOT_TOKEN')
 
 SESSION_NAME = os.getenv('SESSION_NAME', 'copier_session') # Файл для сохранения сессии
+# Хранилище сессии: json — в памяти с записью в <SESSION_NAME>.json (старая .session переносится сама),
+# sqlite — стандартная сессия Telethon; период записи json-сессии на диск, сек
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'json')
+SESSION_FLUSH_INTERVAL = float(os.getenv('SESSION_FLUSH_INTERVAL', '30'))
 
+
+# Защита от повторов: размер в памяти, срок жизни ключа (сек) и файл SQLite (пусто — без сохранения)
+DEDUP_MAX_SIZE = int(os.getenv('DEDUP_MAX_SIZE', '200000'))
+DEDUP_TTL = float(os.getenv('DEDUP_TTL', str(3 * 24 * 3600)))
+DEDUP_DB = os.getenv('DEDUP_DB', 'state.sqlite3')
+
+# Планировщик: число воркеров и размер очереди на один target (при переполнении — ожидание)
+WORKER_COUNT = int(os.getenv('WORKER_COUNT', '4'))
+SHARD_QUEUE_SIZE = int(os.getenv('SHARD_QUEUE_SIZE', '200'))
+
+# Свежесть очереди: target с самым свежим по дате постом обслуживается первым всегда. Срок годности поста
+# по умолчанию, сек (в паре — max_age): по умолчанию 0 — устаревшие посты не выбрасываются, а лишь пропускают
+# свежие вперёд. С какой глубины очереди target сбрасывать наименее ценное (0 — не сбрасывать)
+# и период отчёта о глубине в логах, сек
+QUEUE_MAX_AGE = float(os.getenv('QUEUE_MAX_AGE', '0'))
+QUEUE_SHED_DEPTH = int(os.getenv('QUEUE_SHED_DEPTH', '0'))
+QUEUE_REPORT_INTERVAL = float(os.getenv('QUEUE_REPORT_INTERVAL', '60'))
+
+# Журнал очереди на случай падения: файл (пусто — выключен), период записи с fsync (сек)
+# и после скольких завершённых задач переписывать файл без них
+JOURNAL_PATH = os.getenv('JOURNAL_PATH', 'queue.journal')
+JOURNAL_FSYNC_INTERVAL = float(os.getenv('JOURNAL_FSYNC_INTERVAL', '0.2'))
+JOURNAL_COMPACT_AFTER = int(os.getenv('JOURNAL_COMPACT_AFTER', '10000'))
+
+# Лимиты отправки (сообщений в секунду): общий на аккаунт и на каждый target; повторы при FloodWait
+RATE_GLOBAL = float(os.getenv('RATE_GLOBAL', '10'))
+RATE_GLOBAL_BURST = float(os.getenv('RATE_GLOBAL_BURST', '20'))
+RATE_TARGET = float(os.getenv('RATE_TARGET', '0.5'))
+RATE_TARGET_BURST = float(os.getenv('RATE_TARGET_BURST', '5'))
+FLOOD_MAX_RETRIES = int(os.getenv('FLOOD_MAX_RETRIES', '3'))
+
+# FloodWait до стольких секунд Telethon пережидает сам (скачивание, get_messages, get_dialogs и т.п.),
+# более долгие поднимаются как FloodWaitError. На отправки не действует: любой их FloodWait
+# поднимается сразу и обрабатывается ratelimit.RateLimiter (client.CopierClient)
+FLOOD_SLEEP_THRESHOLD = int(os.getenv('FLOOD_SLEEP_THRESHOLD', '10'))
+
+# Fallback-передача медиа: до какого размера файл держать в памяти (больше — загрузка потоком
+# по мере скачивания), максимум на файл (0 — без лимита),
+# таймаут передачи одного файла (сек) и число параллельных загрузок элементов альбома
+MEDIA_MEMORY_LIMIT = int(os.getenv('MEDIA_MEMORY_LIMIT', str(10 * 1024 * 1024)))
+MEDIA_MAX_BYTES = int(os.getenv('MEDIA_MAX_BYTES', str(2000 * 1024 * 1024)))
+MEDIA_TIMEOUT = float(os.getenv('MEDIA_TIMEOUT', '300'))
+MEDIA_CONCURRENCY = int(os.getenv('MEDIA_CONCURRENCY', '4'))
+
+# Преобразование фото (image_transform в channels.json): число процессов Pillow (0 — выключено)
+# и объём кэша готовых картинок в памяти, байт
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', '2'))
+IMAGE_CACHE_BYTES = int(os.getenv('IMAGE_CACHE_BYTES', str(64 * 1024 * 1024)))
+
+# Кэш медиа на диске: каталог (пусто — выключен), квота в байтах; срок жизни ссылок на загруженные копии (сек)
+MEDIA_CACHE_DIR = os.getenv('MEDIA_CACHE_DIR', 'media_cache')
+MEDIA_CACHE_QUOTA = int(os.getenv('MEDIA_CACHE_QUOTA', str(2 * 1024 * 1024 * 1024)))
+MEDIA_HANDLE_TTL = float(os.getenv('MEDIA_HANDLE_TTL', str(12 * 3600)))
+
+# Сколько соответствий source → target хранить для правок на месте (лежат в том же SQLite, что и DEDUP_DB)
+MSGMAP_MAX_SIZE = int(os.getenv('MSGMAP_MAX_SIZE', '200000'))
+
+# Догонялка при старте: включена ли, сколько сообщений на пару максимум, насколько старые (сек), сколько пар параллельно
+BACKFILL_ENABLED = os.getenv('BACKFILL_ENABLED', '1') == '1'
+BACKFILL_MAX_MESSAGES = int(os.getenv('BACKFILL_MAX_MESSAGES', '500'))
+BACKFILL_MAX_AGE = float(os.getenv('BACKFILL_MAX_AGE', str(6 * 3600)))
+BACKFILL_CONCURRENCY = int(os.getenv('BACKFILL_CONCURRENCY', '4'))
+
+# Логи: формат text|json, ротация size|time (размер в байтах или интервал when), число архивов, gzip архивов
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_DIR = os.getenv('LOG_DIR', '')  # каталог логов ('' — текущий)
+LOG_ROTATE = os.getenv('LOG_ROTATE', 'size')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(50 * 1024 * 1024)))
+LOG_WHEN = os.getenv('LOG_WHEN', 'midnight')
+LOG_BACKUPS = int(os.getenv('LOG_BACKUPS', '7'))
+LOG_COMPRESS = os.getenv('LOG_COMPRESS', '1') == '1'
+
+# Уровни логгеров (WARNING для content/flood выключает дампы текста) и доля сохраняемых записей 0..1
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_LEVEL_CONTENT = os.getenv('LOG_LEVEL_CONTENT', 'INFO')
+LOG_LEVEL_FLOOD = os.getenv('LOG_LEVEL_FLOOD', 'INFO')
+LOG_LEVEL_ADS = os.getenv('LOG_LEVEL_ADS', 'INFO')
+LOG_SAMPLE_CONTENT = float(os.getenv('LOG_SAMPLE_CONTENT', '1.0'))
+LOG_SAMPLE_FLOOD = float(os.getenv('LOG_SAMPLE_FLOOD', '1.0'))
+
+# Метрики Prometheus: адрес и порт HTTP /metrics (0 — выключено)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# Пары каналов: файл и период проверки его изменений, сек (0 — не перечитывать)
+CHANNELS_FILE = os.getenv('CHANNELS_FILE', 'channels.json')
+CHANNELS_RELOAD_INTERVAL = float(os.getenv('CHANNELS_RELOAD_INTERVAL', '5'))
+
+# Супервизор нескольких аккаунтов: сессии через запятую, период heartbeat, когда считать шард мёртвым,
+# и с какой длины FloodWait переносить его пары на другие аккаунты, сек
+SESSIONS = [s.strip() for s in os.getenv('SESSIONS', '').split(',') if s.strip()]
+SUPERVISOR_HEARTBEAT = float(os.getenv('SUPERVISOR_HEARTBEAT', '5'))
+SUPERVISOR_DEAD_AFTER = float(os.getenv('SUPERVISOR_DEAD_AFTER', '30'))
+SUPERVISOR_FLOOD_MOVE = float(os.getenv('SUPERVISOR_FLOOD_MOVE', '300'))
+
+# Быстрый путь: неизменённые сообщения копируются forward без автора, пачками до 100 id;
+# сколько ждать следующие сообщения в пачку, сек
+FORWARD_FAST_PATH = os.getenv('FORWARD_FAST_PATH', '1') == '1'
+FORWARD_BATCH_LINGER = float(os.getenv('FORWARD_BATCH_LINGER', '0.05'))
+
+# Сколько source/target резолвить в InputPeer одновременно при старте
+PEER_RESOLVE_CONCURRENCY = int(os.getenv('PEER_RESOLVE_CONCURRENCY', '8'))
+
+# Подавление почти-дубликатов (simhash текста + id медиа) по каждому target: окно, сек; размер окна;
+# допустимое расстояние Хэмминга (0–3); минимум слов в тексте для сравнения
+NEARDUP_ENABLED = os.getenv('NEARDUP_ENABLED', '0') == '1'
+NEARDUP_WINDOW = float(os.getenv('NEARDUP_WINDOW', '3600'))
+NEARDUP_MAX_ENTRIES = int(os.getenv('NEARDUP_MAX_ENTRIES', '5000'))
+NEARDUP_DISTANCE = int(os.getenv('NEARDUP_DISTANCE', '3'))
+NEARDUP_MIN_TOKENS = int(os.getenv('NEARDUP_MIN_TOKENS', '8'))
+
+# Сборка альбомов: сколько ждать следующий элемент, сек; максимум ожидания с первого элемента, сек;
+# сколько незавершённых альбомов держать в буфере
+ALBUM_IDLE = float(os.getenv('ALBUM_IDLE', '0.25'))
+ALBUM_MAX_WAIT = float(os.getenv('ALBUM_MAX_WAIT', '2'))
+ALBUM_MAX_GROUPS = int(os.getenv('ALBUM_MAX_GROUPS', '1000'))
@@ -0,0 +1,150 @@
+# Защита от повторной обработки сообщений
+# Ключи составные: (вид, chat_id, id) — id сообщений разных каналов не пересекаются.
+# Память ограничена: LRU по времени добавления + TTL. Опционально всё дублируется в SQLite,
+# чтобы после перезапуска копировщик не отправлял уже отправленное.
+
+import time
+import asyncio
+import sqlite3
+import logging
+from collections import OrderedDict
+
+MSG = "m"    # одиночное сообщение: (MSG, chat_id, msg_id)
+GROUP = "g"  # альбом: (GROUP, chat_id, grouped_id)
+
+
+class DedupStore:
+    """Ограниченное множество обработанных ключей с TTL и опциональным SQLite"""
+
+    def __init__(self, max_size: int = 200_000, ttl: float = 3 * 24 * 3600, db_path: str = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.db_path = db_path
+        self._items = OrderedDict()  # ключ → время добавления (старые в начале)
+        self._pending = []           # ещё не записанные в SQLite ключи
+        self._db = None
+        self._pruned_at = 0.0
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key) -> bool:
+        ts = self._items.get(key)
+        if ts is None:
+            return False
+        if time.time() - ts > self.ttl:
+            del self._items[key]
+            return False
+        return True
+
+    def add(self, key, ts: float = None):
+        ts = time.time() if ts is None else ts
+        self._items[key] = ts
+        self._items.move_to_end(key)
+        if self._db is not None:
+            self._pending.append((key[0], key[1], key[2], ts))
+        self._evict(ts)
+
+    def add_many(self, keys):
+        ts = time.time()
+        for key in keys:
+            self.add(key, ts)
+
+    def discard(self, key):
+        """Снимает отметку в памяти (в SQLite её перезапишет следующий add)"""
+        self._items.pop(key, None)
+
+    def check_and_add(self, key) -> bool:
+        """True, если ключ новый (и теперь помечен обработанным)"""
+        if key in self:
+            return False
+        self.add(key)
+        return True
+
+    def _evict(self, now: float):
+        items = self._items
+        while len(items) > self.max_size:
+            items.popitem(last=False)
+        # Просроченные лежат в начале — снимаем их, пока встречаются
+        while items:
+            key, ts = next(iter(items.items()))
+            if now - ts <= self.ttl:
+                break
+            items.popitem(last=False)
+
+    # --- Персистентность ---
+
+    def load(self):
+        """Открывает SQLite и загружает свежие ключи в память"""
+        if not self.db_path:
+            return
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dedup ("
+            "kind TEXT NOT NULL, chat INTEGER NOT NULL, id INTEGER NOT NULL, ts REAL NOT NULL, "
+            "PRIMARY KEY (kind, chat, id))"
+        )
+        self._db.commit()
+        since = time.time() - self.ttl
+        rows = self._db.execute(
+            "SELECT kind, chat, id, ts FROM dedup WHERE ts >= ? ORDER BY ts DESC LIMIT ?",
+            (since, self.max_size),
+        ).fetchall()
+        for kind, chat, id_, ts in reversed(rows):
+            self._items[(kind, chat, id_)] = ts
+        logging.info(f"Dedup store loaded {len(rows)} keys from {self.db_path}")
+
+    def load_chats(self, chat_ids):
+        """Догружает из SQLite ключи этих чатов (пара переехала из другого шарда)"""
+        chat_ids = list(chat_ids)
+        if self._db is None or not chat_ids:
+            return
+        rows = self._db.execute(
+            f"SELECT kind, chat, id, ts FROM dedup WHERE ts >= ? AND chat IN ({','.join('?' * len(chat_ids))})",
+            (time.time() - self.ttl, *chat_ids),
+        ).fetchall()
+        for kind, chat, id_, ts in rows:
+            self._items.setdefault((kind, chat, id_), ts)
+        self._evict(time.time())
+        logging.info(f"Dedup store loaded {len(rows)} keys of chats {chat_ids}")
+
+    def flush(self):
+        """Записывает накопленные ключи в SQLite"""
+        if self._db is None:
+            return
+        pending, self._pending = self._pending, []
+        self._write(pending)
+
+    def _write(self, pending: list):
+        if pending:
+            self._db.executemany("INSERT OR REPLACE INTO dedup (kind, chat, id, ts) VALUES (?, ?, ?, ?)", pending)
+        now = time.time()
+        if now - self._pruned_at > 60:
+            self._db.execute("DELETE FROM dedup WHERE ts < ?", (now - self.ttl,))
+            self._pruned_at = now
+        self._db.commit()
+
+    async def run_flusher(self, interval: float = 1.0):
+        """Фоновая запись в SQLite вне event loop"""
+        if self._db is None:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            if not self._pending:
+                continue
+            # Забираем пачку в потоке event loop, пишем в отдельном потоке
+            pending, self._pending = self._pending, []
+            try:
+                await asyncio.to_thread(self._write, pending)
+            except Exception as e:
+                logging.error(f"Dedup flush failed: {repr(e)}")
+
+    def close(self):
+        if self._db is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._db.close()
+            self._db = None
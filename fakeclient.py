@@ -0,0 +1,251 @@
+# Локальная замена TelegramClient для нагрузочных прогонов без аккаунта
+# Понимает то подмножество API, которым пользуются handlers / media / backfill:
+# on(), send_message, send_file, edit_message, ForwardMessagesRequest, get_input_entity, get_dialogs,
+# get_messages, iter_messages, iter_download, upload_file.
+# События — настоящие events.NewMessage.Event / MessageEdited.Event (альбом — несколько NewMessage с общим grouped_id)
+# над настоящими Message, поэтому код обработчиков идёт по тем же веткам, что и в бою.
+
+import copy
+import time
+import logging
+import random
+import asyncio
+from datetime import datetime, timezone
+
+from telethon import events
+from telethon.errors.rpcerrorlist import FloodWaitError
+from telethon.tl.functions.messages import ForwardMessagesRequest
+from telethon.tl.custom import Message
+from telethon.tl.types import (
+    PeerChannel, InputPeerChannel, MessageMediaDocument, Document, DocumentAttributeFilename, InputFile,
+)
+from telethon import utils as tl_utils
+
+
+class SentRecord:
+    """Что и когда клиент «отправил»"""
+
+    __slots__ = ("kind", "chat_id", "msg_id", "text", "file", "ts")
+
+    def __init__(self, kind, chat_id, msg_id, text, file):
+        self.kind = kind  # "message" | "file" | "album" | "edit" | "forward"
+        self.chat_id = chat_id
+        self.msg_id = msg_id
+        self.text = text
+        self.file = file
+        self.ts = time.perf_counter()
+
+
+class FakeClient:
+    """In-process TelegramClient: события подаются через emit(), отправленное копится в sent"""
+
+    def __init__(self, loop=None, latency: float = 0.0, upload_latency: float = 0.0,
+                 flood_rate: float = 0.0, flood_seconds: int = 1, seed: int = 0):
+        self.loop = loop or asyncio.get_event_loop()
+        self.latency = latency                # задержка любого запроса, сек
+        self.upload_latency = upload_latency  # дополнительная задержка отправки медиа
+        self.flood_rate = flood_rate          # вероятность FloodWaitError на запрос отправки
+        self.flood_seconds = flood_seconds
+        self.sent = []
+        self.on_sent = None                   # on_sent(SentRecord) — для замеров задержки
+        self.floods = 0
+        self._handlers = []
+        self._dispatching = set()             # задачи emit(): держим ссылки, пока обработчики не отработают
+        self._history = {}                    # chat_id → [Message] (для get/iter_messages)
+        self.history_limit = 1000             # не даём генератору раздувать память прогона
+        self._next_id = {}
+        self._rng = random.Random(seed)
+
+    # --- события ---
+
+    def on(self, builder):
+        def decorator(callback):
+            self._handlers.append((builder, callback))
+            return callback
+        return decorator
+
+    @staticmethod
+    def _matches(builder, event) -> bool:
+        if type(event) is not type(builder).Event:
+            return False
+        if builder.chats is None:
+            return True
+        chats = {tl_utils.get_peer_id(c) if not isinstance(c, int) else c for c in builder.chats}
+        return (event.chat_id in chats) != builder.blacklist_chats
+
+    async def emit(self, event):
+        """Доставляет событие в отдельной задаче, как Telethon при sequential_updates=False:
+        обработчики одного события идут по очереди, разные события — параллельно"""
+        task = self.loop.create_task(self._dispatch(event))
+        self._dispatching.add(task)
+        task.add_done_callback(self._dispatching.discard)
+        return task
+
+    async def _dispatch(self, event):
+        for builder, callback in self._handlers:
+            if self._matches(builder, event):
+                try:
+                    await callback(event)
+                except events.StopPropagation:
+                    break
+                except Exception:
+                    logging.exception("Unhandled exception on %s", callback.__name__)
+
+    # --- генерация сообщений источника ---
+
+    def _new_id(self, chat_id: int) -> int:
+        msg_id = self._next_id.get(chat_id, 0) + 1
+        self._next_id[chat_id] = msg_id
+        return msg_id
+
+    def make_message(self, chat_id: int, text: str = "", entities=None, media=None, grouped_id=None):
+        peer = tl_utils.resolve_id(chat_id)[0]
+        msg = Message(
+            id=self._new_id(chat_id),
+            peer_id=PeerChannel(peer),
+            date=datetime.now(timezone.utc),
+            message=text,
+            entities=entities,
+            media=media,
+            grouped_id=grouped_id,
+            post=True,
+        )
+        history = self._history.setdefault(chat_id, [])
+        history.append(msg)
+        if len(history) > self.history_limit:
+            del history[: len(history) - self.history_limit]
+        return msg
+
+    def make_media(self, size: int = 200_000):
+        doc_id = self._rng.getrandbits(62)
+        return MessageMediaDocument(document=Document(
+            id=doc_id,
+            access_hash=doc_id ^ 0x5A5A,
+            file_reference=b"ref",
+            date=datetime.now(timezone.utc),
+            mime_type="image/jpeg",
+            size=size,
+            dc_id=2,
+            attributes=[DocumentAttributeFilename(f"{doc_id}.jpg")],
+        ))
+
+    def new_message_event(self, msg):
+        return events.NewMessage.Event(msg)
+
+    def edited_event(self, msg, text: str = None):
+        """Правка msg: событие получает копию, исходный объект (возможно, ещё в очереди) не меняется"""
+        edited = copy.copy(msg)
+        if text is not None:
+            edited.message = text
+        edited.edit_date = datetime.now(timezone.utc)
+        return events.MessageEdited.Event(edited)
+
+    def album_events(self, messages: list) -> list:
+        """Альбом приходит как отдельные NewMessage с общим grouped_id — так же, как от Telegram"""
+        return [events.NewMessage.Event(msg) for msg in messages]
+
+    # --- запросы ---
+
+    @staticmethod
+    def _chat(entity) -> int:
+        return entity if isinstance(entity, int) else tl_utils.get_peer_id(entity)
+
+    async def get_input_entity(self, entity):
+        if not isinstance(entity, int):
+            return entity
+        await self._request()
+        return InputPeerChannel(tl_utils.resolve_id(entity)[0], access_hash=0)
+
+    async def get_dialogs(self, **kwargs):
+        await self._request()
+        return []
+
+    async def _request(self, extra: float = 0.0):
+        if self.latency or extra:
+            await asyncio.sleep(self.latency + extra)
+        if self.flood_rate and self._rng.random() < self.flood_rate:
+            self.floods += 1
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    def _record(self, kind, chat_id, text, file=None, msg_id=None):
+        chat_id = self._chat(chat_id)
+        if msg_id is None:
+            msg_id = self._new_id(chat_id)
+        record = SentRecord(kind, chat_id, msg_id, text, file)
+        self.sent.append(record)
+        if self.on_sent is not None:
+            self.on_sent(record)
+        peer = tl_utils.resolve_id(chat_id)[0]
+        return Message(id=msg_id, peer_id=PeerChannel(peer), date=datetime.now(timezone.utc), message=text or "", media=file)
+
+    async def send_message(self, entity, message="", formatting_entities=None, **kwargs):
+        await self._request()
+        return self._record("message", entity, message)
+
+    async def send_file(self, entity, file, caption=None, formatting_entities=None, **kwargs):
+        if isinstance(file, (list, tuple)):
+            await self._request(self.upload_latency * len(file))
+            first = self._record("album", entity, caption, file)
+            return [first] + [self._record("album_item", entity, None, f) for f in file[1:]]
+        await self._request(self.upload_latency)
+        return self._record("file", entity, caption, file)
+
+    async def edit_message(self, entity, message=None, text=None, formatting_entities=None, file=None, **kwargs):
+        await self._request(self.upload_latency if file is not None else 0.0)
+        return self._record("edit", entity, text, file, msg_id=message)
+
+    async def __call__(self, request):
+        """Сырые запросы: handlers шлют напрямую только ForwardMessagesRequest (forwarder.ForwardBatcher)"""
+        if not isinstance(request, ForwardMessagesRequest):
+            raise TypeError(f"FakeClient does not support raw {type(request).__name__}: only ForwardMessagesRequest")
+        await self._request()
+        history = self._history.get(self._chat(request.from_peer), [])
+        first = history[0].id if history else 0
+        sent = []
+        for msg_id in request.id:
+            # id сообщений источника идут подряд (make_message), поэтому ищем по смещению
+            src = history[msg_id - first] if 0 <= msg_id - first < len(history) else None
+            sent.append(self._record("forward", request.to_peer, src.message if src else None, src.media if src else None)
+                        if src else None)
+        return sent
+
+    def _get_response_message(self, request, result, entity):
+        return result
+
+    async def get_messages(self, entity, limit=1, ids=None, **kwargs):
+        history = self._history.get(self._chat(entity), [])
+        if ids is not None:
+            await self._request()
+            first = history[0].id if history else 0
+            return [history[i - first] if 0 <= i - first < len(history) else None for i in ids]
+        return list(reversed(history[-limit:])) if limit else []
+
+    async def iter_messages(self, entity, min_id=0, limit=None, **kwargs):
+        count = 0
+        for msg in reversed(self._history.get(self._chat(entity), [])):
+            if msg.id <= min_id or (limit is not None and count >= limit):
+                break
+            count += 1
+            yield msg
+
+    async def iter_download(self, media, **kwargs):
+        size = getattr(getattr(media, "document", None), "size", 0) or 0
+        await self._request(self.upload_latency)
+        chunk = b"\0" * min(size, 128 * 1024)
+        while size > 0:
+            yield chunk[:size]
+            size -= len(chunk)
+
+    async def upload_file(self, file, file_size=None, file_name=None, **kwargs):
+        await self._request(self.upload_latency)
+        if file_size and callable(getattr(file, "read", None)):
+            # Как Telethon: читаем частями по 512 KiB, read() может быть корутиной (потоковая передача)
+            left = file_size
+            while left > 0:
+                part = file.read(min(left, 512 * 1024))
+                if asyncio.iscoroutine(part):
+                    part = await part
+                if not part:
+                    break
+                left -= len(part)
+        return InputFile(id=self._rng.getrandbits(62), parts=1, name=file_name or "file", md5_checksum="")
@@ -0,0 +1,117 @@
+# Быстрый путь для сообщений, которые замены не изменили
+# Вместо send_file/send_message — ForwardMessagesRequest с drop_author (копия без «Переслано от»,
+# без скачивания и повторной загрузки). Подряд идущие такие сообщения одного источника в один target
+# собираются в пачку до 100 id и уходят одним запросом. Пачки одного target отправляются строго
+# по очереди; flush(target) ждёт их, чтобы обычная отправка не обогнала уже принятые в пачку посты.
+# add() возвращает Future, который завершается, когда пачка ушла (или её догнал обычный путь).
+
+import asyncio
+import logging
+import contextvars
+from telethon.tl.functions.messages import ForwardMessagesRequest
+
+MAX_BATCH = 100  # лимит id в одном ForwardMessagesRequest
+
+
+class _Batch:
+    __slots__ = ("client", "pair", "groups", "futures", "size", "timer")
+
+    def __init__(self, client, pair):
+        self.client = client
+        self.pair = pair
+        self.groups = []  # [[Message, ...]] — одиночное сообщение или альбом целиком
+        self.futures = []  # по одному на группу
+        self.size = 0
+        self.timer = None
+
+
+class ForwardBatcher:
+    """Копирование пачками через forward с drop_author, по очереди на каждый target"""
+
+    def __init__(self, limiter, linger: float = 0.05, max_batch: int = MAX_BATCH, peers=None,
+                 on_sent=None, on_failed=None):
+        self.limiter = limiter
+        self.peers = peers          # PeerCache: chat_id → InputPeer
+        self.linger = linger        # сколько ждать следующих сообщений, прежде чем отправить пачку
+        self.max_batch = max_batch
+        self.on_sent = on_sent      # on_sent(pair, group, sent_messages)
+        self.on_failed = on_failed  # await on_failed(client, pair, groups, exc) — отправить обычным путём
+        self._pending = {}          # target_id → _Batch
+        self._tail = {}             # target_id → последняя запущенная отправка
+
+    def add(self, client, pair, group: list) -> asyncio.Future:
+        """Ставит сообщение (или альбом) в пачку target; отправка — позже, в фоне"""
+        target = pair.target_id
+        loop = asyncio.get_running_loop()
+        batch = self._pending.get(target)
+        if batch is not None and (batch.pair.source_id != pair.source_id or batch.size + len(group) > self.max_batch):
+            self._start(target)
+            batch = None
+        if batch is None:
+            batch = self._pending[target] = _Batch(client, pair)
+            batch.timer = loop.call_later(self.linger, self._start, target)
+        future = loop.create_future()
+        batch.groups.append(group)
+        batch.futures.append(future)
+        batch.size += len(group)
+        if batch.size >= self.max_batch:
+            self._start(target)
+        return future
+
+    async def flush(self, target):
+        """Отправляет накопленное для target и ждёт окончания всех его отправок"""
+        self._start(target)
+        tail = self._tail.get(target)
+        if tail is not None:
+            await asyncio.shield(tail)
+
+    def _start(self, target):
+        batch = self._pending.pop(target, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        # Пачка живёт дольше задачи воркера, который её начал: в пустом контексте она не унаследует
+        # его слот scheduler (иначе released() отдал бы и взял обратно чужой слот)
+        task = contextvars.Context().run(asyncio.get_running_loop().create_task, self._send(batch, self._tail.get(target)))
+        self._tail[target] = task
+        task.add_done_callback(lambda t: self._tail.get(target) is t and self._tail.pop(target))
+
+    async def _send(self, batch: _Batch, previous):
+        try:
+            await self._send_batch(batch, previous)
+        finally:
+            for future in batch.futures:
+                if not future.done():
+                    future.set_result(None)
+
+    async def _send_batch(self, batch: _Batch, previous):
+        if previous is not None:
+            await asyncio.gather(previous, return_exceptions=True)  # порядок пачек внутри target
+        pair = batch.pair
+        messages = [m for group in batch.groups for m in group]
+        peer = self.peers.get if self.peers is not None else (lambda chat_id: chat_id)
+        to_peer = peer(pair.target_id)
+        request = ForwardMessagesRequest(
+            from_peer=peer(pair.source_id),
+            id=[m.id for m in messages],
+            to_peer=to_peer,
+            drop_author=True,
+        )
+        try:
+            result = await self.limiter.call(pair.target_id, batch.client, request)
+            sent = batch.client._get_response_message(request, result, to_peer)
+        except Exception as e:
+            logging.warning(f"Forward batch {pair.source_id} -> {pair.target_id} ({len(messages)} msgs) failed: {repr(e)}")
+            if self.on_failed is not None:
+                try:
+                    await self.on_failed(batch.client, pair, batch.groups, e)
+                except Exception as e2:
+                    logging.exception(f"Forward fallback failed for {pair.source_id} -> {pair.target_id}: {e2}")
+            return
+        sent = list(sent) if isinstance(sent, (list, tuple)) else [sent]
+        logging.info(f"Forwarded batch {pair.source_id} -> {pair.target_id}: {len(messages)} msgs in one request")
+        if self.on_sent is not None:
+            pos = 0
+            for group in batch.groups:
+                self.on_sent(pair, group, sent[pos:pos + len(group)])
+                pos += len(group)
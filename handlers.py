@@ -1,189 +1,401 @@
-import json
+import os
 import logging
 import asyncio
-import tempfile
-import os
 from telethon import events
-from telethon.errors.rpcerrorlist import MediaEmptyError, FileReferenceExpiredError
+from telethon.errors.rpcerrorlist import (
+    MediaEmptyError,
+    FileReferenceExpiredError,
+    FloodWaitError,
+    MessageNotModifiedError,
+    ChatForwardsRestrictedError,
+    ChannelPrivateError,
+)
 from telethon.tl.types import MessageMediaWebPage, MessageMediaGame
 from utils import (
-    replace_links_everywhere,
-    replace_name_outside_entities,
-    update_entities_with_name_and_url,
+    rewrite_text_and_entities,
     extract_links_from_text_and_entities,
     links_allowed_by_whitelist,
 )
+from pairs import load_pairs
+from dedup import DedupStore, MSG, GROUP
+from scheduler import ShardedScheduler
+from ratelimit import RateLimiter
+from media import MediaTransfer, media_key
+from mediacache import MediaCache, key_name
+from msgmap import MessageMap
+from backfill import Progress, backfill, BackfillMessage, BackfillAlbum
+from journal import Journal, JournalRecord, EDIT, ALBUM, MESSAGE
+from forwarder import ForwardBatcher
+from peers import PeerCache
+from neardup import NearDupIndex
+from imaging import ImageTransformer
+from albums import AlbumAssembler
+import metrics
+from config import (
+    DEDUP_MAX_SIZE, DEDUP_TTL, DEDUP_DB, MSGMAP_MAX_SIZE, WORKER_COUNT, SHARD_QUEUE_SIZE,
+    QUEUE_MAX_AGE, QUEUE_SHED_DEPTH, QUEUE_REPORT_INTERVAL,
+    JOURNAL_PATH, JOURNAL_FSYNC_INTERVAL, JOURNAL_COMPACT_AFTER,
+    ALBUM_IDLE, ALBUM_MAX_WAIT, ALBUM_MAX_GROUPS,
+    RATE_GLOBAL, RATE_GLOBAL_BURST, RATE_TARGET, RATE_TARGET_BURST, FLOOD_MAX_RETRIES,
+    MEDIA_MEMORY_LIMIT, MEDIA_MAX_BYTES, MEDIA_TIMEOUT, MEDIA_CONCURRENCY,
+    MEDIA_CACHE_DIR, MEDIA_CACHE_QUOTA, MEDIA_HANDLE_TTL, IMAGE_WORKERS, IMAGE_CACHE_BYTES,
+    BACKFILL_ENABLED, BACKFILL_MAX_MESSAGES, BACKFILL_MAX_AGE, BACKFILL_CONCURRENCY,
+    METRICS_HOST, METRICS_PORT, CHANNELS_FILE, CHANNELS_RELOAD_INTERVAL,
+    FORWARD_FAST_PATH, FORWARD_BATCH_LINGER, PEER_RESOLVE_CONCURRENCY,
+    NEARDUP_ENABLED, NEARDUP_WINDOW, NEARDUP_MAX_ENTRIES, NEARDUP_DISTANCE, NEARDUP_MIN_TOKENS,
+)
 from logger import content_logger, flood_logger, ad_logger
 
-# Загружаем пары каналов из JSON
-with open("channels.json", "r", encoding="utf-8") as f:
-    CHANNEL_PAIRS = json.load(f)
+# Загружаем и компилируем пары каналов из JSON; при изменении файла они перечитываются (watch_channels)
+CHANNEL_PAIRS = load_pairs(CHANNELS_FILE)
 
-PAIR_BY_SOURCE = {pair["source_id"]: pair for pair in CHANNEL_PAIRS}
-task_queue = asyncio.Queue()
+PAIR_BY_SOURCE = {pair.source_id: pair for pair in CHANNEL_PAIRS}
 
-# Защита от повторной обработки
-processed_ids = set()
-processed_groups = set()  # grouped_id альбомов
+# Заранее разрезолвленные InputPeer всех source/target — отправки не ищут сущности в сессии
+peers = PeerCache(concurrency=PEER_RESOLVE_CONCURRENCY)
 
 
-async def try_send_media_with_fallback(client, target_id, media, caption, entities):
-    """Отправка одного медиа с fallback через временный файл"""
-    try:
-        # Проверка валидности media
-        if not hasattr(media, "document") and not hasattr(media, "photo"):
-            logging.warning(f"Media object is invalid: {repr(media)}")
-            return False
+def pair_chat_ids(pairs) -> list:
+    return [chat_id for pair in pairs for chat_id in (pair.source_id, pair.target_id)]
 
-        await client.send_file(
+
+# Построители событий с фильтром chats= по источникам — Telethon не зовёт обработчики для чужих чатов
+_event_builders = []
+
+
+def set_pairs(pairs: list):
+    """Подменяет набор пар и фильтр источников у обработчиков (без await — атомарно для event loop)"""
+    global CHANNEL_PAIRS, PAIR_BY_SOURCE
+    by_source = {pair.source_id: pair for pair in pairs}
+    added = [source_id for source_id in by_source if source_id not in PAIR_BY_SOURCE]
+    if added:
+        # Пара могла переехать из другого шарда (supervisor.py): его отметки лежат в общей SQLite,
+        # без них правка переотправится дублем, а повтор старого поста не отсеется
+        for store in (dedup, msgmap, progress):
+            try:
+                store.load_chats(added)
+            except Exception as e:
+                logging.error(f"Loading state of {added} into {type(store).__name__} failed: {repr(e)}")
+    CHANNEL_PAIRS = pairs
+    PAIR_BY_SOURCE = by_source
+    for builder in _event_builders:
+        # id уже помечены (-100…), резолвить через сеть нечего
+        builder.chats = set(by_source)
+        builder.resolved = True
+    peers.refresh(i for i in pair_chat_ids(pairs) if i not in peers)
+
+# Защита от повторной обработки: ключи (вид, chat_id, id), ограниченный размер и TTL, SQLite
+dedup = DedupStore(max_size=DEDUP_MAX_SIZE, ttl=DEDUP_TTL, db_path=DEDUP_DB or None)
+
+# Почти-дубликаты одного поста из разных источников в один target (опционально)
+neardup = NearDupIndex(
+    window=NEARDUP_WINDOW,
+    max_entries=NEARDUP_MAX_ENTRIES,
+    distance=NEARDUP_DISTANCE,
+    min_tokens=NEARDUP_MIN_TOKENS,
+) if NEARDUP_ENABLED else None
+
+# Какое сообщение в target соответствует исходному — для правок на месте
+msgmap = MessageMap(max_size=MSGMAP_MAX_SIZE, db_path=DEDUP_DB or None)
+
+# Последний обработанный id каждого источника — с него начинается догонялка после рестарта
+progress = Progress(db_path=DEDUP_DB or None)
+
+# Журнал принятых, но ещё не отправленных задач — после падения они ставятся в очередь снова
+journal = Journal(path=JOURNAL_PATH or None, compact_after=JOURNAL_COMPACT_AFTER)
+
+# Живые события ставятся в очередь только после догонялки, чтобы не обгонять старые посты
+live_ready = asyncio.Event()
+
+# Лимиты отправки: общий на аккаунт и по каждому target, FloodWait ставит на паузу только свой target
+limiter = RateLimiter(
+    global_rate=RATE_GLOBAL,
+    global_burst=RATE_GLOBAL_BURST,
+    target_rate=RATE_TARGET,
+    target_burst=RATE_TARGET_BURST,
+    max_retries=FLOOD_MAX_RETRIES,
+)
+
+# Кэш скачанных медиа (по id и размеру) и ссылок на уже загруженные копии
+media_cache = MediaCache(MEDIA_CACHE_DIR, MEDIA_CACHE_QUOTA, handle_ttl=MEDIA_HANDLE_TTL)
+
+# Преобразование фото для пар с image_transform — в отдельных процессах, event loop не блокируется
+image_transformer = ImageTransformer(workers=IMAGE_WORKERS, cache_bytes=IMAGE_CACHE_BYTES)
+
+# Fallback-передача медиа: маленькие файлы в памяти, альбомы параллельно, бюджет по размеру и времени
+media_transfer = MediaTransfer(
+    memory_limit=MEDIA_MEMORY_LIMIT,
+    max_bytes=MEDIA_MAX_BYTES,
+    timeout=MEDIA_TIMEOUT,
+    concurrency=MEDIA_CONCURRENCY,
+    cache=media_cache,
+    transformer=image_transformer,
+)
+
+
+def media_key_str(media) -> str:
+    key = media_key(media)
+    return key_name(key) if key else ""
+
+
+def remember_sent(src_msg, target_id, sent, media):
+    """Запоминает, какое сообщение в target соответствует исходному"""
+    sent_id = getattr(sent, "id", None)
+    if sent_id is not None:
+        msgmap.put(src_msg.chat_id, src_msg.id, target_id, sent_id, media_key_str(media) if media else "")
+
+
+def find_disallowed(pair, messages) -> set:
+    """Ссылки из всех messages, которых нет в white_list пары (пустое множество — можно отправлять)"""
+    with metrics.WHITELIST_SECONDS.time(pair.source_id, pair.target_id):
+        found_links = set()
+        for msg in messages:
+            found_links |= extract_links_from_text_and_entities(
+                msg.message or "",
+                msg.entities or [],
+                media=msg.media,
+                reply_markup=getattr(msg, "reply_markup", None),
+            )
+        if not found_links:
+            return set()
+        allowed_all, disallowed = links_allowed_by_whitelist(found_links, pair.whitelist)
+    if disallowed:
+        metrics.BLOCKED.inc(pair.source_id, pair.target_id)
+    return disallowed
+
+
+def rewrite(text, entities, pair):
+    with metrics.REWRITE_SECONDS.time(pair.source_id, pair.target_id):
+        return rewrite_text_and_entities(text, entities, pair)
+
+
+async def try_send_media_with_fallback(client, pair, media, caption, entities):
+    """Отправка одного медиа с fallback через скачивание и повторную загрузку.
+    Возвращает отправленное сообщение или None"""
+    target_id = pair.target_id
+    # Проверка валидности media
+    if not hasattr(media, "document") and not hasattr(media, "photo"):
+        logging.warning(f"Media object is invalid: {repr(media)}")
+        return None
+
+    async def send(file):
+        return await limiter.call(
             target_id,
-            media,
+            client.send_file,
+            peers.get(target_id),
+            file,
             caption=caption if caption else None,
             formatting_entities=entities if entities else None,
         )
-        return True
+
+    # Фото, которое нужно преобразовать, нельзя отправить по ссылке на оригинал — сразу через загрузку;
+    # если преобразование не удалось, уходит оригинал
+    if media_transfer.transforms(media, pair.image_transform):
+        try:
+            with metrics.FALLBACK_SECONDS.time(pair.source_id, target_id):
+                return await media_transfer.send(client, media, send, pair.image_transform)
+        except FloodWaitError:
+            raise
+        except Exception as e:
+            logging.warning(f"Image transform send failed ({type(e).__name__}): {e}; sending original media")
+
+    try:
+        with metrics.MEDIA_SEND_SECONDS.time(pair.source_id, target_id):
+            return await send(media)
+    except FloodWaitError:
+        # Повторы исчерпаны — fallback через скачивание тоже упрётся в лимит
+        raise
     except (MediaEmptyError, FileReferenceExpiredError) as e:
         logging.warning(f"send_file initial failed ({type(e).__name__}): {e}; trying download+send fallback")
     except Exception as e:
         logging.warning(f"send_file initial exception: {repr(e)}; trying download+send fallback")
 
-    tmp_path = None
     try:
-        with tempfile.NamedTemporaryFile(delete=False) as tf:
-            tmp_path = tf.name
-        await client.download_media(media, file=tmp_path)
-        await client.send_file(
-            target_id,
-            tmp_path,
-            caption=caption if caption else None,
-            formatting_entities=entities if entities else None,
-        )
-        return True
+        with metrics.FALLBACK_SECONDS.time(pair.source_id, target_id):
+            return await media_transfer.send(client, media, send)
+    except FloodWaitError:
+        raise
     except Exception as e:
         logging.error(f"Fallback download+send failed: {repr(e)}")
-        return False
-    finally:
-        try:
-            if tmp_path and os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except Exception:
-            pass
+        return None
 
 
-async def try_send_album_with_fallback(client, target_id, medias, caption, entities):
-    """Отправка альбома списком medias; при ошибке — скачиваем каждый и шлём локальными файлами"""
-    try:
-        await client.send_file(
+async def try_send_album_with_fallback(client, pair, medias, caption, entities):
+    """Отправка альбома списком medias; при ошибке — параллельно скачиваем и загружаем элементы заново.
+    Возвращает список отправленных сообщений или None"""
+    target_id = pair.target_id
+
+    async def send(files):
+        return await limiter.call(
             target_id,
-            medias,
+            client.send_file,
+            peers.get(target_id),
+            files,
             caption=caption if caption else None,
             formatting_entities=entities if entities else None,
         )
-        return True
+
+    valid = []
+    for m in medias:
+        if not hasattr(m, "document") and not hasattr(m, "photo"):
+            logging.warning(f"Invalid album media item: {repr(m)}")
+            continue
+        valid.append(m)
+
+    # Элементы с неудавшимся преобразованием send_album сам заменяет оригиналами; сюда доходят
+    # только ошибки всей отправки — тогда альбом уходит как есть
+    if any(media_transfer.transforms(m, pair.image_transform) for m in valid):
+        try:
+            with metrics.FALLBACK_SECONDS.time(pair.source_id, target_id):
+                sent = await media_transfer.send_album(client, valid, send, pair.image_transform)
+            if sent is not None:
+                return sent
+        except FloodWaitError:
+            raise
+        except Exception as e:
+            logging.warning(f"Album image transform send failed ({type(e).__name__}): {e}; sending original media")
+
+    try:
+        with metrics.MEDIA_SEND_SECONDS.time(pair.source_id, target_id):
+            return await send(medias)
+    except FloodWaitError:
+        raise
     except Exception as e:
-        logging.warning(f"Album send_file failed: {repr(e)}; trying file-path fallback")
+        logging.warning(f"Album send_file failed: {repr(e)}; trying reupload fallback")
 
-    tmp_paths = []
     try:
-        for m in medias:
-            if not hasattr(m, "document") and not hasattr(m, "photo"):
-                logging.warning(f"Invalid album media item: {repr(m)}")
-                continue
-            tf = tempfile.NamedTemporaryFile(delete=False)
-            tf.close()
-            await client.download_media(m, file=tf.name)
-            tmp_paths.append(tf.name)
-
-        if not tmp_paths:
+        with metrics.FALLBACK_SECONDS.time(pair.source_id, target_id):
+            sent = await media_transfer.send_album(client, valid, send)
+        if sent is None:
             logging.error("Album fallback: no valid media downloaded")
-            return False
-
-        await client.send_file(
-            target_id,
-            tmp_paths,
-            caption=caption if caption else None,
-            formatting_entities=entities if entities else None,
-        )
-        return True
+        return sent
+    except FloodWaitError:
+        raise
     except Exception as e:
         logging.error(f"Album fallback failed: {repr(e)}")
+        return None
+
+
+def is_near_duplicate(pair, text, messages) -> bool:
+    """Тот же пост (текст после замен + медиа) уже ушёл в target из другого источника"""
+    if neardup is None:
         return False
-    finally:
-        for p in tmp_paths:
-            try:
-                if p and os.path.exists(p):
-                    os.remove(p)
-            except Exception:
-                pass
+    media_keys = [media_key(m.media) for m in messages if m.media]
+    if not neardup.check(pair.target_id, text, media_keys):
+        return False
+    metrics.NEAR_DUPLICATES.inc(pair.source_id, pair.target_id)
+    logging.info(f"Skipped near-duplicate {pair.source_id} -> {pair.target_id} (msgs {[m.id for m in messages]})")
+    return True
+
+
+def remember_near_duplicate(pair, text, messages):
+    """Отпечаток поста — сразу при приёме: копия из другого источника, пришедшая, пока пост лежит в пачке
+    forward или отправляется, уже будет дублем. Неудачная отправка снимает его (forget_near_duplicate)"""
+    if neardup is not None:
+        neardup.add(pair.target_id, text, [media_key(m.media) for m in messages if m.media])
+
+
+def forget_near_duplicate(pair, text, messages):
+    """Пост не ушёл — иначе его повтор из другого источника считался бы дублем"""
+    if neardup is not None:
+        neardup.discard(pair.target_id, text, [media_key(m.media) for m in messages if m.media])
+
+
+def unchanged(text, ents, original_text, entities) -> bool:
+    """Замены ничего не изменили: rewrite возвращает исходные объекты entities, если их не трогал"""
+    return text == original_text and len(ents) == len(entities) and all(a is b for a, b in zip(ents, entities))
+
+
+def can_forward(pair, messages) -> bool:
+    """Быстрый путь forward: фото, которые пара преобразует (image_transform), пересылкой не отправить"""
+    return (
+        FORWARD_FAST_PATH
+        and pair.source_id not in forward_restricted
+        and not any(media_transfer.transforms(m.media, pair.image_transform) for m in messages)
+    )
 
 
 async def process_message(client, msg, pair):
     """Обработка одиночного сообщения"""
-    # Игнорируем сообщения, являющиеся частью альбома — их обработает Album()
+    # Игнорируем сообщения, являющиеся частью альбома — их соберёт AlbumAssembler
     if getattr(msg, "grouped_id", None):
         logging.info(f"Skip single item of album id={msg.grouped_id} msg_id={msg.id}")
         return
 
-    if msg.id in processed_ids:
-        logging.info(f"Skipped duplicate msg {msg.id}")
+    if not dedup.check_and_add((MSG, msg.chat_id, msg.id)):
+        logging.info(f"Skipped duplicate msg chat={msg.chat_id} id={msg.id}")
         return
-    processed_ids.add(msg.id)
 
     original_text = msg.message or ""
     entities = msg.entities or []
-    target_id = pair["target_id"]
 
-    logging.info(f"Incoming msg chat={msg.chat_id} id={msg.id} from source={pair['source_id']}")
-    flood_logger.info(f"Обработка: chat={msg.chat_id} id={msg.id} text={original_text}")
+    logging.info(f"Incoming msg chat={msg.chat_id} id={msg.id} from source={pair.source_id}")
+    # Аргументы через %, а не f-строкой: при выключенном уровне или сэмплинге текст поста не форматируется
+    flood_logger.info("Обработка: chat=%s id=%s text=%s", msg.chat_id, msg.id, original_text)
 
     # --- Проверка white_list ---
-    whitelist = pair.get("white_list") or []
-    found_links = extract_links_from_text_and_entities(
-        original_text,
-        entities,
-        media=msg.media,
-        reply_markup=getattr(msg, "reply_markup", None),
-    )
-    if found_links:
-        allowed_all, disallowed = links_allowed_by_whitelist(found_links, whitelist)
-        if not allowed_all:
-            for bad in sorted(disallowed):
-                ad_logger.info(f"{bad} | source={pair.get('source_id')} | msg={msg.id}")
-            return
+    disallowed = find_disallowed(pair, [msg])
+    if disallowed:
+        for bad in sorted(disallowed):
+            ad_logger.info(f"{bad} | source={pair.source_id} | msg={msg.id}")
+        return
 
-    mappings = pair.get("link_mappings") or []
-    src_name = pair.get("source_name")
-    tgt_name = pair.get("target_name")
+    text, ents = rewrite(original_text, entities, pair)
+
+    if is_near_duplicate(pair, text, [msg]):
+        return
+    remember_near_duplicate(pair, text, [msg])
 
-    text = original_text
-    ents = entities
+    # Замены ничего не поменяли — копируем пересылкой без автора, без повторной загрузки
+    if can_forward(pair, [msg]) and unchanged(text, ents, original_text, entities):
+        return forwarder.add(client, pair, [msg])
 
-    if mappings:
-        text, ents = update_entities_with_name_and_url(text, ents, mappings, src_name, tgt_name)
-        text, ents = replace_links_everywhere(text, ents, mappings)
+    await forwarder.flush(pair.target_id)
+    await send_copy(client, pair, msg, text, ents)
 
-    text = replace_name_outside_entities(text, ents, src_name, tgt_name)
 
+async def send_copy(client, pair, msg, text, ents):
+    """Отправка одиночного сообщения заново (send_file / send_message); отпечаток поста уже запомнен при приёме"""
+    target_id = pair.target_id
     unsupported_media = (MessageMediaWebPage, MessageMediaGame)
     media = msg.media
     has_supported_media = media is not None and not isinstance(media, unsupported_media)
 
-    if has_supported_media:
-        caption = text if text and text.strip() else None
-        sent_ok = await try_send_media_with_fallback(client, target_id, media, caption, ents)
-        if sent_ok:
-            logging.info(f"Forwarded with media {pair['source_id']} -> {pair['target_id']} (msg {msg.id})")
+    try:
+        if has_supported_media:
+            caption = text if text and text.strip() else None
+            sent = await try_send_media_with_fallback(client, pair, media, caption, ents)
+            if sent:
+                remember_sent(msg, target_id, sent, media)
+                metrics.FORWARDED.inc(pair.source_id, target_id)
+                logging.info(f"Forwarded with media {pair.source_id} -> {pair.target_id} (msg {msg.id})")
+            else:
+                safe_text = text if text is not None else ""
+                sent = await limiter.call(target_id, client.send_message, peers.get(target_id), safe_text, formatting_entities=ents if ents else None)
+                remember_sent(msg, target_id, sent, None)
+                forget_near_duplicate(pair, text, [msg])  # ушёл только текст — сам пост с медиа так и не отправлен
+                metrics.FALLBACK_TEXT.inc(pair.source_id, target_id)
+                logging.info(f"Fallback: text instead of media {pair.source_id} -> {pair.target_id} (msg {msg.id})")
         else:
             safe_text = text if text is not None else ""
-            await client.send_message(target_id, safe_text, formatting_entities=ents if ents else None)
-            logging.info(f"Fallback: text instead of media {pair['source_id']} -> {pair['target_id']} (msg {msg.id})")
-    else:
-        safe_text = text if text is not None else ""
-        await client.send_message(target_id, safe_text, formatting_entities=ents if ents else None)
-        logging.info(f"Forwarded text {pair['source_id']} -> {pair['target_id']} (msg {msg.id})")
+            sent = await limiter.call(target_id, client.send_message, peers.get(target_id), safe_text, formatting_entities=ents if ents else None)
+            remember_sent(msg, target_id, sent, None)
+            metrics.FORWARDED.inc(pair.source_id, target_id)
+            logging.info(f"Forwarded text {pair.source_id} -> {pair.target_id} (msg {msg.id})")
+    except Exception:
+        forget_near_duplicate(pair, text, [msg])
+        raise
 
     if text:
-        content_logger.info(f"Содержимое: {text}")
+        content_logger.info("Содержимое: %s", text)
+
+
+def album_caption(messages):
+    """Единая подпись альбома — первый непустой текст среди элементов"""
+    for msg in messages:
+        if (msg.message or "").strip():
+            return msg.message, msg.entities or []
+    return "", []
 
 
 async def process_album(client, event, pair):
@@ -196,132 +408,440 @@ async def process_album(client, event, pair):
     except Exception:
         group_id = None
 
-    if group_id and group_id in processed_groups:
+    chat_id = event.chat_id
+    # Досылка опоздавших элементов (part > 0) идёт с grouped_id уже отданного альбома — её отсеивают только id
+    if group_id and not getattr(event, "part", 0) and not dedup.check_and_add((GROUP, chat_id, group_id)):
         logging.info(f"Skipped duplicate album grouped_id={group_id}")
         return
-    if group_id:
-        processed_groups.add(group_id)
 
     album_ids = [msg.id for msg in event.messages]
-    if any(mid in processed_ids for mid in album_ids):
+    if any((MSG, chat_id, mid) in dedup for mid in album_ids):
         logging.info(f"Skipped duplicate album items {album_ids}")
         return
-    processed_ids.update(album_ids)
-
-    # Собираем медиа и единую подпись
-    medias = []
-    caption = None
-    entities = None
+    dedup.add_many((MSG, chat_id, mid) for mid in album_ids)
 
-    for msg in event.messages:
-        if msg.media:
-            medias.append(msg.media)
-        if not caption and (msg.message or "").strip():
-            caption = msg.message
-            entities = msg.entities
+    caption, entities = album_caption(event.messages)
 
-    caption = caption or ""
-    ents = entities or []
-
-    flood_logger.info(f"Альбом: chat={event.chat_id} group={group_id} ids={album_ids} caption={caption}")
+    flood_logger.info("Альбом: chat=%s group=%s ids=%s caption=%s", event.chat_id, group_id, album_ids, caption)
 
     # --- Проверка white_list на уровне альбома (агрегация ссылок со всех элементов) ---
-    whitelist = pair.get("white_list") or []
-    aggregated_links = set()
-    for msg in event.messages:
-        aggregated_links |= extract_links_from_text_and_entities(
-            msg.message or "",
-            msg.entities or [],
-            media=msg.media,
-            reply_markup=getattr(msg, "reply_markup", None),
-        )
-    if aggregated_links:
-        allowed_all, disallowed = links_allowed_by_whitelist(aggregated_links, whitelist)
-        if not allowed_all:
-            for bad in sorted(disallowed):
-                ad_logger.info(f"{bad} | source={pair.get('source_id')} | album_ids={album_ids}")
-            return
+    disallowed = find_disallowed(pair, event.messages)
+    if disallowed:
+        for bad in sorted(disallowed):
+            ad_logger.info(f"{bad} | source={pair.source_id} | album_ids={album_ids}")
+        return
 
     # Замены по маппингам
-    mappings = pair.get("link_mappings") or []
-    src_name = pair.get("source_name")
-    tgt_name = pair.get("target_name")
+    text, ents = rewrite(caption, entities, pair)
 
-    text = caption
-    if mappings:
-        text, ents = update_entities_with_name_and_url(text, ents, mappings, src_name, tgt_name)
-        text, ents = replace_links_everywhere(text, ents, mappings)
+    if is_near_duplicate(pair, text, event.messages):
+        return
+    remember_near_duplicate(pair, text, event.messages)
 
-    text = replace_name_outside_entities(text, ents, src_name, tgt_name)
+    # Подпись не изменилась — альбом целиком пересылается без автора, группировка сохраняется
+    if can_forward(pair, event.messages) and unchanged(text, ents, caption, entities):
+        return forwarder.add(client, pair, list(event.messages))
 
-    # Отправка альбома одним постом (с fallback)
-    sent_ok = await try_send_album_with_fallback(client, pair["target_id"], medias, text if text.strip() else None, ents if ents else None)
-    if sent_ok:
-        logging.info(f"Forwarded album {pair['source_id']} -> {pair['target_id']} (count={len(medias)})")
-    else:
-        logging.exception(f"Error forwarding album {pair['source_id']} -> {pair['target_id']} (group={group_id})")
+    await forwarder.flush(pair.target_id)
+    await send_album_copy(client, pair, event.messages, text, ents)
 
 
-async def worker(client):
-    while True:
-        pair, event = await task_queue.get()
+async def send_album_copy(client, pair, messages, text, ents):
+    """Отправка альбома заново одним постом (с fallback); отпечаток поста уже запомнен при приёме"""
+    media_msgs = [msg for msg in messages if msg.media]
+    medias = [msg.media for msg in media_msgs]
+    try:
+        sent = await try_send_album_with_fallback(client, pair, medias, text if text.strip() else None, ents if ents else None)
+    except Exception:
+        forget_near_duplicate(pair, text, messages)
+        raise
+    if sent:
+        # Элементы альбома сопоставляются по порядку; если fallback что-то пропустил — порядок не гарантирован
+        if isinstance(sent, list) and len(sent) == len(media_msgs):
+            for src, dst in zip(media_msgs, sent):
+                remember_sent(src, pair.target_id, dst, src.media)
+        metrics.FORWARDED.inc(pair.source_id, pair.target_id)
+        logging.info(f"Forwarded album {pair.source_id} -> {pair.target_id} (count={len(medias)})")
+    else:
+        forget_near_duplicate(pair, text, messages)
+        group_id = getattr(messages[0], "grouped_id", None) if messages else None
+        logging.exception(f"Error forwarding album {pair.source_id} -> {pair.target_id} (group={group_id})")
+
+
+def on_forwarded(pair, group, sent):
+    """Пачка forward дошла: запоминаем соответствие id для правок"""
+    for src, dst in zip(group, sent):
+        remember_sent(src, pair.target_id, dst, src.media)
+    metrics.FORWARDED.inc(pair.source_id, pair.target_id)
+    metrics.FAST_PATH.inc(pair.source_id, pair.target_id)
+    text = album_caption(group)[0]
+    if text:
+        content_logger.info("Содержимое: %s", text)
 
-        # Защита от переполнения памяти в processed-структурах
-        if len(processed_ids) > 100_000:
-            processed_ids.clear()
-        if len(processed_groups) > 50_000:
-            processed_groups.clear()
 
+async def on_forward_failed(client, pair, groups, exc):
+    """Forward не прошёл — отправляем те же сообщения обычным путём, в том же порядке.
+    Отпечатки постов остаются занятыми: send_copy / send_album_copy снимут их, если не уйдёт и копия"""
+    if isinstance(exc, ChatForwardsRestrictedError):
+        # В источнике запрещено копирование — дальше для него только обычная отправка
+        forward_restricted.add(pair.source_id)
+        logging.warning(f"Source {pair.source_id} restricts forwarding; fast path disabled for it")
+    for i, group in enumerate(groups):
         try:
-            if hasattr(event, "messages"):  # Album
-                await process_album(client, event, pair)
+            if len(group) > 1 or getattr(group[0], "grouped_id", None):
+                caption, entities = album_caption(group)
+                await send_album_copy(client, pair, group, caption, entities)
             else:
-                await process_message(client, event.message, pair)
-        except Exception as e:
-            logging.exception(f"Error forwarding from {pair.get('source_id')} to {pair.get('target_id')}: {e}")
-        finally:
-            task_queue.task_done()
+                await send_copy(client, pair, group[0], group[0].message or "", group[0].entities or [])
+        except Exception:
+            for rest in groups[i + 1:]:
+                forget_near_duplicate(pair, album_caption(rest)[0], rest)  # до этих постов отправка не дошла
+            raise
+
+
+# Источники с запретом пересылки (noforwards) — для них быстрый путь не используется
+forward_restricted = set()
+
+forwarder = ForwardBatcher(
+    limiter, linger=FORWARD_BATCH_LINGER, peers=peers, on_sent=on_forwarded, on_failed=on_forward_failed
+)
+
+
+async def process_edit(client, msg, pair):
+    """Правка в источнике: редактируем уже отправленную копию, медиа перезаливаем только если оно сменилось"""
+    await forwarder.flush(pair.target_id)  # оригинал мог ещё лежать в пачке forward
+    mapped = msgmap.get(msg.chat_id, msg.id)
+    if mapped is None:
+        if getattr(msg, "grouped_id", None) or (MSG, msg.chat_id, msg.id) in dedup:
+            logging.info(f"Skip edit of unmapped msg chat={msg.chat_id} id={msg.id}")
+            return
+        # Правка пришла раньше самого сообщения — обрабатываем как новое
+        return await process_message(client, msg, pair)
+    target_chat, target_msg_id, old_media = mapped
+
+    original_text = msg.message or ""
+    entities = msg.entities or []
+    disallowed = find_disallowed(pair, [msg])
+    if disallowed:
+        for bad in sorted(disallowed):
+            ad_logger.info(f"{bad} | source={pair.source_id} | edit msg={msg.id}")
+        return
+
+    text, ents = rewrite(original_text, entities, pair)
+
+    media = msg.media
+    has_supported_media = media is not None and not isinstance(media, (MessageMediaWebPage, MessageMediaGame))
+    new_media = media_key_str(media) if has_supported_media else ""
+    file = media if has_supported_media and new_media != old_media else None
+
+    async def edit(f):
+        return await limiter.call(
+            target_chat,
+            client.edit_message,
+            peers.get(target_chat),
+            target_msg_id,
+            text,
+            formatting_entities=ents if ents else None,
+            file=f,
+        )
+
+    try:
+        if file is None:
+            await edit(None)
+        else:
+            try:
+                await edit(file)
+            except (MediaEmptyError, FileReferenceExpiredError) as e:
+                logging.warning(f"edit_message with media failed ({type(e).__name__}); reuploading")
+                await edit(await media_transfer.reupload(client, media))
+    except MessageNotModifiedError:
+        pass
+    msgmap.put(msg.chat_id, msg.id, target_chat, target_msg_id, new_media if file is not None else old_media)
+    logging.info(f"Edited {pair.source_id} -> {target_chat} (msg {msg.id} -> {target_msg_id}, media changed={file is not None})")
+
+
+def journal_record(event) -> JournalRecord:
+    """Запись журнала для события очереди"""
+    if isinstance(event, events.MessageEdited.Event):
+        return JournalRecord(EDIT, event.message.chat_id, None, [event.message.id])
+    if hasattr(event, "messages"):  # Album
+        first = event.messages[0]
+        return JournalRecord(ALBUM, first.chat_id, first.grouped_id, [m.id for m in event.messages])
+    return JournalRecord(MESSAGE, event.message.chat_id, None, [event.message.id])
+
+
+async def handle_task(task):
+    client, pair, event = task
+    edited = isinstance(event, events.MessageEdited.Event)
+    batched = None  # Future, если пост ушёл в пачку forward и отправится позже
+    try:
+        if hasattr(event, "messages"):  # Album
+            batched = await process_album(client, event, pair)
+        elif edited:
+            batched = await process_edit(client, event.message, pair)
+        else:
+            batched = await process_message(client, event.message, pair)
+    except Exception as e:
+        if isinstance(e, ChannelPrivateError):
+            peers.refresh([pair.source_id, pair.target_id])
+        metrics.ERRORS.inc(pair.source_id, pair.target_id)
+        logging.exception(f"Error forwarding from {pair.source_id} to {pair.target_id}: {e}")
+
+    # Запись журнала закрывается, когда отправка закончилась (в том числе с ошибкой — повтор её не исправит)
+    key = journal_record(event).key
+    if batched is not None:
+        batched.add_done_callback(lambda _: journal.done(key))
+    else:
+        journal.done(key)
+    if edited:
+        return
+
+    # Ошибка отправки не должна зацикливать догонялку — id всё равно продвигаем
+    messages = event.messages if hasattr(event, "messages") else [event.message]
+    progress.advance(pair.source_id, max(m.id for m in messages))
+
+
+def on_task_dropped(target, task, reason: str):
+    """Задача выброшена из очереди (просрочена, сброшена или заменена более новой правкой)"""
+    client, pair, event = task
+    metrics.DROPPED.inc(target, reason)
+    journal.done(journal_record(event).key)
+    if hasattr(event, "messages"):
+        messages = event.messages
+    else:
+        messages = [event.message]
+    logging.warning(f"Dropped queued {type(event).__name__} {pair.source_id} -> {target} ids={[m.id for m in messages]}: {reason}")
+    if not isinstance(event, events.MessageEdited.Event):
+        progress.advance(pair.source_id, max(m.id for m in messages))
+
+
+# Очереди по target_id: порядок внутри target сохраняется, разные target идут параллельно,
+# первыми — target с большим priority пары и ближайшим дедлайном
+scheduler = ShardedScheduler(
+    handle_task,
+    worker_count=WORKER_COUNT,
+    shard_size=SHARD_QUEUE_SIZE,
+    on_wait=lambda target, seconds: metrics.ENQUEUE_WAIT.observe(seconds, target),
+    on_drop=on_task_dropped,
+    shed_depth=QUEUE_SHED_DEPTH,
+    report_interval=QUEUE_REPORT_INTERVAL,
+    # Target на паузе FloodWait не занимает воркеры: ни новые задачи, ни та, что ждёт повтора
+    paused=limiter.paused_for,
+)
+limiter.idle = scheduler.released
+
 
+async def enqueue(client, pair, event):
+    """Ставит событие в очередь target с приоритетом пары, сроком годности и ценностью при сбросе"""
+    record = journal_record(event)
+    journal.add(record.kind, record.chat_id, record.ids, record.grouped_id)
 
-def register_handlers(client, worker_count: int = 3):
-    @client.on(events.NewMessage())
+    edited = isinstance(event, events.MessageEdited.Event)
+    if hasattr(event, "messages"):  # Album
+        msg = event.messages[0]
+    else:
+        msg = event.message
+    posted = (msg.edit_date if edited else None) or msg.date
+
+    max_age = pair.max_age if pair.max_age is not None else QUEUE_MAX_AGE
+    deadline = posted.timestamp() + max_age if max_age and posted else None
+
+    # При сбросе первыми уходят текстовые посты, затем правки; медиа и альбомы не сбрасываются (только по сроку)
+    if edited:
+        shed_rank = 1
+    elif hasattr(event, "messages") or msg.media:
+        shed_rank = None
+    else:
+        shed_rank = 2
+
+    await scheduler.submit(
+        pair.target_id,
+        (client, pair, event),
+        priority=pair.priority,
+        posted=posted.timestamp() if posted else None,
+        deadline=deadline,
+        shed_rank=shed_rank,
+        # Из нескольких правок одного поста, ждущих в очереди, выполняется только последняя
+        coalesce_key=("edit", msg.chat_id, msg.id) if edited else None,
+    )
+
+metrics.registry.gauge("copier_queue_depth", "Tasks waiting per target queue", scheduler.shard_sizes, ("target",))
+metrics.registry.gauge("copier_dedup_keys", "Keys held by the dedup store", lambda: len(dedup))
+
+
+def _builder(event_type):
+    builder = event_type(chats=list(PAIR_BY_SOURCE))
+    _event_builders.append(builder)
+    return builder
+
+
+def register_handlers(client, worker_count: int = None):
+    async def on_album(album):
+        pair = PAIR_BY_SOURCE.get(album.chat_id)
+        if not pair:
+            logging.debug(f"Skipped album from chat={album.chat_id}")
+            return
+        metrics.ALBUM_WAIT.observe(album.waited, album.reason)
+        await live_ready.wait()
+        await enqueue(client, pair, album)
+        logging.info(f"Enqueued album from {pair.source_id} with {len(album.messages)} items ({album.reason} after {album.waited * 1000:.0f} ms)")
+
+    # Альбомы собираем сами из NewMessage: готовый альбом уходит в очередь без фиксированной паузы events.Album
+    albums = AlbumAssembler(on_album, idle=ALBUM_IDLE, max_wait=ALBUM_MAX_WAIT, max_groups=ALBUM_MAX_GROUPS)
+    metrics.registry.gauge("copier_album_groups_pending", "Albums still being assembled", lambda: len(albums))
+
+    @client.on(_builder(events.NewMessage))
     async def on_new_message(event):
         pair = PAIR_BY_SOURCE.get(event.chat_id)
         if not pair:
             logging.debug(f"Skipped NewMessage from chat={event.chat_id} id={event.message.id}")
             return
 
-        # Если это элемент альбома — ждём Album() и не обрабатываем как одиночное
+        # Элемент альбома — в сборщик; обычное сообщение сначала закрывает альбом, собираемый в этом чате
         if getattr(event.message, "grouped_id", None):
-            logging.info(f"Detected album item grouped_id={event.message.grouped_id} msg_id={event.message.id} — waiting for Album event")
+            await albums.add(event.message)
             return
+        async with albums.ordered(event.chat_id, flush=True):
+            await live_ready.wait()
+            await enqueue(client, pair, event)
+        logging.info(f"Enqueued message from {pair.source_id} id={event.message.id}")
 
-        await task_queue.put((pair, event))
-        logging.info(f"Enqueued message from {pair['source_id']} id={event.message.id}")
-
-    @client.on(events.MessageEdited())
+    @client.on(_builder(events.MessageEdited))
     async def on_message_edited(event):
         pair = PAIR_BY_SOURCE.get(event.chat_id)
         if not pair:
             logging.debug(f"Skipped MessageEdited from chat={event.chat_id} id={event.message.id}")
             return
 
-        # Если правка касается элемента альбома — пропускаем (альбом уже отправлен)
-        if getattr(event.message, "grouped_id", None):
-            logging.info(f"Skip edit of album item grouped_id={event.message.grouped_id} msg_id={event.message.id}")
-            return
+        # Правка не должна обогнать сам пост, ждущий в очереди чата за альбомом
+        async with albums.ordered(event.chat_id):
+            await live_ready.wait()
+            await enqueue(client, pair, event)
+        logging.info(f"Enqueued edited message from {pair.source_id} id={event.message.id}")
+
+    dedup.load()
+    msgmap.load()
+    progress.load()
+    journal.load()
+    media_cache.scan()
+    if not image_transformer.available and any(pair.image_transform for pair in CHANNEL_PAIRS):
+        logging.warning("image_transform is set in channels.json, but Pillow is missing or IMAGE_WORKERS=0: photos are sent as is")
+    client.loop.create_task(dedup.run_flusher())
+    client.loop.create_task(msgmap.run_flusher())
+    client.loop.create_task(progress.run_flusher())
+    client.loop.create_task(journal.run_flusher(JOURNAL_FSYNC_INTERVAL))
+    client.loop.create_task(metrics.serve(METRICS_HOST, METRICS_PORT))
+    client.loop.create_task(watch_channels())
+
+    if worker_count:
+        scheduler.worker_count = worker_count
+    scheduler.start(client.loop)
+
+
+async def watch_channels(path: str = CHANNELS_FILE, interval: float = CHANNELS_RELOAD_INTERVAL):
+    """Следит за channels.json по mtime и перекомпилирует пары без рестарта; битый файл не применяется"""
+    if not interval:
+        return
 
-        await task_queue.put((pair, event))
-        logging.info(f"Enqueued edited message from {pair['source_id']} id={event.message.id}")
+    def stamp():
+        try:
+            st = os.stat(path)
+            return st.st_mtime_ns, st.st_size
+        except OSError:
+            return None
 
-    @client.on(events.Album())
-    async def on_album(event):
-        pair = PAIR_BY_SOURCE.get(event.chat_id)
-        if not pair:
-            logging.debug(f"Skipped Album from chat={event.chat_id}")
-            return
-        await task_queue.put((pair, event))
-        logging.info(f"Enqueued album from {pair['source_id']} with {len(event.messages)} items")
+    last = stamp()
+    while True:
+        await asyncio.sleep(interval)
+        current = stamp()
+        if current is None or current == last:
+            continue
+        last = current
+        try:
+            pairs = await asyncio.to_thread(load_pairs, path)
+        except Exception as e:
+            logging.error(f"Reload of {path} failed, keeping {len(CHANNEL_PAIRS)} pairs: {repr(e)}")
+            continue
+        old = set(PAIR_BY_SOURCE)
+        set_pairs(pairs)
+        new = set(PAIR_BY_SOURCE)
+        logging.info(f"Reloaded {path}: {len(pairs)} pairs (added {sorted(new - old)}, removed {sorted(old - new)})")
+
+
+async def warm_peers(client):
+    """Резолвит InputPeer всех пар до первой отправки"""
+    await peers.warm(client, pair_chat_ids(CHANNEL_PAIRS))
 
-    for _ in range(worker_count):
-        client.loop.create_task(worker(client))
+
+async def run_backfill(client):
+    """Догоняет пропущенное за время простоя, затем открывает очередь для живых событий"""
+    try:
+        await recover_journal(client)
+        if BACKFILL_ENABLED:
+            async def submit(pair, item):
+                await enqueue(client, pair, item)
+
+            await backfill(
+                client,
+                CHANNEL_PAIRS,
+                progress,
+                submit,
+                max_messages=BACKFILL_MAX_MESSAGES,
+                max_age=BACKFILL_MAX_AGE,
+                concurrency=BACKFILL_CONCURRENCY,
+                peers=peers,
+            )
+    finally:
+        live_ready.set()
+
+
+async def recover_journal(client):
+    """Снова ставит в очередь задачи из журнала, не отправленные до остановки; сообщения перечитываются по id"""
+    records = journal.pending()
+    if not records:
+        return
+    by_chat = {}
+    for record in records:
+        by_chat.setdefault(record.chat_id, []).append(record)
+
+    requeued = 0
+    for chat_id, chat_records in by_chat.items():
+        pair = PAIR_BY_SOURCE.get(chat_id)
+        if pair is None:
+            for record in chat_records:
+                journal.done(record.key)  # пару убрали из channels.json
+            continue
+        ids = list(dict.fromkeys(i for record in chat_records for i in record.ids))
+        found = {}
+        try:
+            for start in range(0, len(ids), 100):
+                for msg in await client.get_messages(peers.get(chat_id), ids=ids[start:start + 100]):
+                    if msg is not None:
+                        found[msg.id] = msg
+        except Exception as e:
+            # Записи остаются в журнале — попробуем при следующем старте
+            logging.error(f"Journal recovery for {chat_id} failed, {len(chat_records)} tasks kept: {repr(e)}")
+            continue
+
+        for record in chat_records:
+            messages = [found[i] for i in record.ids if i in found]
+            # Старая запись закрывается, enqueue пишет новую — по фактически найденным id
+            journal.done(record.key)
+            if not messages:
+                continue  # сообщения удалены в источнике
+            if record.kind != EDIT and not any(msgmap.get(chat_id, m.id) for m in messages):
+                # Копии в target нет — пост не ушёл. Отметки dedup ставятся до отправки и могли успеть
+                # попасть в SQLite: без снятия повтор из журнала отсеялся бы как дубль
+                if record.grouped_id:
+                    dedup.discard((GROUP, chat_id, record.grouped_id))
+                for m in messages:
+                    dedup.discard((MSG, chat_id, m.id))
+            if record.kind == EDIT:
+                event = events.MessageEdited.Event(messages[0])
+            elif record.kind == ALBUM:
+                event = BackfillAlbum(messages)
+            else:
+                event = BackfillMessage(messages[0])
+            await enqueue(client, pair, event)
+            requeued += 1
+    logging.info(f"Journal recovery: requeued {requeued} of {len(records)} unfinished tasks")
@@ -0,0 +1,186 @@
+# Преобразование фото перед отправкой: перекодирование, удаление EXIF, уменьшение, водяной знак
+# Включается на пару полем "image_transform" в channels.json, например:
+#   "image_transform": {"format": "JPEG", "quality": 85, "max_side": 2560,
+#                       "watermark": "@target_channel", "watermark_position": "bottom-right"}
+# Pillow работает в ProcessPoolExecutor над байтами в памяти — event loop и другие пары не ждут его.
+# Результат кэшируется по (фото источника, конфиг преобразования): одно фото в нескольких target
+# с одинаковым конфигом обрабатывается один раз.
+
+import io
+import json
+import hashlib
+import asyncio
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+try:
+    from PIL import Image, ImageDraw, ImageFont, ImageOps
+except ImportError:  # без Pillow фото уходят как есть
+    Image = None
+
+FORMATS = {"JPEG": "photo.jpg", "PNG": "photo.png", "WEBP": "photo.webp"}
+POSITIONS = ("top-left", "top-right", "bottom-left", "bottom-right", "center")
+
+
+class ImageTransform:
+    """Разобранный конфиг "image_transform" пары; key — хэш конфига для кэша"""
+
+    __slots__ = ("spec", "key")
+
+    def __init__(self, raw: dict):
+        spec = {
+            "format": str(raw.get("format") or "JPEG").upper(),
+            "quality": int(raw.get("quality") or 85),
+            "max_side": int(raw.get("max_side") or 0),
+            "strip_exif": bool(raw.get("strip_exif", True)),
+            "watermark": raw.get("watermark") or "",
+            "watermark_file": raw.get("watermark_file") or "",
+            "watermark_font": raw.get("watermark_font") or "",
+            "watermark_opacity": float(raw.get("watermark_opacity", 0.5)),
+            # Доля меньшей стороны фото: высота текста или ширина картинки-знака (0 — 5% и 20%)
+            "watermark_scale": float(raw.get("watermark_scale") or 0),
+            "watermark_position": raw.get("watermark_position") or "bottom-right",
+        }
+        if spec["format"] not in FORMATS:
+            raise ValueError(f"image_transform.format must be one of {sorted(FORMATS)}")
+        if spec["watermark_position"] not in POSITIONS:
+            raise ValueError(f"image_transform.watermark_position must be one of {POSITIONS}")
+        self.spec = spec
+        self.key = hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+    @classmethod
+    def parse(cls, raw):
+        return cls(raw) if raw else None
+
+    @property
+    def file_name(self) -> str:
+        return FORMATS[self.spec["format"]]
+
+    def __repr__(self):
+        return f"ImageTransform({self.key})"
+
+
+@lru_cache(maxsize=8)
+def _watermark_image(path: str):
+    with Image.open(path) as im:
+        return im.convert("RGBA")
+
+
+def _font(path: str, size: int):
+    if path:
+        return ImageFont.truetype(path, size)
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:  # Pillow < 10.1 — только встроенный растровый шрифт
+        return ImageFont.load_default()
+
+
+def _place(position: str, box: tuple, mark: tuple, margin: int) -> tuple:
+    (w, h), (mw, mh) = box, mark
+    x = {"left": margin, "right": w - mw - margin}
+    y = {"top": margin, "bottom": h - mh - margin}
+    if position == "center":
+        return (w - mw) // 2, (h - mh) // 2
+    v, hpos = position.split("-")
+    return x[hpos], y[v]
+
+
+def _watermark(im, spec: dict):
+    overlay = Image.new("RGBA", im.size, (0, 0, 0, 0))
+    side = min(im.size)
+    margin = max(4, side // 50)
+    alpha = max(0, min(255, int(255 * spec["watermark_opacity"])))
+    if spec["watermark_file"]:
+        mark = _watermark_image(spec["watermark_file"]).copy()
+        width = max(1, int(side * (spec["watermark_scale"] or 0.2)))
+        mark.thumbnail((width, width))
+        mark.putalpha(mark.getchannel("A").point(lambda a: a * alpha // 255))
+        overlay.paste(mark, _place(spec["watermark_position"], im.size, mark.size, margin), mark)
+    if spec["watermark"]:
+        draw = ImageDraw.Draw(overlay)
+        font = _font(spec["watermark_font"], max(10, int(side * (spec["watermark_scale"] or 0.05))))
+        left, top, right, bottom = draw.textbbox((0, 0), spec["watermark"], font=font)
+        x, y = _place(spec["watermark_position"], im.size, (right - left, bottom - top), margin)
+        draw.text((x - left, y - top), spec["watermark"], font=font, fill=(255, 255, 255, alpha),
+                  stroke_width=max(1, side // 500), stroke_fill=(0, 0, 0, alpha))
+    return Image.alpha_composite(im.convert("RGBA"), overlay)
+
+
+def apply_transform(data: bytes, spec: dict) -> bytes:
+    """Выполняется в процессе пула: байты исходного фото → байты результата"""
+    with Image.open(io.BytesIO(data)) as src:
+        im = ImageOps.exif_transpose(src)  # поворот из EXIF применяем до того, как EXIF будет удалён
+        exif = None if spec["strip_exif"] else im.getexif()
+        if spec["max_side"] and max(im.size) > spec["max_side"]:
+            im.thumbnail((spec["max_side"], spec["max_side"]), Image.LANCZOS)
+        if spec["watermark"] or spec["watermark_file"]:
+            im = _watermark(im, spec)
+        fmt = spec["format"]
+        if fmt == "JPEG" and im.mode not in ("RGB", "L"):
+            im = im.convert("RGB")
+        params = {"optimize": True}
+        if fmt in ("JPEG", "WEBP"):
+            params["quality"] = spec["quality"]
+        if exif:
+            params["exif"] = exif.tobytes()
+        out = io.BytesIO()
+        im.save(out, fmt, **params)
+        return out.getvalue()
+
+
+class ImageTransformer:
+    """Пул процессов для apply_transform и LRU-кэш результатов по размеру в байтах"""
+
+    def __init__(self, workers: int = 2, cache_bytes: int = 64 * 1024 * 1024):
+        self.workers = workers
+        self.cache_bytes = cache_bytes
+        self._pool = None
+        self._cache = OrderedDict()  # (ключ медиа, ключ конфига) → bytes
+        self._cache_size = 0
+
+    @property
+    def available(self) -> bool:
+        return Image is not None and self.workers > 0
+
+    def get(self, key):
+        data = self._cache.get(key)
+        if data is not None:
+            self._cache.move_to_end(key)
+        return data
+
+    def _put(self, key, data: bytes):
+        if len(data) > self.cache_bytes:
+            return
+        old = self._cache.pop(key, None)
+        if old is not None:
+            self._cache_size -= len(old)
+        self._cache[key] = data
+        self._cache_size += len(data)
+        while self._cache_size > self.cache_bytes:
+            _, dropped = self._cache.popitem(last=False)
+            self._cache_size -= len(dropped)
+
+    async def run(self, key, data: bytes, transform: ImageTransform) -> bytes:
+        """Преобразует data в пуле процессов; key — (ключ медиа, transform.key) для кэша"""
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+        if self._pool is None:
+            # spawn: рабочие процессы не наследуют event loop и соединения родителя
+            self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._pool, apply_transform, data, transform.spec)
+        except BrokenProcessPool:
+            self._pool = None  # процесс упал (например, по памяти) — следующий вызов создаст пул заново
+            raise
+        self._put(key, result)
+        return result
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,164 @@
+# Журнал очереди (write-ahead) на случай падения процесса
+# Каждая постановка в очередь дописывает компактную запись: вид (m — сообщение, a — альбом, e — правка),
+# чат источника, grouped_id и id сообщений; когда отправка закончилась — отметку d.
+# Строки копятся в памяти и уходят на диск пачкой с одним fsync раз в interval — горячий путь диск не ждёт.
+# Когда отметок набирается много, файл в фоне переписывается только с незавершёнными записями.
+# При старте незавершённое перечитывается по id и снова ставится в очередь: доставка «хотя бы раз».
+# Отметки DedupStore у постов без копии в MessageMap снимаются, у уже отправленных — отсекают повтор.
+
+import os
+import asyncio
+import logging
+
+EDIT, ALBUM, MESSAGE = "e", "a", "m"
+
+
+class JournalRecord:
+    """Незавершённая задача из журнала"""
+
+    __slots__ = ("kind", "chat_id", "grouped_id", "ids")
+
+    def __init__(self, kind: str, chat_id: int, grouped_id: int, ids: list):
+        self.kind = kind
+        self.chat_id = chat_id
+        self.grouped_id = grouped_id
+        self.ids = ids
+
+    @property
+    def key(self) -> tuple:
+        return self.kind, self.chat_id, self.ids[0]
+
+
+def _parse(line: str):
+    """Строка журнала → ("a", JournalRecord) | ("d", ключ); оборванная запись — ValueError"""
+    parts = line.split()
+    if parts[0] == "a" and len(parts) == 5:
+        ids = [int(i) for i in parts[4].split(",")]
+        return "a", JournalRecord(parts[1], int(parts[2]), int(parts[3]) or None, ids)
+    if parts[0] == "d" and len(parts) == 4:
+        return "d", (parts[1], int(parts[2]), int(parts[3]))
+    raise ValueError(f"bad journal line: {line!r}")
+
+
+class Journal:
+    """Журнал задач очереди: add() при постановке, done() по окончании отправки"""
+
+    def __init__(self, path: str = None, compact_after: int = 10000):
+        self.path = path
+        self.compact_after = compact_after  # сколько отметок d копить до перезаписи файла
+        self._live = {}       # ключ → [строка записи, сколько раз поставлено]
+        self._buffer = []     # строки, ещё не записанные на диск
+        self._done = 0        # отметок d с последней перезаписи
+        self._file = None
+
+    def __len__(self):
+        return len(self._live)
+
+    def add(self, kind: str, chat_id: int, ids: list, grouped_id: int = None) -> tuple:
+        key = (kind, chat_id, ids[0])
+        if not self.path:
+            return key
+        entry = self._live.get(key)
+        if entry is not None:
+            entry[1] += 1  # например, вторая правка того же поста, пока первая в очереди
+            return key
+        line = f"a {kind} {chat_id} {grouped_id or 0} {','.join(map(str, ids))}\n"
+        self._live[key] = [line, 1]
+        self._buffer.append(line)
+        return key
+
+    def done(self, key: tuple):
+        entry = self._live.get(key)
+        if entry is None:
+            return
+        if entry[1] > 1:
+            entry[1] -= 1
+            return
+        del self._live[key]
+        self._buffer.append(f"d {key[0]} {key[1]} {key[2]}\n")
+        self._done += 1
+
+    def pending(self) -> list:
+        """Незавершённые записи в порядке постановки (при старте — то, что не успели отправить)"""
+        return [_parse(line)[1] for line, _ in self._live.values()]
+
+    def load(self):
+        if not self.path:
+            return
+        live = {}
+        broken = 0
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        op, value = _parse(line)
+                    except ValueError:
+                        broken += 1  # последняя строка могла оборваться при падении
+                        continue
+                    if op == "a":
+                        live.setdefault(value.key, [line if line.endswith("\n") else line + "\n", 1])
+                    else:
+                        live.pop(value, None)
+        except FileNotFoundError:
+            pass
+        self._live = live
+        self._rewrite(self._snapshot())
+        if live or broken:
+            logging.info(f"Journal {self.path}: {len(live)} unfinished tasks, {broken} broken lines skipped")
+
+    def _snapshot(self) -> list:
+        """Состояние для перезаписи; буфер в него уже входит и больше не нужен"""
+        self._buffer = []
+        self._done = 0
+        return [line for line, _ in self._live.values()]
+
+    def _write(self, lines: list):
+        self._file.write("".join(lines))
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _rewrite(self, lines: list):
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        old, self._file = self._file, open(self.path, "a", encoding="utf-8")
+        if old is not None:
+            old.close()
+
+    async def run_flusher(self, interval: float = 0.2):
+        if self._file is None:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self._done >= self.compact_after:
+                    try:
+                        await asyncio.to_thread(self._rewrite, self._snapshot())
+                    except Exception:
+                        self._done = self.compact_after  # снимок не записан — повторить целиком
+                        raise
+                elif self._buffer:
+                    lines, self._buffer = self._buffer, []
+                    try:
+                        await asyncio.to_thread(self._write, lines)
+                    except Exception:
+                        self._buffer[:0] = lines
+                        raise
+            except Exception as e:
+                logging.error(f"Journal flush failed: {repr(e)}")
+
+    def close(self):
+        if self._file is None:
+            return
+        try:
+            if self._buffer:
+                lines, self._buffer = self._buffer, []
+                self._write(lines)
+        finally:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,228 @@
+# Нагрузочный прогон всего конвейера handlers на FakeClient (без Telegram)
+# Генерирует NewMessage / MessageEdited / альбомы (поэлементно) с заданной частотой, ждёт, пока всё будет
+# «отправлено», и печатает msg/sec, p50/p99 задержки от события до отправки и рост памяти.
+# Код выхода 1, если хоть одно событие или элемент альбома не доставлен и не сброшен очередью
+# за --timeout: прогон с параметрами по умолчанию обязан проходить без потерь.
+#
+#   python loadgen.py --count 20000 --rate 5000 --pairs 50
+#   python loadgen.py --count 2000 --latency 0.02 --flood-rate 0.01 --target-rate 0.5
+
+import os
+import re
+import sys
+import time
+import random
+import asyncio
+import argparse
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description="End-to-end load test of handlers with a fake client")
+    p.add_argument("--count", type=int, default=10000, help="сколько событий сгенерировать")
+    p.add_argument("--rate", type=float, default=0, help="событий в секунду (0 — без ограничения)")
+    p.add_argument("--pairs", type=int, default=20, help="число пар источник → target")
+    p.add_argument("--mappings", type=int, default=5, help="маппингов ссылок на пару")
+    p.add_argument("--album-ratio", type=float, default=0.05)
+    p.add_argument("--album-size", type=int, default=4)
+    p.add_argument("--edit-ratio", type=float, default=0.05)
+    p.add_argument("--media-ratio", type=float, default=0.2)
+    p.add_argument("--unchanged-ratio", type=float, default=0.0, help="доля постов без замен (быстрый путь forward)")
+    p.add_argument("--latency", type=float, default=0.0, help="задержка каждого запроса, сек")
+    p.add_argument("--upload-latency", type=float, default=0.0, help="доп. задержка отправки медиа, сек")
+    p.add_argument("--flood-rate", type=float, default=0.0, help="вероятность FloodWaitError на запрос")
+    p.add_argument("--flood-seconds", type=int, default=1)
+    p.add_argument("--workers", type=int, default=None)
+    p.add_argument("--global-rate", type=float, default=0, help="RATE_GLOBAL (0 — без лимита)")
+    p.add_argument("--target-rate", type=float, default=0, help="RATE_TARGET (0 — без лимита)")
+    p.add_argument("--timeout", type=float, default=300, help="сколько ждать завершения, сек")
+    p.add_argument("--seed", type=int, default=1)
+    return p.parse_args(argv)
+
+
+def configure_env(args):
+    """Окружение до импорта config: без SQLite, диска (журнал — только если JOURNAL_PATH задан), /metrics и догонялки"""
+    no_limit = "1000000000"
+    os.environ.update({
+        "DEDUP_DB": "",
+        "JOURNAL_PATH": os.environ.get("JOURNAL_PATH", ""),
+        "MEDIA_CACHE_DIR": "",
+        "METRICS_PORT": "0",
+        "BACKFILL_ENABLED": "0",
+        "CHANNELS_RELOAD_INTERVAL": "0",
+        "LOG_LEVEL": os.environ.get("LOG_LEVEL", "WARNING"),
+        "RATE_GLOBAL": str(args.global_rate) if args.global_rate else no_limit,
+        "RATE_GLOBAL_BURST": str(max(args.global_rate * 2, 1)) if args.global_rate else no_limit,
+        "RATE_TARGET": str(args.target_rate) if args.target_rate else no_limit,
+        "RATE_TARGET_BURST": str(max(args.target_rate * 10, 1)) if args.target_rate else no_limit,
+    })
+    for name in ("LOG_LEVEL_CONTENT", "LOG_LEVEL_FLOOD", "LOG_LEVEL_ADS"):
+        os.environ.setdefault(name, "WARNING")
+    os.environ.setdefault("API_ID", "0")
+    os.environ.setdefault("API_HASH", "0")
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(q * len(sorted_values)))
+    return sorted_values[idx]
+
+
+SEQ_RE = re.compile(r"#seq(\d+)")
+
+
+async def run(args):
+    import handlers
+    from pairs import Pair
+    from fakeclient import FakeClient
+
+    rng = random.Random(args.seed)
+    pairs = []
+    for i in range(args.pairs):
+        links = [{"src": f"https://t.me/src{i}_{j}", "tgt": f"https://t.me/tgt{i}_{j}"} for j in range(args.mappings)]
+        pairs.append(Pair({
+            "source_id": -1001000000000 - i,
+            "target_id": -1002000000000 - i,
+            "source_name": f"источник{i}",
+            "target_name": f"получатель{i}",
+            "white_list": [m["src"] for m in links],
+            "link_mappings": links,
+        }))
+    handlers.set_pairs(pairs)
+
+    client = FakeClient(
+        loop=asyncio.get_running_loop(),
+        latency=args.latency,
+        upload_latency=args.upload_latency,
+        flood_rate=args.flood_rate,
+        flood_seconds=args.flood_seconds,
+        seed=args.seed,
+    )
+    emitted_at = {}
+    latencies = []
+    album_items = set()  # id документов элементов альбомов, которые ещё не отправлены и не сброшены
+    dropped = {}  # причина → сколько #seq не будет доставлено (сброшены, просрочены, заменены правкой)
+    done = asyncio.Event()
+
+    def finished():
+        if len(latencies) + sum(dropped.values()) >= args.count:
+            done.set()
+
+    def on_sent(record):
+        file = record.file[0] if isinstance(record.file, list) else record.file
+        album_items.discard(getattr(getattr(file, "document", None), "id", None))
+        m = SEQ_RE.search(record.text or "")
+        if m:
+            t0 = emitted_at.pop(int(m.group(1)), None)
+            if t0 is not None:
+                latencies.append(record.ts - t0)
+                finished()
+
+    on_task_dropped = handlers.scheduler.on_drop
+
+    def on_drop(target, task, reason):
+        on_task_dropped(target, task, reason)
+        event = task[2]
+        for msg in getattr(event, "messages", None) or [event.message]:
+            album_items.discard(getattr(getattr(msg.media, "document", None), "id", None))
+            m = SEQ_RE.search(msg.message or "")
+            if m and emitted_at.pop(int(m.group(1)), None) is not None:
+                dropped[reason] = dropped.get(reason, 0) + 1
+        finished()
+
+    client.on_sent = on_sent
+    handlers.scheduler.on_drop = on_drop
+    handlers.register_handlers(client, worker_count=args.workers)
+    await handlers.warm_peers(client)
+    await handlers.run_backfill(client)
+
+    sent_msgs = {p.source_id: [] for p in pairs}
+    grouped = 1
+
+    def make_event(seq: int):
+        nonlocal grouped
+        index = rng.randrange(len(pairs))
+        pair = pairs[index]
+        link = f"https://t.me/src{index}_{rng.randrange(args.mappings)}"
+        if rng.random() < args.unchanged_ratio:
+            text = f"Пост #seq{seq} без ссылок 🚀"
+        else:
+            text = f"Пост {pair.source_name} #seq{seq} подробнее: {link} 🚀"
+        roll = rng.random()
+        history = sent_msgs[pair.source_id]
+        if roll < args.edit_ratio and history:
+            return [client.edited_event(rng.choice(history), text)]
+        if roll < args.edit_ratio + args.album_ratio:
+            grouped += 1
+            msgs = [
+                client.make_message(pair.source_id, text if k == 0 else "", media=client.make_media(), grouped_id=grouped)
+                for k in range(args.album_size)
+            ]
+            album_items.update(m.media.document.id for m in msgs)
+            return client.album_events(msgs)
+        media = client.make_media() if rng.random() < args.media_ratio else None
+        msg = client.make_message(pair.source_id, text, media=media)
+        history.append(msg)
+        if len(history) > 100:
+            del history[:50]
+        return [client.new_message_event(msg)]
+
+    rss_start = rss_bytes()
+    start = time.perf_counter()
+    for seq in range(args.count):
+        if args.rate:
+            due = start + seq / args.rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        batch = make_event(seq)
+        emitted_at[seq] = time.perf_counter()
+        for event in batch:
+            await client.emit(event)
+        if seq % 256 == 0:
+            await asyncio.sleep(0)  # не монополизируем loop при --rate 0
+    emit_time = time.perf_counter() - start
+
+    try:
+        await asyncio.wait_for(done.wait(), timeout=args.timeout)
+    except asyncio.TimeoutError:
+        pass
+    total = time.perf_counter() - start
+    rss_end = rss_bytes()
+
+    latencies.sort()
+    delivered = len(latencies)
+    print(f"events emitted:   {args.count} in {emit_time:.2f}s ({args.count / emit_time:.0f}/s offered)")
+    print(f"delivered:        {delivered} in {total:.2f}s ({delivered / total:.0f} msg/s)")
+    print(f"requests sent:    {len(client.sent)}  flood waits injected: {client.floods}")
+    if dropped:
+        print(f"dropped by queue: {sum(dropped.values())} {dropped}")
+    print(f"latency p50/p99:  {percentile(latencies, 0.5) * 1000:.1f} / {percentile(latencies, 0.99) * 1000:.1f} ms"
+          f"  max {(latencies[-1] if latencies else 0) * 1000:.1f} ms")
+    print(f"rss:              {rss_start / 2**20:.1f} → {rss_end / 2**20:.1f} MiB ({(rss_end - rss_start) / 2**20:+.1f})")
+    lost = args.count - delivered - sum(dropped.values())
+    if lost > 0:
+        print(f"WARNING: {lost} events neither delivered nor dropped within {args.timeout:.0f}s")
+    # Пост альбома считается доставленным по подписи, поэтому элементы без подписи проверяем отдельно
+    if album_items:
+        print(f"WARNING: {len(album_items)} album items neither delivered nor dropped within {args.timeout:.0f}s")
+    return 1 if lost > 0 or album_items else 0
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    configure_env(args)
+    return asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,30 +1,121 @@
+import os
+import gzip
+import json
+import queue
+import atexit
+import random
+import shutil
 import logging
-
-# Основной лог
-logging.basicConfig(
-    filename='bot.log',
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s: %(message)s',
-    encoding='utf-8'
+import logging.handlers
+from config import (
+    LOG_FORMAT, LOG_ROTATE, LOG_MAX_BYTES, LOG_WHEN, LOG_BACKUPS, LOG_COMPRESS,
+    LOG_LEVEL, LOG_LEVEL_CONTENT, LOG_LEVEL_FLOOD, LOG_LEVEL_ADS,
+    LOG_SAMPLE_CONTENT, LOG_SAMPLE_FLOOD, LOG_DIR,
 )
 
+# Все логи пишутся через очередь: в event loop запись только кладётся в queue,
+# форматирование и запись на диск (с ротацией и gzip) делает отдельный поток QueueListener.
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка (JSONL)"""
+
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False)
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только долю rate записей (1.0 — все, 0 — ни одной)"""
+
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return self.rate >= 1.0 or random.random() < self.rate
+
+
+class NameFilter(logging.Filter):
+    """Пропускает записи только от логгера name"""
+
+    def __init__(self, name: str):
+        super().__init__()
+        self.logger_name = name
+
+    def filter(self, record):
+        return record.name == self.logger_name
+
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as src, gzip.open(dest, "wb") as dst:
+        shutil.copyfileobj(src, dst)
+    os.remove(source)
+
+
+def _file_handler(filename: str, fmt: str):
+    if LOG_DIR:
+        os.makedirs(LOG_DIR, exist_ok=True)
+        filename = os.path.join(LOG_DIR, filename)
+    if LOG_ROTATE == "time":
+        handler = logging.handlers.TimedRotatingFileHandler(
+            filename, when=LOG_WHEN, backupCount=LOG_BACKUPS, encoding="utf-8"
+        )
+    else:
+        handler = logging.handlers.RotatingFileHandler(
+            filename, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8"
+        )
+    if LOG_COMPRESS:
+        handler.namer = lambda name: name + ".gz"
+        handler.rotator = _gzip_rotator
+    handler.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else logging.Formatter(fmt))
+    return handler
+
+
+log_queue = queue.SimpleQueue()
+
+# Основной лог (как и раньше, сюда попадают и записи остальных логгеров)
+bot_handler = _file_handler('bot.log', '[%(asctime)s] %(levelname)s: %(message)s')
+
 # Контент лог
 content_logger = logging.getLogger('content_logger')
-content_handler = logging.FileHandler('content.log', encoding='utf-8')
-content_handler.setFormatter(logging.Formatter('[%(asctime)s] %(message)s'))
-content_logger.addHandler(content_handler)
-content_logger.setLevel(logging.INFO)
+content_handler = _file_handler('content.log', '[%(asctime)s] %(message)s')
+content_handler.addFilter(NameFilter('content_logger'))
+content_logger.setLevel(LOG_LEVEL_CONTENT)
+content_logger.addFilter(SamplingFilter(LOG_SAMPLE_CONTENT))
 
 # Flood лог
 flood_logger = logging.getLogger('flood_logger')
-flood_handler = logging.FileHandler('flood.log', encoding='utf-8')
-flood_handler.setFormatter(logging.Formatter('[%(asctime)s] %(message)s'))
-flood_logger.addHandler(flood_handler)
-flood_logger.setLevel(logging.INFO)
+flood_handler = _file_handler('flood.log', '[%(asctime)s] %(message)s')
+flood_handler.addFilter(NameFilter('flood_logger'))
+flood_logger.setLevel(LOG_LEVEL_FLOOD)
+flood_logger.addFilter(SamplingFilter(LOG_SAMPLE_FLOOD))
 
 # Новый логгер для рекламы
 ad_logger = logging.getLogger("ads")
-ad_logger.setLevel(logging.INFO)
-ad_handler = logging.FileHandler("ads.log", encoding="utf-8")
-ad_handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s"))
-ad_logger.addHandler(ad_handler)
\ No newline at end of file
+ad_handler = _file_handler("ads.log", "[%(asctime)s] %(message)s")
+ad_handler.addFilter(NameFilter("ads"))
+ad_logger.setLevel(LOG_LEVEL_ADS)
+
+root = logging.getLogger()
+root.setLevel(LOG_LEVEL)
+root.addHandler(logging.handlers.QueueHandler(log_queue))
+
+log_listener = logging.handlers.QueueListener(
+    log_queue, bot_handler, content_handler, flood_handler, ad_handler, respect_handler_level=True
+)
+log_listener.start()
+
+
+@atexit.register
+def _stop_listener():
+    # Дописываем всё, что осталось в очереди; повторная остановка не ошибка
+    if log_listener._thread is not None:
+        log_listener.stop()
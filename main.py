@@ -1,12 +1,24 @@
 from client import client
-from handlers import register_handlers
+from handlers import register_handlers, warm_peers, run_backfill, dedup, msgmap, progress, journal, image_transformer
 import logger
+from config import SESSION_FLUSH_INTERVAL
 
 def main():
     register_handlers(client)  # Регистрация обработчиков
+    if hasattr(client.session, "run_flusher"):
+        client.loop.create_task(client.session.run_flusher(SESSION_FLUSH_INTERVAL))  # json-сессия на диск
     client.start()
+    client.loop.run_until_complete(warm_peers(client))  # InputPeer всех пар — до первой отправки
+    client.loop.run_until_complete(run_backfill(client))  # Догоняем пропущенное за время простоя
     print("Bot is running...")
-    client.run_until_disconnected()
+    try:
+        client.run_until_disconnected()
+    finally:
+        dedup.close()  # Дописываем ключи, чтобы после рестарта не было повторов
+        msgmap.close()
+        progress.close()
+        journal.close()
+        image_transformer.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,374 @@
+# Передача медиа в обход ссылки на исходный файл (fallback, когда send_file(media) не прошёл)
+# Маленькие файлы скачиваются в память (BytesIO) и загружаются оттуда, диск для загрузки не нужен. Большие файлы
+# известного размера идут потоком: upload_file Telethon ждёт read() каждой части, а _DownloadStream
+# отдаёт её по мере скачивания через iter_download — в памяти лежит не больше пары кусков.
+# Файл неизвестного размера буферизуется в SpooledTemporaryFile (после memory_limit — на диске).
+# Элементы альбома качаются и загружаются параллельно (не больше concurrency одновременно).
+# С подключённым MediaCache скачанное переживает перезапуск: файлы больше memory_limit берутся с диска,
+# а поток при загрузке заодно пишется в кэш; маленькие загружаются из буфера в памяти, а копия буфера
+# пишется в кэш (запись всегда в потоке, не в event loop). Уже отправленные копии берутся по готовой ссылке.
+# Если у пары задан image_transform, фото перед загрузкой проходят через imaging.ImageTransformer;
+# готовые ссылки на такие копии хранятся под ключом (ключ медиа, ключ конфига).
+
+import io
+import asyncio
+import logging
+import tempfile
+from telethon import utils as tl_utils
+from telethon.errors.rpcerrorlist import FloodWaitError
+from telethon.tl.types import (
+    DocumentAttributeFilename,
+    InputMediaUploadedDocument,
+    InputMediaUploadedPhoto,
+)
+
+
+class MediaTooLarge(Exception):
+    """Медиа больше допустимого размера для fallback"""
+
+
+def media_key(media):
+    """Ключ медиа: ("photo"|"document", id, размер) или None"""
+    photo = getattr(media, "photo", None)
+    if photo is not None and getattr(photo, "id", None):
+        return "photo", photo.id, media_size(media) or 0
+    document = getattr(media, "document", None)
+    if document is not None and getattr(document, "id", None):
+        return "document", document.id, getattr(document, "size", 0) or 0
+    return None
+
+
+def media_size(media):
+    """Размер файла в байтах, если Telegram его сообщил"""
+    document = getattr(media, "document", None)
+    if document is not None:
+        return getattr(document, "size", None)
+    photo = getattr(media, "photo", None)
+    sizes = getattr(photo, "sizes", None) if photo is not None else None
+    if sizes:
+        try:
+            return tl_utils._photo_size_byte_count(sizes[-1])
+        except Exception:
+            return None
+    return None
+
+
+def media_file_name(media) -> str:
+    """Имя файла для загрузки: по нему Telegram определяет тип"""
+    document = getattr(media, "document", None)
+    if document is not None:
+        for attr in getattr(document, "attributes", None) or []:
+            if isinstance(attr, DocumentAttributeFilename) and attr.file_name:
+                return attr.file_name
+        return "file" + (tl_utils.get_extension(media) or "")
+    return "photo.jpg"
+
+
+class _DownloadStream:
+    """Файл для upload_file поверх iter_download: read(n) докачивает ровно столько, сколько просят.
+
+    Каждый кусок заодно уходит в tee (запись кэша), если он задан.
+    """
+
+    def __init__(self, chunks, max_bytes: int = 0, tee=None):
+        self._chunks = chunks
+        self._buf = bytearray()
+        self._eof = False
+        self.max_bytes = max_bytes
+        self.tee = tee
+        self.total = 0
+
+    async def read(self, n: int = -1) -> bytes:
+        while not self._eof and (n < 0 or len(self._buf) < n):
+            try:
+                chunk = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self._eof = True
+                break
+            self.total += len(chunk)
+            if self.max_bytes and self.total > self.max_bytes:
+                raise MediaTooLarge(f"more than {self.max_bytes} bytes")
+            if self.tee is not None:
+                await asyncio.to_thread(self.tee.write, chunk)
+            self._buf += chunk
+        if n < 0 or n > len(self._buf):
+            n = len(self._buf)
+        data = bytes(self._buf[:n])
+        del self._buf[:n]
+        return data
+
+    async def aclose(self):
+        """Прерывает скачивание (освобождает соединение с чужим DC, если Telethon его занял)"""
+        close = getattr(self._chunks, "aclose", None) or getattr(self._chunks, "close", None)
+        if close is not None and not self._eof:
+            await close()
+
+
+class MediaTransfer:
+    """Скачивание и повторная загрузка медиа (из буфера или потоком) с бюджетом по размеру и времени"""
+
+    def __init__(self, memory_limit: int = 10 * 1024 * 1024, max_bytes: int = 0,
+                 timeout: float = 300.0, concurrency: int = 4, cache=None, transformer=None):
+        self.memory_limit = memory_limit
+        self.max_bytes = max_bytes  # 0 — без ограничения
+        self.timeout = timeout
+        self.concurrency = concurrency
+        self.cache = cache  # mediacache.MediaCache или None
+        self.transformer = transformer  # imaging.ImageTransformer или None
+
+    def transforms(self, media, transform) -> bool:
+        """Нужно ли преобразовать media перед отправкой (только фото и только при доступном Pillow)"""
+        return (
+            transform is not None
+            and self.transformer is not None
+            and self.transformer.available
+            and getattr(media, "photo", None) is not None
+        )
+
+    def _key(self, media, transform):
+        key = media_key(media)
+        if key is not None and self.transforms(media, transform):
+            return key, transform.key
+        return key
+
+    def _new_buffer(self, size):
+        if size is not None and size <= self.memory_limit:
+            return io.BytesIO()
+        return tempfile.SpooledTemporaryFile(max_size=self.memory_limit)
+
+    def _cache_for(self, size):
+        """Дисковый кэш для файла такого размера или None (неизвестного размера или больше квоты)"""
+        if self.cache is None or not self.cache.fits(size):
+            return None
+        return self.cache
+
+    async def _save(self, cache, key, buf):
+        """Копия маленького файла из буфера в кэш; сбой диска отправке не мешает — файл уже в памяти"""
+
+        def write():
+            with buf.getbuffer() as view:
+                writer.write(view)
+            return writer.finish()
+
+        writer = None
+        try:
+            writer = await asyncio.to_thread(cache.writer, key)
+            if writer is None:
+                return
+            await asyncio.to_thread(write)
+        except OSError as e:
+            if writer is not None:
+                writer.abort()
+            logging.warning(f"Media cache write failed for {key}: {e!r}")
+            return
+        writer.register()
+
+    async def download(self, client, media):
+        """Скачивает media целиком в буфер (или берёт из кэша); возвращает (файл с позицией 0, размер)"""
+        key = media_key(media)
+        size = media_size(media)
+        if self.max_bytes and size and size > self.max_bytes:
+            raise MediaTooLarge(f"{size} > {self.max_bytes} bytes")
+
+        # Большие файлы пишутся в кэш прямо при скачивании, маленькие качаются в память и копируются в кэш
+        # после (файл неизвестного размера — только в буфер)
+        cache = self._cache_for(size)
+        if cache is not None:
+            cached = cache.open(key)
+            if cached is not None:
+                return cached
+
+        large = cache is not None and size > self.memory_limit
+        writer = await asyncio.to_thread(cache.writer, key) if large else None
+        buf = writer if writer is not None else self._new_buffer(size)
+
+        async def pump():
+            total = 0
+            async for chunk in client.iter_download(media):
+                total += len(chunk)
+                if self.max_bytes and total > self.max_bytes:
+                    raise MediaTooLarge(f"more than {self.max_bytes} bytes")
+                if writer is not None:
+                    await asyncio.to_thread(writer.write, chunk)
+                else:
+                    buf.write(chunk)
+            return total
+
+        try:
+            total = await asyncio.wait_for(pump(), self.timeout or None)
+            if writer is not None:
+                path = await asyncio.to_thread(writer.finish)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            else:
+                buf.close()
+            raise
+        if writer is not None:
+            # Открываем до register(): если файл всё же больше квоты, вытеснение не отнимет его у нас
+            f = await asyncio.to_thread(open, path, "rb")
+            writer.register()
+            return f, total
+        if cache is not None:
+            await self._save(cache, key, buf)
+        buf.seek(0)
+        return buf, total
+
+    async def _transformed(self, client, media, transform) -> bytes:
+        key = (media_key(media), transform.key)
+        data = self.transformer.get(key)
+        if data is not None:
+            return data
+        buf, _ = await self.download(client, media)
+        try:
+            data = buf.read()
+        finally:
+            buf.close()
+        return await self.transformer.run(key, data, transform)
+
+    async def _upload(self, client, media):
+        """upload_file для media: маленькие и неизвестного размера — из буфера, большие — потоком"""
+        name = media_file_name(media)
+        size = media_size(media)
+        cached = None
+        if size and size > self.memory_limit:
+            if self.max_bytes and size > self.max_bytes:
+                raise MediaTooLarge(f"{size} > {self.max_bytes} bytes")
+            cache = self._cache_for(size)
+            cached = cache.open(media_key(media)) if cache is not None else None
+            if cached is None:
+                return await self._upload_stream(client, media, size, name)
+
+        buf, size = cached or await self.download(client, media)
+        try:
+            return await client.upload_file(buf, file_size=size, file_name=name)
+        finally:
+            buf.close()
+
+    async def _upload_stream(self, client, media, size: int, name: str):
+        """Загрузка по мере скачивания; с кэшем поток заодно пишется на диск"""
+        cache = self._cache_for(size)
+        writer = await asyncio.to_thread(cache.writer, media_key(media)) if cache is not None else None
+        stream = _DownloadStream(client.iter_download(media), self.max_bytes, writer)
+
+        async def transfer():
+            handle = await client.upload_file(stream, file_size=size, file_name=name)
+            # upload_file читает ровно size байт; остаток значит, что Telegram сообщил неверный размер
+            if await stream.read() or stream.total != size:
+                raise ValueError(f"media size mismatch: expected {size}, got {stream.total}+ bytes")
+            return handle
+
+        try:
+            handle = await asyncio.wait_for(transfer(), self.timeout or None)
+            if writer is not None:
+                await asyncio.to_thread(writer.finish)
+        except BaseException:
+            if writer is not None:
+                writer.abort()
+            await stream.aclose()
+            raise
+        if writer is not None:
+            writer.register()
+        return handle
+
+    async def reupload(self, client, media, transform=None):
+        """Скачивает и загружает media заново; возвращает InputMediaUploaded* для send_file"""
+        if self.transforms(media, transform):
+            data = await self._transformed(client, media, transform)
+            handle = await client.upload_file(data, file_size=len(data), file_name=transform.file_name)
+            return InputMediaUploadedPhoto(file=handle)
+
+        handle = await self._upload(client, media)
+        document = getattr(media, "document", None)
+        if document is not None:
+            # Сохраняем mime и атрибуты (длительность, размеры видео и т.п.) исходного документа
+            return InputMediaUploadedDocument(
+                file=handle,
+                mime_type=getattr(document, "mime_type", None) or "application/octet-stream",
+                attributes=list(getattr(document, "attributes", None) or []),
+            )
+        return InputMediaUploadedPhoto(file=handle)
+
+    async def reupload_many(self, client, medias: list, transform=None) -> list:
+        """Параллельная повторная загрузка; на месте неудачных элементов — None"""
+        sem = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def one(m):
+            async with sem:
+                return await self.reupload(client, m, transform)
+
+        results = await asyncio.gather(*(one(m) for m in medias), return_exceptions=True)
+        uploaded = []
+        for m, r in zip(medias, results):
+            if isinstance(r, BaseException):
+                logging.warning(f"Album item reupload failed ({type(r).__name__}): {r!r}; media={media_key(m)}")
+                r = None
+            uploaded.append(r)
+        return uploaded
+
+    def _handle(self, key):
+        return self.cache.get_handle(key) if self.cache is not None else None
+
+    def _remember(self, keys: list, sent):
+        if self.cache is None or sent is None:
+            return
+        messages = sent if isinstance(sent, list) else [sent]
+        for key, msg in zip(keys, messages):
+            self.cache.put_handle(key, getattr(msg, "media", None))
+
+    async def send(self, client, media, send, transform=None):
+        """Отправляет media заново через send(file): по готовой ссылке, иначе с повторной загрузкой"""
+        key = self._key(media, transform)
+        handle = self._handle(key)
+        if handle is not None:
+            try:
+                return await send(handle)
+            except FloodWaitError:
+                raise
+            except Exception as e:
+                logging.warning(f"Cached media handle failed ({type(e).__name__}): {e}; reuploading {key}")
+                self.cache.drop_handle(key)
+
+        uploaded = await self.reupload(client, media, transform)
+        sent = await send(uploaded)
+        self._remember([key], sent)
+        return sent
+
+    async def send_album(self, client, medias: list, send, transform=None):
+        """То же для альбома: готовые ссылки + параллельная загрузка остальных; None, если отправлять нечего"""
+        keys = [self._key(m, transform) for m in medias]
+        files = [self._handle(k) for k in keys]
+        if transform is not None:
+            # Альбом пришёл сюда ради преобразования фото: остальное сначала пробуем по исходной ссылке
+            files = [m if f is None and not self.transforms(m, transform) else f for m, f in zip(medias, files)]
+
+        for attempt in range(2):
+            missing = [i for i, f in enumerate(files) if f is None]
+            if missing:
+                uploaded = await self.reupload_many(client, [medias[i] for i in missing], transform)
+                for i, u in zip(missing, uploaded):
+                    if u is None and self.transforms(medias[i], transform):
+                        # Преобразование не удалось — элемент уходит как есть, по ссылке на оригинал
+                        keys[i] = media_key(medias[i])
+                        u = medias[i]
+                    files[i] = u
+            items = [(k, f) for k, f in zip(keys, files) if f is not None]
+            if not items:
+                return None
+            try:
+                sent = await send([f for _, f in items])
+            except FloodWaitError:
+                raise
+            except Exception as e:
+                reused = [i for i, k in enumerate(keys) if files[i] is not None and i not in missing]
+                if attempt or not reused:
+                    raise
+                # Какая-то из готовых ссылок устарела — загружаем эти элементы заново
+                logging.warning(f"Cached album handles failed ({type(e).__name__}): {e}; reuploading")
+                for i in reused:
+                    if self.cache is not None:
+                        self.cache.drop_handle(keys[i])
+                    files[i] = None
+                continue
+            self._remember([k for k, _ in items], sent)
+            return sent
@@ -0,0 +1,181 @@
+# Кэш медиа на диске с адресацией по Telegram id
+# Файл называется по ключу медиа (тип, id, размер), общий объём ограничен квотой,
+# вытесняются давно не использованные (LRU). Запись атомарная: <имя>.<случайное>.part → os.replace,
+# у каждой записи свой .part — параллельные скачивания одного медиа друг другу не мешают.
+# Дополнительно в памяти хранятся ссылки на уже отправленные нами копии (InputPhoto/
+# InputDocument) — повторная отправка тех же байтов не требует новой загрузки. Ссылки на диск не пишутся:
+# их file_reference живёт часы (отсюда handle_ttl), после перезапуска повтор берёт байты из файлов кэша
+# и только заново загружает их.
+
+import os
+import time
+import tempfile
+import logging
+from collections import OrderedDict
+from telethon import utils as tl_utils
+
+PART_SUFFIX = ".part"
+
+
+def key_name(key) -> str:
+    kind, media_id, size = key
+    return f"{kind}_{media_id}_{size}"
+
+
+class _Writer:
+    """Запись одного файла кэша; фиксируется только при commit()"""
+
+    def __init__(self, cache, name: str):
+        self._cache = cache
+        self.name = name
+        self.size = 0
+        os.makedirs(cache.directory, exist_ok=True)
+        fd, self.part_path = tempfile.mkstemp(suffix=PART_SUFFIX, prefix=name + ".", dir=cache.directory)
+        self._f = os.fdopen(fd, "wb")
+
+    def write(self, chunk: bytes):
+        self._f.write(chunk)
+        self.size += len(chunk)
+
+    def finish(self) -> str:
+        """Закрывает и переименовывает файл; индекс кэша не трогает — можно звать из потока"""
+        self._f.close()
+        path = os.path.join(self._cache.directory, self.name)
+        os.replace(self.part_path, path)
+        return path
+
+    def register(self):
+        """Добавляет готовый файл в индекс кэша (в event loop)"""
+        self._cache._add(self.name, self.size)
+
+    def commit(self) -> str:
+        path = self.finish()
+        self.register()
+        return path
+
+    def abort(self):
+        try:
+            self._f.close()
+            os.remove(self.part_path)
+        except OSError:
+            pass
+
+
+class MediaCache:
+    """LRU-кэш файлов медиа с квотой на диске и кэшем ссылок на загруженные копии"""
+
+    def __init__(self, directory: str, quota_bytes: int, handle_ttl: float = 12 * 3600, max_handles: int = 5000):
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        self.handle_ttl = handle_ttl
+        self.max_handles = max_handles
+        self._index = OrderedDict()  # имя файла → размер (давно не использованные в начале)
+        self._total = 0
+        self._handles = OrderedDict()  # ключ медиа → (InputPhoto/InputDocument, время)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory and self.quota_bytes > 0)
+
+    def fits(self, size) -> bool:
+        """Поместится ли файл такого размера в кэш; больше квоты он был бы вытеснен сразу же"""
+        return self.enabled and size is not None and 0 < size <= self.quota_bytes
+
+    def scan(self):
+        """Восстанавливает индекс по содержимому каталога (при старте)"""
+        if not self.enabled:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(PART_SUFFIX):
+                # Недописанный файл от прошлого запуска
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            st = entry.stat()
+            entries.append((max(st.st_atime, st.st_mtime), entry.name, st.st_size))
+        entries.sort()
+        self._index.clear()
+        self._total = 0
+        for _, name, size in entries:
+            self._index[name] = size
+            self._total += size
+        self._evict()
+        logging.info(f"Media cache: {len(self._index)} files, {self._total} bytes in {self.directory}")
+
+    def _add(self, name: str, size: int):
+        old = self._index.pop(name, None)
+        if old is not None:
+            self._total -= old
+        self._index[name] = size
+        self._total += size
+        self._evict()
+
+    def _evict(self):
+        while self._total > self.quota_bytes and self._index:
+            name, size = self._index.popitem(last=False)
+            self._total -= size
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def open(self, key):
+        """Открывает файл из кэша на чтение: (файл, размер) или None"""
+        if not self.enabled or key is None:
+            return None
+        name = key_name(key)
+        size = self._index.get(name)
+        if size is None:
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            f = open(path, "rb")
+            os.utime(path)  # порядок LRU переживает перезапуск через mtime
+        except OSError:
+            self._total -= self._index.pop(name, 0)
+            return None
+        self._index.move_to_end(name)
+        return f, size
+
+    def writer(self, key):
+        """Начинает атомарную запись файла в кэш, None если кэш выключен"""
+        if not self.enabled or key is None:
+            return None
+        return _Writer(self, key_name(key))
+
+    # --- Ссылки на уже загруженные копии ---
+
+    def get_handle(self, key):
+        if key is None:
+            return None
+        item = self._handles.get(key)
+        if item is None:
+            return None
+        handle, ts = item
+        if time.time() - ts > self.handle_ttl:
+            del self._handles[key]
+            return None
+        self._handles.move_to_end(key)
+        return handle
+
+    def put_handle(self, key, sent_media):
+        """Запоминает медиа отправленного нами сообщения как готовую к повторной отправке ссылку"""
+        if key is None or sent_media is None:
+            return
+        try:
+            handle = tl_utils.get_input_media(sent_media)
+        except TypeError:
+            return
+        self._handles[key] = (handle, time.time())
+        self._handles.move_to_end(key)
+        while len(self._handles) > self.max_handles:
+            self._handles.popitem(last=False)
+
+    def drop_handle(self, key):
+        self._handles.pop(key, None)
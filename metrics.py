@@ -0,0 +1,181 @@
+# Метрики в формате Prometheus (text exposition 0.0.4) без внешних зависимостей
+# Counter / Histogram с метками, Gauge через функцию обратного вызова.
+# serve() поднимает маленький asyncio HTTP-сервер с /metrics в том же процессе.
+
+import time
+import asyncio
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self._values = {}
+
+    def inc(self, *labels, value: float = 1.0):
+        self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def total(self) -> float:
+        return sum(self._values.values())
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = labels
+        self.buckets = tuple(buckets)
+        self._series = {}  # метки → [счётчики по корзинам (не накопленные)..., +Inf], сумма, количество
+
+    def observe(self, value: float, *labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {cumulative}")
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, labels, le)} {count}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class Gauge:
+    """Значение считается при каждом запросе: func() → число или {метки: число}"""
+
+    def __init__(self, name: str, help_text: str, func, labels: tuple = ()):
+        self.name = name
+        self.help = help_text
+        self.func = func
+        self.label_names = labels
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        try:
+            value = self.func()
+        except Exception as e:
+            logging.warning(f"Gauge {self.name} failed: {repr(e)}")
+            return lines
+        if isinstance(value, dict):
+            for labels, v in value.items():
+                labels = labels if isinstance(labels, tuple) else (labels,)
+                lines.append(f"{self.name}{_labels(self.label_names, labels)} {v}")
+        else:
+            lines.append(f"{self.name} {value}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labels=()):
+        return self.register(Counter(name, help_text, labels))
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, help_text, labels, buckets))
+
+    def gauge(self, name, help_text, func, labels=()):
+        return self.register(Gauge(name, help_text, func, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+PAIR = ("source", "target")
+
+ENQUEUE_WAIT = registry.histogram("copier_enqueue_wait_seconds", "Time a task waited in its target queue", ("target",))
+WHITELIST_SECONDS = registry.histogram("copier_whitelist_seconds", "Link extraction and whitelist check", PAIR)
+REWRITE_SECONDS = registry.histogram("copier_rewrite_seconds", "Text and entity rewrite", PAIR)
+MEDIA_SEND_SECONDS = registry.histogram("copier_media_send_seconds", "send_file by original media reference", PAIR)
+FALLBACK_SECONDS = registry.histogram("copier_fallback_seconds", "Download and reupload fallback", PAIR)
+
+ALBUM_WAIT = registry.histogram("copier_album_assembly_seconds", "From first album item to the album being queued", ("reason",))
+
+FORWARDED = registry.counter("copier_forwarded_total", "Messages and albums forwarded", PAIR)
+BLOCKED = registry.counter("copier_blocked_whitelist_total", "Posts dropped by whitelist", PAIR)
+FALLBACK_TEXT = registry.counter("copier_fallback_text_total", "Media posts sent as text only", PAIR)
+FAST_PATH = registry.counter("copier_fast_path_total", "Posts copied by batched forward without reupload", PAIR)
+NEAR_DUPLICATES = registry.counter("copier_near_duplicates_total", "Posts dropped as near-duplicates of a recent post", PAIR)
+DROPPED = registry.counter("copier_queue_dropped_total", "Queued tasks dropped: expired, shed or coalesced edits", ("target", "reason"))
+ERRORS = registry.counter("copier_errors_total", "Tasks failed with an exception", PAIR)
+
+
+async def _handle(reader, writer):
+    try:
+        request_line = await reader.readline()
+        # Заголовки не нужны — дочитываем до пустой строки
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request_line.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            body = registry.render().encode("utf-8")
+            head = "HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+        else:
+            body = b"not found\n"
+            head = "HTTP/1.1 404 Not Found\r\nContent-Type: text/plain\r\n"
+        writer.write(f"{head}Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode("latin-1") + body)
+        await writer.drain()
+    except Exception as e:
+        logging.debug(f"Metrics request failed: {repr(e)}")
+    finally:
+        writer.close()
+
+
+async def serve(host: str = "127.0.0.1", port: int = 9108):
+    """Запускает HTTP-сервер /metrics; port=0 — не запускать"""
+    if not port:
+        return None
+    server = await asyncio.start_server(_handle, host, port)
+    logging.info(f"Metrics endpoint on http://{host}:{port}/metrics")
+    return server
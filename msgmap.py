@@ -0,0 +1,130 @@
+# Соответствие исходных сообщений отправленным копиям
+# (source chat, source msg id) → (target chat, target msg id, ключ медиа)
+# Нужно, чтобы правки в источнике применялись через edit_message к уже отправленной копии,
+# а медиа перезаливалось только если оно действительно поменялось.
+# Размер ограничен (LRU), содержимое дублируется в SQLite и переживает перезапуск.
+
+import time
+import asyncio
+import sqlite3
+import logging
+from collections import OrderedDict
+
+
+class MessageMap:
+    """Ограниченная LRU-карта source → target с опциональным SQLite"""
+
+    def __init__(self, max_size: int = 200_000, db_path: str = None):
+        self.max_size = max_size
+        self.db_path = db_path
+        self._items = OrderedDict()  # (source_chat, source_id) → (target_chat, target_id, media)
+        self._pending = []
+        self._db = None
+        self._pruned_at = 0.0
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, source_chat: int, source_id: int):
+        """(target_chat, target_id, media) или None"""
+        key = (source_chat, source_id)
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, source_chat: int, source_id: int, target_chat: int, target_id: int, media: str = ""):
+        key = (source_chat, source_id)
+        value = (target_chat, target_id, media or "")
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if self._db is not None:
+            self._pending.append((source_chat, source_id, target_chat, target_id, media or "", time.time()))
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    # --- Персистентность ---
+
+    def load(self):
+        """Открывает SQLite и загружает последние записи в память"""
+        if not self.db_path:
+            return
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS msgmap ("
+            "source_chat INTEGER NOT NULL, source_id INTEGER NOT NULL, "
+            "target_chat INTEGER NOT NULL, target_id INTEGER NOT NULL, media TEXT NOT NULL, ts REAL NOT NULL, "
+            "PRIMARY KEY (source_chat, source_id))"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS msgmap_ts ON msgmap (ts)")
+        self._db.commit()
+        rows = self._db.execute(
+            "SELECT source_chat, source_id, target_chat, target_id, media FROM msgmap ORDER BY ts DESC LIMIT ?",
+            (self.max_size,),
+        ).fetchall()
+        for source_chat, source_id, target_chat, target_id, media in reversed(rows):
+            self._items[(source_chat, source_id)] = (target_chat, target_id, media)
+        logging.info(f"Message map loaded {len(rows)} entries from {self.db_path}")
+
+    def load_chats(self, chat_ids):
+        """Догружает из SQLite записи этих источников (пара переехала из другого шарда)"""
+        chat_ids = list(chat_ids)
+        if self._db is None or not chat_ids:
+            return
+        rows = self._db.execute(
+            "SELECT source_chat, source_id, target_chat, target_id, media FROM msgmap "
+            f"WHERE source_chat IN ({','.join('?' * len(chat_ids))}) ORDER BY ts DESC LIMIT ?",
+            (*chat_ids, self.max_size),
+        ).fetchall()
+        for source_chat, source_id, target_chat, target_id, media in reversed(rows):
+            self._items.setdefault((source_chat, source_id), (target_chat, target_id, media))
+        while len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+        logging.info(f"Message map loaded {len(rows)} entries of chats {chat_ids}")
+
+    def flush(self):
+        if self._db is None:
+            return
+        pending, self._pending = self._pending, []
+        self._write(pending)
+
+    def _write(self, pending: list):
+        if pending:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO msgmap (source_chat, source_id, target_chat, target_id, media, ts) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                pending,
+            )
+        now = time.time()
+        if now - self._pruned_at > 60:
+            # Храним не больше max_size самых свежих записей
+            self._db.execute(
+                "DELETE FROM msgmap WHERE ts < (SELECT ts FROM msgmap ORDER BY ts DESC LIMIT 1 OFFSET ?)",
+                (max(0, self.max_size - 1),),
+            )
+            self._pruned_at = now
+        self._db.commit()
+
+    async def run_flusher(self, interval: float = 1.0):
+        """Фоновая запись в SQLite вне event loop"""
+        if self._db is None:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            if not self._pending:
+                continue
+            pending, self._pending = self._pending, []
+            try:
+                await asyncio.to_thread(self._write, pending)
+            except Exception as e:
+                logging.error(f"Message map flush failed: {repr(e)}")
+
+    def close(self):
+        if self._db is None:
+            return
+        try:
+            self.flush()
+        finally:
+            self._db.close()
+            self._db = None
@@ -0,0 +1,157 @@
+# Подавление почти-дубликатов между источниками
+# Одну и ту же рекламу часто публикуют несколько источников — каждая пара отправила бы свою копию.
+# После замен текст поста сводится к 64-битному simhash (слова без ссылок, биграммы), медиа — к своим
+# ключам (id + размер). Для каждого target держим окно последних отпечатков (по времени и количеству);
+# пост считается повтором, если simhash отличается не больше чем на distance бит, а все его медиа уже были.
+# Поиск по 4 полосам по 16 бит: при расстоянии ≤ 3 хотя бы одна полоса совпадает точно.
+
+import re
+import time
+import heapq
+from collections import deque
+
+from utils import URL_RE
+
+MASK = (1 << 64) - 1
+BANDS = 4
+BAND_BITS = 64 // BANDS
+WORD_RE = re.compile(r"\w+")
+# Длинный текст представляется 128 биграммами с наименьшим хэшем — выборка одинакова у копий
+MAX_SHINGLES = 128
+
+
+def fingerprint(text: str, min_tokens: int = 8):
+    """simhash текста или None, если слов слишком мало для надёжного сравнения"""
+    words = WORD_RE.findall(URL_RE.sub(" ", text or "").lower())
+    if len(words) < min_tokens:
+        return None
+    hashes = {hash(f"{a} {b}") & MASK for a, b in zip(words, words[1:])}
+    if len(hashes) > MAX_SHINGLES:
+        hashes = heapq.nsmallest(MAX_SHINGLES, hashes)
+    counts = [0] * 64
+    for h in hashes:
+        for i in range(64):
+            if h >> i & 1:
+                counts[i] += 1
+    half = len(hashes) / 2
+    value = 0
+    for i, c in enumerate(counts):
+        if c > half:
+            value |= 1 << i
+    return value
+
+
+def _bands(value: int):
+    mask = (1 << BAND_BITS) - 1
+    return [(b, value >> (b * BAND_BITS) & mask) for b in range(BANDS)]
+
+
+class _Entry:
+    __slots__ = ("ts", "simhash", "media")
+
+    def __init__(self, ts, simhash, media):
+        self.ts = ts
+        self.simhash = simhash
+        self.media = media
+
+
+class _TargetIndex:
+    def __init__(self):
+        self.entries = deque()  # в порядке добавления
+        self.bands = {}         # (полоса, значение) → [_Entry]
+        self.media = {}         # ключ медиа → сколько живых записей на него ссылаются
+
+
+class NearDupIndex:
+    """Окно последних отпечатков по каждому target"""
+
+    def __init__(self, window: float = 3600, max_entries: int = 5000, distance: int = 3, min_tokens: int = 8):
+        self.window = window
+        self.max_entries = max_entries
+        self.distance = min(distance, BANDS - 1)  # больше — полосы уже не гарантируют находку
+        self.min_tokens = min_tokens
+        self._targets = {}
+
+    def __len__(self):
+        return sum(len(t.entries) for t in self._targets.values())
+
+    def _evict(self, index: _TargetIndex, now: float):
+        while index.entries and (now - index.entries[0].ts > self.window or len(index.entries) > self.max_entries):
+            self._unlink(index, index.entries.popleft())
+
+    @staticmethod
+    def _unlink(index: _TargetIndex, entry: _Entry):
+        if entry.simhash is not None:
+            for band in _bands(entry.simhash):
+                bucket = index.bands.get(band)
+                if bucket is not None:
+                    bucket.remove(entry)
+                    if not bucket:
+                        del index.bands[band]
+        for key in entry.media:
+            left = index.media[key] - 1
+            if left:
+                index.media[key] = left
+            else:
+                del index.media[key]
+
+    def _text_seen(self, index: _TargetIndex, simhash: int) -> bool:
+        for band in _bands(simhash):
+            for entry in index.bands.get(band, ()):
+                if bin(entry.simhash ^ simhash).count("1") <= self.distance:
+                    return True
+        return False
+
+    def _index(self, target, now: float) -> _TargetIndex:
+        index = self._targets.get(target)
+        if index is None:
+            index = self._targets[target] = _TargetIndex()
+        self._evict(index, now)
+        return index
+
+    def check(self, target, text: str, media_keys=()) -> bool:
+        """True — почти-дубликат уже отправленного в target поста; индекс не меняется"""
+        index = self._index(target, time.time())
+        simhash = fingerprint(text, self.min_tokens)
+        media = tuple(k for k in media_keys if k)
+        if simhash is None and not media:
+            return False  # сравнивать нечего — короткий текст без медиа
+
+        media_seen = all(k in index.media for k in media)
+        if media and not media_seen:
+            return False
+        if simhash is not None:
+            return self._text_seen(index, simhash)
+        # Только медиа, без значимого текста: повтор, если те же файлы уже были и подписи нет
+        return not (text or "").strip()
+
+    def add(self, target, text: str, media_keys=()):
+        """Запоминает пост, принятый к отправке в target; если отправка не удалась — discard()"""
+        now = time.time()
+        index = self._index(target, now)
+        simhash = fingerprint(text, self.min_tokens)
+        media = tuple(k for k in media_keys if k)
+        if simhash is None and not media:
+            return
+
+        entry = _Entry(now, simhash, media)
+        index.entries.append(entry)
+        if simhash is not None:
+            for band in _bands(simhash):
+                index.bands.setdefault(band, []).append(entry)
+        for key in media:
+            index.media[key] = index.media.get(key, 0) + 1
+        self._evict(index, now)
+
+    def discard(self, target, text: str, media_keys=()):
+        """Снимает последнюю запись add() с тем же текстом и медиа — пост так и не ушёл"""
+        index = self._targets.get(target)
+        if index is None:
+            return
+        simhash = fingerprint(text, self.min_tokens)
+        media = tuple(k for k in media_keys if k)
+        for entry in reversed(index.entries):
+            if entry.simhash == simhash and entry.media == media:
+                index.entries.remove(entry)
+                self._unlink(index, entry)
+                return
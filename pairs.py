@@ -0,0 +1,88 @@
+# Компиляция пар каналов из channels.json
+# Всё, что можно посчитать один раз (регулярки, таблицы замен), считается при загрузке
+
+import re
+import json
+from utils import normalize_link, Whitelist
+from imaging import ImageTransform
+
+
+class Pair:
+    """Скомпилированная пара source → target (неизменяемая)"""
+
+    __slots__ = (
+        "source_id",
+        "target_id",
+        "source_name",
+        "target_name",
+        "white_list",
+        "whitelist",
+        "link_mappings",
+        "rewrite_re",
+        "has_name",
+        "link_by_src",
+        "url_by_norm",
+        "priority",
+        "max_age",
+        "image_transform",
+        "raw",
+    )
+
+    def __init__(self, raw: dict):
+        mappings = [m for m in (raw.get("link_mappings") or []) if m.get("src") and m.get("tgt")]
+        src_name = raw.get("source_name")
+        tgt_name = raw.get("target_name")
+
+        # Таблица для замены в тексте: src без хвостового / в нижнем регистре → tgt
+        link_by_src = {}
+        # Таблица для замены url в entities: нормализованный src → tgt
+        url_by_norm = {}
+        for m in mappings:
+            link_by_src.setdefault(m["src"].rstrip("/").lower(), m["tgt"].rstrip("/"))
+            url_by_norm.setdefault(normalize_link(m["src"]), m["tgt"].rstrip("/"))
+
+        # Одна регулярка на все src и имя канала; длинные ссылки идут первыми,
+        # чтобы не съедались префиксами. Группа src — ссылка, name — имя канала
+        has_name = bool(src_name and tgt_name and src_name != tgt_name)
+        alternatives = []
+        if link_by_src:
+            links = "|".join(re.escape(s) for s in sorted(link_by_src, key=len, reverse=True))
+            alternatives.append(rf"(?P<src>(?i:{links}))/?(?:\?[^\s#]*)?")
+        if has_name:
+            alternatives.append(rf"(?P<name>{re.escape(src_name)})")
+        rewrite_re = re.compile("|".join(alternatives)) if alternatives else None
+
+        sets = object.__setattr__
+        sets(self, "source_id", raw["source_id"])
+        sets(self, "target_id", raw["target_id"])
+        sets(self, "source_name", src_name)
+        sets(self, "target_name", tgt_name)
+        sets(self, "white_list", tuple(raw.get("white_list") or ()))
+        sets(self, "whitelist", Whitelist(self.white_list))
+        sets(self, "link_mappings", tuple(mappings))
+        sets(self, "rewrite_re", rewrite_re)
+        sets(self, "has_name", has_name)
+        sets(self, "link_by_src", link_by_src)
+        sets(self, "url_by_norm", url_by_norm)
+        # Очередь: больший priority обслуживается раньше; max_age (сек) — срок годности поста, None — из конфига
+        sets(self, "priority", int(raw.get("priority") or 0))
+        max_age = raw.get("max_age")
+        sets(self, "max_age", float(max_age) if max_age is not None else None)
+        # Преобразование фото перед отправкой (imaging.py); None — фото уходят как есть
+        sets(self, "image_transform", ImageTransform.parse(raw.get("image_transform")))
+        sets(self, "raw", raw)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Pair is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Pair is immutable")
+
+    def __repr__(self):
+        return f"Pair({self.source_id} -> {self.target_id}, mappings={len(self.link_mappings)})"
+
+
+def load_pairs(path: str = "channels.json") -> list:
+    """Читает channels.json и компилирует каждую пару"""
+    with open(path, "r", encoding="utf-8") as f:
+        return [Pair(raw) for raw in json.load(f)]
@@ -0,0 +1,71 @@
+# Кэш InputPeer для всех source/target из channels.json
+# Резолвим при старте параллельно, чтобы первая отправка не платила за поиск сущности.
+# Если в сессии канала нет (холодный кэш) — один раз проходим диалоги, это заполняет access_hash.
+# При ChannelPrivateError и перезагрузке пар записи обновляются в фоне.
+
+import asyncio
+import logging
+
+
+class PeerCache:
+    """chat_id → InputPeer; get() без записи возвращает сам id (Telethon разрезолвит сам)"""
+
+    def __init__(self, concurrency: int = 8):
+        self.concurrency = concurrency
+        self.client = None
+        self._peers = {}
+        self._refreshing = set()
+
+    def __len__(self):
+        return len(self._peers)
+
+    def __contains__(self, chat_id) -> bool:
+        return chat_id in self._peers
+
+    def get(self, chat_id):
+        return self._peers.get(chat_id, chat_id)
+
+    async def _resolve(self, ids) -> list:
+        sem = asyncio.Semaphore(max(1, self.concurrency))
+
+        async def one(chat_id):
+            async with sem:
+                self._peers[chat_id] = await self.client.get_input_entity(chat_id)
+
+        results = await asyncio.gather(*(one(i) for i in ids), return_exceptions=True)
+        return [(i, r) for i, r in zip(ids, results) if isinstance(r, BaseException)]
+
+    async def warm(self, client, ids):
+        """Резолвит все ids; то, чего нет в сессии, ищется через список диалогов"""
+        self.client = client
+        ids = list(dict.fromkeys(ids))
+        failed = await self._resolve(ids)
+        if failed:
+            logging.info(f"Peer cache: {len(failed)} ids not in session, loading dialogs")
+            try:
+                await client.get_dialogs()
+            except Exception as e:
+                logging.warning(f"Peer cache: get_dialogs failed: {repr(e)}")
+            failed = await self._resolve([i for i, _ in failed])
+        for chat_id, e in failed:
+            logging.error(f"Peer cache: cannot resolve {chat_id}: {repr(e)}")
+        logging.info(f"Peer cache: {len(self._peers)}/{len(ids)} peers resolved")
+
+    def refresh(self, ids):
+        """Фоновое обновление записей (после ChannelPrivateError или перезагрузки пар)"""
+        if self.client is None:
+            return
+        ids = [i for i in dict.fromkeys(ids) if i not in self._refreshing]
+        if not ids:
+            return
+        self._refreshing.update(ids)
+        for chat_id in ids:
+            self._peers.pop(chat_id, None)
+
+        async def run():
+            try:
+                await self.warm(self.client, ids)
+            finally:
+                self._refreshing.difference_update(ids)
+
+        self.client.loop.create_task(run())
@@ -0,0 +1,126 @@
+# Ограничение скорости исходящих отправок
+# Глобальный token bucket на весь аккаунт + по одному на каждый target.
+# FloodWaitError ставит на паузу только тот target, в который он пришёл, и уменьшает
+# его скорость вдвое; успешные отправки постепенно возвращают скорость (AIMD).
+# Паузу своего target отправка ждёт внутри idle() — планировщик на это время отдаёт её место воркера другим.
+
+import time
+import random
+import asyncio
+from contextlib import asynccontextmanager
+from telethon.errors.rpcerrorlist import FloodWaitError, SlowModeWaitError
+from logger import flood_logger
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько ждать до появления токена"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+@asynccontextmanager
+async def _no_idle():
+    yield
+
+
+class RateLimiter:
+    """Ограничитель отправок с учётом FloodWait по каждому target"""
+
+    def __init__(self, global_rate: float = 10.0, global_burst: float = 20.0,
+                 target_rate: float = 0.5, target_burst: float = 5.0,
+                 min_target_rate: float = 0.05, max_retries: int = 3, backoff: float = 1.0):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.target_rate = target_rate
+        self.target_burst = target_burst
+        self.min_target_rate = min_target_rate
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._buckets = {}
+        self._paused_until = {}  # target_id → time.monotonic(), до которого отправки запрещены
+        self.idle = _no_idle  # async context manager на время паузы target (ShardedScheduler.released)
+
+    def _bucket(self, target_id) -> TokenBucket:
+        bucket = self._buckets.get(target_id)
+        if bucket is None:
+            bucket = self._buckets[target_id] = TokenBucket(self.target_rate, self.target_burst)
+        return bucket
+
+    def paused_for(self, target_id) -> float:
+        return max(0.0, self._paused_until.get(target_id, 0.0) - time.monotonic())
+
+    def longest_pause(self) -> float:
+        """Самая долгая оставшаяся пауза по всем target (для heartbeat супервизора)"""
+        if not self._paused_until:
+            return 0.0
+        return max(0.0, max(self._paused_until.values()) - time.monotonic())
+
+    def pause(self, target_id, seconds: float):
+        until = time.monotonic() + seconds
+        if until > self._paused_until.get(target_id, 0.0):
+            self._paused_until[target_id] = until
+        # Telegram сказал, что мы слишком быстрые — уменьшаем скорость этого target вдвое
+        bucket = self._bucket(target_id)
+        bucket.rate = max(self.min_target_rate, bucket.rate / 2)
+        bucket.tokens = min(bucket.tokens, 0.0)
+
+    def _on_success(self, target_id):
+        bucket = self._bucket(target_id)
+        if bucket.rate < self.target_rate:
+            bucket.rate = min(self.target_rate, bucket.rate + self.min_target_rate)
+
+    async def acquire(self, target_id):
+        """Ждёт токен в глобальном bucket и в bucket target"""
+        bucket = self._bucket(target_id)
+        while True:
+            now = time.monotonic()
+            paused = self._paused_until.get(target_id, 0.0) - now
+            wait = max(paused, bucket.delay(now), self.global_bucket.delay(now))
+            if wait <= 0:
+                bucket.take()
+                self.global_bucket.take()
+                return
+            if paused > 0:
+                async with self.idle():
+                    await asyncio.sleep(paused)
+                continue
+            await asyncio.sleep(wait)
+
+    async def call(self, target_id, func, *args, **kwargs):
+        """Вызывает func(*args, **kwargs) с учётом лимитов; повторяет при FloodWait"""
+        attempt = 0
+        while True:
+            await self.acquire(target_id)
+            try:
+                result = await func(*args, **kwargs)
+            except (FloodWaitError, SlowModeWaitError) as e:
+                self.pause(target_id, e.seconds)
+                flood_logger.info("%s: target=%s seconds=%s attempt=%s", type(e).__name__, target_id, e.seconds, attempt + 1)
+                if attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                # Пауза уже учтена в acquire; джиттер разводит повторы разных воркеров
+                async with self.idle():
+                    await asyncio.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+                continue
+            self._on_success(target_id)
+            return result
@@ -0,0 +1,306 @@
+# Планировщик задач с шардированием по target_id
+# Внутри одного target — строгий FIFO (в работе не больше одной задачи),
+# разные target обрабатываются параллельно общим пулом воркеров.
+# Очередь каждого шарда ограничена: при переполнении submit() ждёт (backpressure),
+# освободившиеся места выдаются ждущим в порядке их прихода — FIFO сохраняется и под нагрузкой.
+#
+# Какой target обслужить следующим, решает куча: сначала приоритет пары, затем самая свежая по дате
+# поста голова очереди — хвост устаревших постов (после FloodWait, догонялки) не держит свежие.
+# Дедлайн на порядок не влияет: просроченные задачи выбрасываются при выдаче и при сбросе,
+# при глубине шарда больше shed_depth сбрасываются наименее ценные (больший shed_rank, старые первыми),
+# повторная задача с тем же coalesce_key заменяет ещё не начатую (например, несколько правок одного поста).
+#
+# Target на паузе (paused(key) > 0, например FloodWait) воркеры пропускают, шард вернётся в кучу после паузы.
+# Задача, которой пауза досталась посреди отправки, ждёт её внутри released() — её место воркера
+# на это время свободно, и остальные target не простаивают.
+
+import time
+import heapq
+import asyncio
+import logging
+import contextvars
+from itertools import count
+from collections import deque
+from contextlib import asynccontextmanager
+
+# Место воркера, занятое текущей задачей (у каждой задачи — своё, через контекст asyncio.Task)
+_current_slot = contextvars.ContextVar("scheduler_slot", default=None)
+
+
+class _Slot:
+    __slots__ = ("scheduler", "held")
+
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.held = True
+
+
+class _Item:
+    __slots__ = ("item", "enqueued", "posted", "deadline", "shed_rank", "coalesce_key")
+
+    def __init__(self, item, posted, deadline, shed_rank, coalesce_key):
+        self.item = item
+        self.enqueued = time.monotonic()
+        self.posted = posted if posted is not None else time.time()  # дата поста, time.time()
+        self.deadline = deadline          # time.time(), после которого задача не нужна (None — без срока)
+        self.shed_rank = shed_rank        # чем больше, тем раньше сбрасывается (None — никогда)
+        self.coalesce_key = coalesce_key
+
+
+class _Shard:
+    __slots__ = ("items", "scheduled", "priority", "coalesce", "waiters", "reserved", "entry")
+
+    def __init__(self):
+        self.items = deque()    # очередь _Item (голова — items[0])
+        self.scheduled = False  # ключ шарда стоит в очереди готовых или обрабатывается
+        self.priority = 0
+        self.coalesce = {}      # coalesce_key → _Item, ещё не взятый в работу
+        self.waiters = deque()  # future ждущих места submit() в порядке прихода
+        self.reserved = 0       # мест, уже отданных разбуженным, но ещё не занятых
+        self.entry = None       # n действующей записи шарда в куче готовых (остальные его записи устарели)
+
+
+class ShardedScheduler:
+    """Пул воркеров над набором FIFO-очередей, по одной на ключ (target_id)"""
+
+    def __init__(self, handler, worker_count: int = 3, shard_size: int = 100, on_wait=None,
+                 on_drop=None, shed_depth: int = 0, report_interval: float = 60.0, paused=None):
+        self._handler = handler
+        self._on_wait = on_wait  # on_wait(key, секунды в очереди) — для метрик
+        self._paused = paused  # paused(key) → сек до конца паузы шарда (0 — не на паузе), например FloodWait
+        self.on_drop = on_drop  # on_drop(key, item, причина: "expired" | "shed" | "coalesced")
+        self.worker_count = worker_count
+        self.shard_size = shard_size
+        self.shed_depth = shed_depth  # 0 — не сбрасывать, только backpressure
+        self.report_interval = report_interval
+        self._shards = {}
+        self._ready = []  # куча (-приоритет, -дата поста головы, n, ключ)
+        self._ready_event = asyncio.Event()
+        self._seq = count()
+        self._tasks = []
+        self._slots = None  # asyncio.Semaphore(worker_count): одновременно выполняемые задачи
+        self._running = set()
+        self.dropped = {"expired": 0, "shed": 0, "coalesced": 0}
+
+    def qsize(self) -> int:
+        """Суммарная глубина всех шардов"""
+        return sum(len(s.items) for s in self._shards.values())
+
+    def shard_sizes(self) -> dict:
+        return {key: len(s.items) for key, s in self._shards.items()}
+
+    def _notify(self, key, item, reason: str):
+        self.dropped[reason] += 1
+        if self.on_drop is not None:
+            try:
+                self.on_drop(key, item, reason)
+            except Exception as e:
+                logging.exception(f"Scheduler on_drop failed for shard {key}: {e}")
+
+    def _discard(self, key, shard: _Shard, entry: _Item, reason: str):
+        if entry.coalesce_key is not None and shard.coalesce.get(entry.coalesce_key) is entry:
+            del shard.coalesce[entry.coalesce_key]
+        self._notify(key, entry.item, reason)
+
+    def _shed(self, key, shard: _Shard, limit: int):
+        """Сбрасывает просроченные, затем наименее ценные задачи, пока в шарде больше limit"""
+        now = time.time()
+        keep = []
+        for it in shard.items:
+            if it.deadline is not None and now > it.deadline:
+                self._discard(key, shard, it, "expired")
+            else:
+                keep.append(it)
+        excess = len(keep) - limit
+        if excess > 0:
+            candidates = sorted(
+                (it for it in keep if it.shed_rank is not None),
+                key=lambda it: (-it.shed_rank, it.posted),
+            )[:excess]
+            if candidates:
+                victims = set(map(id, candidates))
+                for it in candidates:
+                    self._discard(key, shard, it, "shed")
+                keep = [it for it in keep if id(it) not in victims]
+        if len(keep) != len(shard.items):
+            shard.items.clear()
+            shard.items.extend(keep)
+            self._refresh(key, shard)
+            self._wake(shard)
+
+    def _wake(self, shard: _Shard):
+        """Отдаёт свободные места ждущим submit() по одному, в порядке прихода"""
+        while shard.waiters and len(shard.items) + shard.reserved < self.shard_size:
+            waiter = shard.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                shard.reserved += 1
+
+    def _schedule(self, key, shard: _Shard):
+        shard.entry = n = next(self._seq)
+        heapq.heappush(self._ready, (-shard.priority, -shard.items[0].posted, n, key))
+        self._ready_event.set()
+
+    def _refresh(self, key, shard: _Shard):
+        """Голова шарда, ждущего в куче, сменилась (сброс, новая правка, приоритет) — запись в куче заменяется"""
+        if shard.entry is None:
+            return  # шард в работе или на паузе — в кучу он вернётся с новой головой сам
+        if shard.items:
+            self._schedule(key, shard)
+        else:
+            shard.entry = None
+            shard.scheduled = False
+
+    async def submit(self, key, item, priority: int = 0, posted: float = None, deadline: float = None,
+                     shed_rank: int = None, coalesce_key=None):
+        """Ставит задачу в шард key; ждёт, если шард заполнен и сбрасывать нечего.
+
+        posted — дата поста (time.time(); None — сейчас): по ней выбирается самый свежий target.
+        """
+        shard = self._shards.get(key)
+        if shard is None:
+            shard = self._shards[key] = _Shard()
+        if shard.priority != priority:
+            shard.priority = priority
+            self._refresh(key, shard)
+
+        if coalesce_key is not None:
+            queued = shard.coalesce.get(coalesce_key)
+            if queued is not None:
+                # Более новая версия заменяет старую на её месте в очереди
+                self._notify(key, queued.item, "coalesced")
+                queued.item = item
+                queued.deadline = deadline
+                if posted is not None and queued.posted != posted:
+                    queued.posted = posted
+                    if shard.items and shard.items[0] is queued:
+                        self._refresh(key, shard)
+                return
+
+        entry = _Item(item, posted, deadline, shed_rank, coalesce_key)
+        if self.shed_depth and len(shard.items) >= self.shed_depth:
+            self._shed(key, shard, self.shed_depth - 1)
+        # Разбуженные (reserved) ещё не встали в очередь — новый submit не должен их обогнать
+        if shard.waiters or shard.reserved or len(shard.items) + shard.reserved >= self.shard_size:
+            waiter = asyncio.get_running_loop().create_future()
+            shard.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    shard.reserved -= 1  # место уже было отдано — передаём следующему
+                    self._wake(shard)
+                raise
+            shard.reserved -= 1
+        shard.items.append(entry)
+        self._wake(shard)  # место могло остаться для тех, кто ждал только разбуженных
+        if coalesce_key is not None:
+            shard.coalesce[coalesce_key] = entry
+        if not shard.scheduled:
+            shard.scheduled = True
+            self._schedule(key, shard)
+
+    async def _next_key(self):
+        while True:
+            while not self._ready:
+                self._ready_event.clear()
+                await self._ready_event.wait()
+            *_, n, key = heapq.heappop(self._ready)
+            shard = self._shards.get(key)
+            if shard is None or shard.entry != n:
+                continue  # устаревшая запись: голову шарда после неё уже переставили
+            shard.entry = None
+            wait = self._paused(key) if self._paused is not None else 0.0
+            if wait <= 0:
+                return key
+            # Шард остаётся scheduled и возвращается в кучу, когда пауза кончится
+            asyncio.get_running_loop().call_later(wait, self._resume, key)
+
+    def _resume(self, key):
+        shard = self._shards.get(key)
+        if shard is None:
+            return
+        if shard.items:
+            self._schedule(key, shard)
+        else:
+            shard.scheduled = False
+
+    async def _dispatch(self):
+        """Выдаёт шарды готовым задачам, пока есть свободные места воркеров"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._slots.acquire()
+            try:
+                key = await self._next_key()
+            except BaseException:
+                self._slots.release()
+                raise
+            # Голову снимаем сразу: до старта задачи submit() мог бы её сбросить
+            shard = self._shards[key]
+            entry = shard.items.popleft()
+            self._wake(shard)
+            if entry.coalesce_key is not None and shard.coalesce.get(entry.coalesce_key) is entry:
+                del shard.coalesce[entry.coalesce_key]
+            task = loop.create_task(self._run(key, shard, entry))
+            self._running.add(task)
+            task.add_done_callback(self._running.discard)
+
+    async def _run(self, key, shard: _Shard, entry: _Item):
+        slot = _Slot(self)
+        _current_slot.set(slot)
+        try:
+            if entry.deadline is not None and time.time() > entry.deadline:
+                self._notify(key, entry.item, "expired")
+                return
+            if self._on_wait is not None:
+                self._on_wait(key, time.monotonic() - entry.enqueued)
+            await self._handler(entry.item)
+        except Exception as e:
+            logging.exception(f"Scheduler handler failed for shard {key}: {e}")
+        finally:
+            if slot.held:
+                self._slots.release()
+            # Следующая задача шарда встаёт в кучу готовых — по своему приоритету и дедлайну
+            if shard.items:
+                self._schedule(key, shard)
+            else:
+                shard.scheduled = False
+
+    @asynccontextmanager
+    async def released(self):
+        """На время блока отдаёт место воркера текущей задачи (ожидание паузы своего target)"""
+        slot = _current_slot.get()
+        if slot is None or slot.scheduler is not self or not slot.held:
+            yield
+            return
+        slot.held = False
+        self._slots.release()
+        try:
+            yield
+        finally:
+            await self._slots.acquire()
+            slot.held = True
+
+    async def run_reporter(self, interval: float = 60.0):
+        """Периодически пишет в лог глубину очередей и счётчики сброшенных задач"""
+        if not interval:
+            return
+        reported = None
+        while True:
+            await asyncio.sleep(interval)
+            sizes = self.shard_sizes()
+            depth = sum(sizes.values())
+            state = (depth, tuple(self.dropped.values()))
+            if state == reported:
+                continue
+            reported = state
+            deepest = sorted(sizes.items(), key=lambda kv: kv[1], reverse=True)[:3]
+            logging.info(
+                f"Queue backlog={depth} deepest={deepest} expired={self.dropped['expired']} "
+                f"shed={self.dropped['shed']} coalesced={self.dropped['coalesced']}"
+            )
+
+    def start(self, loop):
+        self._slots = asyncio.Semaphore(max(1, self.worker_count))
+        self._tasks.append(loop.create_task(self._dispatch()))
+        self._tasks.append(loop.create_task(self.run_reporter(self.report_interval)))
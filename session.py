@@ -0,0 +1,253 @@
+# Сессия Telethon в памяти с периодической атомарной записью в файл
+# Стандартная SQLiteSession пишет каждую пачку сущностей в базу и делает commit прямо в event loop.
+# Здесь авторизация, сущности, состояние обновлений (pts) и кэш загруженных файлов живут в словарях,
+# а на диск уходят одним JSON: раз в interval, по session.save() от Telethon (в фоновом потоке)
+# и синхронно при close(). Запись — во временный файл и os.replace, файл никогда не бывает наполовину записан.
+# Если файла ещё нет, а рядом лежит старая <имя>.session (SQLite), данные переносятся из неё; сама она не удаляется.
+
+import os
+import json
+import time
+import base64
+import sqlite3
+import asyncio
+import logging
+import datetime
+
+from telethon import utils as tl_utils
+from telethon.crypto import AuthKey
+from telethon.sessions import MemorySession
+from telethon.sessions.memory import _SentFileType
+from telethon.tl import types
+
+FORMAT_VERSION = 1
+
+
+def _state_row(state) -> list:
+    return [state.pts, state.qts, state.date.timestamp(), state.seq]
+
+
+def _state(row):
+    pts, qts, date, seq = row
+    date = datetime.datetime.fromtimestamp(date, tz=datetime.timezone.utc)
+    return types.updates.State(pts, qts, date, seq, unread_count=0)
+
+
+class JsonSession(MemorySession):
+    """MemorySession с индексами сущностей и сохранением в JSON-файл"""
+
+    def __init__(self, path: str, legacy_path: str = None):
+        super().__init__()
+        self.path = path
+        self._entities = {}      # marked id → (id, hash, username, phone, name)
+        self._by_username = {}   # username → marked id
+        self._by_phone = {}      # phone → marked id
+        self._version = 0        # растёт при каждом изменении
+        self._saved_version = 0
+        self._writing = None     # фоновая запись, если идёт
+        self._lock = None
+
+        started = time.perf_counter()
+        if os.path.exists(path):
+            self._load(path)
+            source = path
+        elif legacy_path and os.path.exists(legacy_path):
+            self._migrate(legacy_path)
+            self._version += 1
+            self._write(self._snapshot())
+            source = legacy_path
+        else:
+            return
+        logging.info(
+            f"Session loaded from {source}: {len(self._entities)} entities, "
+            f"{len(self._update_states)} update states in {(time.perf_counter() - started) * 1000:.1f} ms"
+        )
+
+    # --- загрузка ---
+
+    def _load(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self._dc_id = data.get("dc_id") or 0
+        self._server_address = data.get("server_address")
+        self._port = data.get("port")
+        if data.get("auth_key"):
+            self._auth_key = AuthKey(base64.b64decode(data["auth_key"]))
+        self._takeout_id = data.get("takeout_id")
+        for row in data.get("entities", ()):
+            self._put_entity(tuple(row))
+        self._update_states = {int(k): _state(v) for k, v in data.get("update_states", {}).items()}
+        self._files = {
+            (bytes.fromhex(md5), size, _SentFileType(kind)): (file_id, file_hash)
+            for md5, size, kind, file_id, file_hash in data.get("files", ())
+        }
+
+    def _migrate(self, legacy_path: str):
+        """Перенос из SQLite-сессии Telethon (только чтение)"""
+        db = sqlite3.connect(f"file:{legacy_path}?mode=ro", uri=True)
+        try:
+            row = db.execute("SELECT dc_id, server_address, port, auth_key, takeout_id FROM sessions").fetchone()
+            if row:
+                self._dc_id, self._server_address, self._port, key, self._takeout_id = row
+                self._dc_id = self._dc_id or 0
+                self._auth_key = AuthKey(key) if key else None
+            for row in db.execute("SELECT id, hash, username, phone, name FROM entities"):
+                self._put_entity(tuple(row))
+            for entity_id, *state in db.execute("SELECT id, pts, qts, date, seq FROM update_state"):
+                self._update_states[entity_id] = _state(state)
+            for md5, size, kind, file_id, file_hash in db.execute(
+                    "SELECT md5_digest, file_size, type, id, hash FROM sent_files"):
+                self._files[(md5, size, _SentFileType(kind))] = (file_id, file_hash)
+        finally:
+            db.close()
+        logging.info(f"Session migrated from {legacy_path} to {self.path}")
+
+    # --- сохранение ---
+
+    def _changed(self):
+        self._version += 1
+
+    def _snapshot(self) -> tuple:
+        """Копия состояния на момент вызова (в event loop); сериализация — уже в потоке"""
+        return self._version, {
+            "version": FORMAT_VERSION,
+            "dc_id": self._dc_id,
+            "server_address": self._server_address,
+            "port": self._port,
+            "auth_key": base64.b64encode(self._auth_key.key).decode() if self._auth_key else None,
+            "takeout_id": self._takeout_id,
+            "entities": list(self._entities.values()),
+            "update_states": {str(k): _state_row(v) for k, v in self._update_states.items()},
+            "files": [[md5.hex(), size, kind.value, file_id, file_hash]
+                      for (md5, size, kind), (file_id, file_hash) in self._files.items()],
+        }
+
+    def _write(self, snapshot: tuple):
+        version, data = snapshot
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        self._saved_version = max(self._saved_version, version)
+
+    async def flush(self):
+        """Записывает изменения в фоновом потоке; параллельные вызовы ждут одну запись"""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if self._version == self._saved_version:
+                return
+            await asyncio.to_thread(self._write, self._snapshot())
+
+    async def run_flusher(self, interval: float = 30.0):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Session flush failed: {repr(e)}")
+
+    def save(self):
+        # Telethon зовёт save() раз в минуту и после входа — не блокируем event loop записью
+        if self._version == self._saved_version:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write(self._snapshot())
+            return
+        if self._writing is None or self._writing.done():
+            self._writing = loop.create_task(self.flush())
+
+    def close(self):
+        if self._version != self._saved_version:
+            self._write(self._snapshot())
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    # --- состояние, которое меняет Telethon ---
+
+    def set_dc(self, dc_id, server_address, port):
+        super().set_dc(dc_id, server_address, port)
+        self._changed()
+
+    @MemorySession.auth_key.setter
+    def auth_key(self, value):
+        self._auth_key = value
+        self._changed()
+
+    @MemorySession.takeout_id.setter
+    def takeout_id(self, value):
+        self._takeout_id = value
+        self._changed()
+
+    def set_update_state(self, entity_id, state):
+        self._update_states[entity_id] = state
+        self._changed()
+
+    def cache_file(self, md5_digest, file_size, instance):
+        super().cache_file(md5_digest, file_size, instance)
+        self._changed()
+
+    # --- сущности: словари вместо перебора множества ---
+
+    def _put_entity(self, row: tuple) -> bool:
+        marked_id, _, username, phone, _ = row
+        if self._entities.get(marked_id) == row:
+            return False
+        self._entities[marked_id] = row
+        if username:
+            self._by_username[username] = marked_id
+        if phone:
+            self._by_phone[phone] = marked_id
+        return True
+
+    def process_entities(self, tlo):
+        changed = False
+        for row in self._entities_to_rows(tlo):
+            changed |= self._put_entity(row)
+        if changed:
+            self._changed()
+
+    def _row_pair(self, marked_id):
+        row = self._entities.get(marked_id)
+        return (row[0], row[1]) if row else None
+
+    def get_entity_rows_by_phone(self, phone):
+        marked_id = self._by_phone.get(phone)
+        row = self._entities.get(marked_id)
+        return (row[0], row[1]) if row and row[3] == phone else None
+
+    def get_entity_rows_by_username(self, username):
+        marked_id = self._by_username.get(username)
+        row = self._entities.get(marked_id)
+        return (row[0], row[1]) if row and row[2] == username else None
+
+    def get_entity_rows_by_name(self, name):
+        return next(((row[0], row[1]) for row in self._entities.values() if row[4] == name), None)
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            return self._row_pair(id)
+        for marked_id in (
+            tl_utils.get_peer_id(types.PeerUser(id)),
+            tl_utils.get_peer_id(types.PeerChat(id)),
+            tl_utils.get_peer_id(types.PeerChannel(id)),
+        ):
+            found = self._row_pair(marked_id)
+            if found:
+                return found
+        return None
+
+
+def open_session(name: str, backend: str = "json"):
+    """Сессия для TelegramClient: "json" — JsonSession в <name>.json, "sqlite" — стандартная <name>.session"""
+    if backend == "sqlite":
+        return name
+    return JsonSession(f"{name}.json", legacy_path=f"{name}.session")
@@ -0,0 +1,315 @@
+# Супервизор нескольких аккаунтов (сессий)
+# Каждая сессия из SESSIONS работает в своём процессе (multiprocessing spawn) со своим event loop
+# и получает свою часть пар: источник → сессия по консистентному хэшу. Часть пар записывается
+# в channels.<сессия>.json, шард подхватывает изменения через watch_channels (как при правке channels.json).
+# Шарды шлют heartbeat; если процесс упал, давно молчит, отключён или получил долгий FloodWait —
+# его пары переезжают на следующие по кольцу живые сессии и возвращаются, когда он поправится.
+#
+# Все аккаунты должны состоять в источниках и иметь право публикации в target.
+# Запуск: SESSIONS=acc1,acc2,acc3 python supervisor.py
+
+import os
+import sys
+import json
+import time
+import queue
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+from bisect import bisect_right
+
+from config import (
+    SESSIONS, SUPERVISOR_HEARTBEAT, SUPERVISOR_DEAD_AFTER, SUPERVISOR_FLOOD_MOVE,
+    CHANNELS_FILE, CHANNELS_RELOAD_INTERVAL, METRICS_HOST, METRICS_PORT, MEDIA_CACHE_DIR, LOG_DIR, JOURNAL_PATH,
+)
+from pairs import load_pairs
+import metrics
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Консистентный хэш с виртуальными узлами: при выпадении узла переезжают только его ключи"""
+
+    def __init__(self, nodes, replicas: int = 100):
+        self._ring = sorted((_hash(f"{node}#{i}"), node) for node in nodes for i in range(replicas))
+        self._keys = [h for h, _ in self._ring]
+
+    def node(self, key, alive=None):
+        """Первый по часовой стрелке узел из alive (None — любой)"""
+        if not self._ring:
+            return None
+        start = bisect_right(self._keys, _hash(str(key)))
+        for i in range(len(self._ring)):
+            node = self._ring[(start + i) % len(self._ring)][1]
+            if alive is None or node in alive:
+                return node
+        return None
+
+
+def shard_channels_file(session: str) -> str:
+    base, ext = os.path.splitext(CHANNELS_FILE)
+    return f"{base}.{session}{ext or '.json'}"
+
+
+def shard_journal_file(session: str) -> str:
+    """Свой журнал очереди у каждого шарда: queue.journal → queue.<сессия>.journal ("" — журнал выключен)"""
+    if not JOURNAL_PATH:
+        return ""
+    base, ext = os.path.splitext(JOURNAL_PATH)
+    return f"{base}.{session}{ext}"
+
+
+# --- процесс шарда ---
+
+async def _heartbeat(session: str, heartbeats, interval: float):
+    from client import client
+    import handlers
+
+    while True:
+        try:
+            heartbeats.put_nowait({
+                "session": session,
+                "pid": os.getpid(),
+                "ts": time.time(),
+                "connected": client.is_connected(),
+                "flood": handlers.limiter.longest_pause(),
+                "pairs": len(handlers.CHANNEL_PAIRS),
+                "queue": handlers.scheduler.qsize(),
+                "forwarded": metrics.FORWARDED.total(),
+                "errors": metrics.ERRORS.total(),
+            })
+        except Exception as e:
+            logging.warning(f"Heartbeat failed: {repr(e)}")
+        await asyncio.sleep(interval)
+
+
+def run_shard(session: str, heartbeats, interval: float):
+    """Точка входа процесса шарда: свой клиент и свои пары, тот же main()"""
+    import main
+    from client import client
+
+    client.loop.create_task(_heartbeat(session, heartbeats, interval))
+    main.main()
+
+
+# --- супервизор ---
+
+class _Shard:
+    __slots__ = ("session", "index", "process", "started", "last_seen", "status",
+                 "disconnected_since", "restarts", "restart_at")
+
+    def __init__(self, session: str, index: int):
+        self.session = session
+        self.index = index
+        self.process = None
+        self.started = 0.0
+        self.last_seen = 0.0
+        self.status = {}
+        self.disconnected_since = None
+        self.restarts = 0
+        self.restart_at = 0.0
+
+
+class Supervisor:
+    def __init__(self, sessions: list):
+        self.ctx = multiprocessing.get_context("spawn")
+        self.heartbeats = self.ctx.Queue()
+        self.shards = {s: _Shard(s, i) for i, s in enumerate(sessions)}
+        self.ring = HashRing(sessions)
+        self.pairs = []
+        self.assignment = {}  # source_id → сессия
+        self._channels_stamp = None
+        self._boot_until = 0.0
+
+        metrics.registry.gauge("copier_shard_up", "Shard is alive and usable", self._gauge("up"), ("session",))
+        metrics.registry.gauge("copier_shard_pairs", "Pairs assigned to shard", self._gauge("pairs"), ("session",))
+        metrics.registry.gauge("copier_shard_queue_depth", "Tasks queued in shard", self._gauge("queue"), ("session",))
+        metrics.registry.gauge("copier_shard_forwarded", "Posts forwarded by shard since its start", self._gauge("forwarded"), ("session",))
+        metrics.registry.gauge("copier_shard_flood_seconds", "Longest FloodWait pause left in shard", self._gauge("flood"), ("session",))
+
+    def _gauge(self, field: str):
+        def func():
+            if field == "up":
+                return {s.session: int(self._healthy(s, time.time())) for s in self.shards.values()}
+            if field == "pairs":
+                counts = {s: 0 for s in self.shards}
+                for session in self.assignment.values():
+                    counts[session] += 1
+                return counts
+            return {s.session: s.status.get(field, 0) for s in self.shards.values()}
+        return func
+
+    def _env(self, shard: _Shard) -> dict:
+        session = shard.session
+        return {
+            "SESSION_NAME": session,
+            "CHANNELS_FILE": shard_channels_file(session),
+            "CHANNELS_RELOAD_INTERVAL": str(CHANNELS_RELOAD_INTERVAL or SUPERVISOR_HEARTBEAT),
+            "METRICS_PORT": str(METRICS_PORT + 1 + shard.index) if METRICS_PORT else "0",
+            "MEDIA_CACHE_DIR": os.path.join(MEDIA_CACHE_DIR, session) if MEDIA_CACHE_DIR else "",
+            "LOG_DIR": os.path.join(LOG_DIR or "logs", session),
+            "JOURNAL_PATH": shard_journal_file(session),
+        }
+
+    def _spawn(self, shard: _Shard):
+        shard.process = self.ctx.Process(
+            target=run_shard, args=(shard.session, self.heartbeats, SUPERVISOR_HEARTBEAT), name=f"shard-{shard.session}"
+        )
+        # config читается при импорте, а spawn импортирует модули заново ещё до target —
+        # поэтому окружение шарда выставляем в родителе на время start(), ребёнок его наследует
+        saved = dict(os.environ)
+        os.environ.update(self._env(shard))
+        try:
+            shard.process.start()
+        finally:
+            os.environ.clear()
+            os.environ.update(saved)
+        shard.started = shard.last_seen = time.time()
+        shard.status = {}
+        shard.disconnected_since = None
+        logging.info(f"Shard {shard.session} started pid={shard.process.pid}")
+
+    def _healthy(self, shard: _Shard, now: float) -> bool:
+        if shard.process is None or not shard.process.is_alive():
+            return False
+        if not shard.status:
+            # Ещё не прислал heartbeat: при старте супервизора ждём его, после перезапуска пары не отдаём
+            return now < self._boot_until
+        if now - shard.last_seen > SUPERVISOR_DEAD_AFTER:
+            return False
+        if shard.disconnected_since is not None and now - shard.disconnected_since > SUPERVISOR_DEAD_AFTER:
+            return False
+        return shard.status.get("flood", 0.0) < SUPERVISOR_FLOOD_MOVE
+
+    def _drain_heartbeats(self):
+        while True:
+            try:
+                hb = self.heartbeats.get_nowait()
+            except queue.Empty:
+                return
+            shard = self.shards.get(hb.get("session"))
+            if shard is None or shard.process is None or hb.get("pid") != shard.process.pid:
+                continue  # от уже перезапущенного процесса
+            shard.last_seen = time.time()
+            shard.status = hb
+            if hb.get("connected"):
+                shard.disconnected_since = None
+            elif shard.disconnected_since is None:
+                shard.disconnected_since = shard.last_seen
+
+    def _check_processes(self, now: float):
+        for shard in self.shards.values():
+            if shard.process is not None and not shard.process.is_alive():
+                shard.restarts += 1
+                delay = min(300, 2 ** shard.restarts)
+                logging.error(f"Shard {shard.session} exited code={shard.process.exitcode}; restart in {delay}s")
+                shard.process = None
+                shard.restart_at = now + delay
+            elif shard.process is None and now >= shard.restart_at:
+                self._spawn(shard)
+            elif shard.process is not None and now - shard.started > 10 * SUPERVISOR_DEAD_AFTER:
+                shard.restarts = 0  # давно работает стабильно — сбрасываем экспоненту
+
+    def _reload_channels(self) -> bool:
+        try:
+            st = os.stat(CHANNELS_FILE)
+        except OSError as e:
+            if not self.pairs:
+                raise
+            logging.error(f"Cannot stat {CHANNELS_FILE}: {repr(e)}")
+            return False
+        stamp = (st.st_mtime_ns, st.st_size)
+        if stamp == self._channels_stamp:
+            return False
+        try:
+            pairs = load_pairs(CHANNELS_FILE)
+        except Exception as e:
+            if not self.pairs:
+                raise
+            logging.error(f"Reload of {CHANNELS_FILE} failed, keeping {len(self.pairs)} pairs: {repr(e)}")
+            self._channels_stamp = stamp
+            return False
+        self._channels_stamp = stamp
+        self.pairs = pairs
+        return True
+
+    def _rebalance(self, now: float, force: bool = False):
+        alive = {s.session for s in self.shards.values() if self._healthy(s, now)}
+        if not alive:
+            # Все шарды нездоровы — не трогаем раздачу, переносить некуда
+            if not force:
+                return
+            alive = set(self.shards)
+        assignment = {p.source_id: self.ring.node(p.source_id, alive) for p in self.pairs}
+        if assignment == self.assignment and not force:
+            return
+        moved = [src for src, session in assignment.items() if self.assignment.get(src, session) != session]
+        for src in moved:
+            logging.warning(f"Pair {src} moved {self.assignment[src]} -> {assignment[src]}")
+        self.assignment = assignment
+        for session in self.shards:
+            raws = [p.raw for p in self.pairs if assignment[p.source_id] == session]
+            _write_json_atomic(shard_channels_file(session), raws)
+        logging.info(f"Assignment: {len(self.pairs)} pairs over {len(alive)} healthy shards, moved {len(moved)}")
+
+    async def run(self):
+        self._boot_until = time.time() + SUPERVISOR_DEAD_AFTER
+        self._reload_channels()
+        self._rebalance(time.time(), force=True)
+        for shard in self.shards.values():
+            self._spawn(shard)
+        await metrics.serve(METRICS_HOST, METRICS_PORT)
+        while True:
+            await asyncio.sleep(1.0)
+            now = time.time()
+            self._drain_heartbeats()
+            self._check_processes(now)
+            changed = self._reload_channels()
+            self._rebalance(now, force=changed)
+
+    def stop(self):
+        for shard in self.shards.values():
+            if shard.process is not None and shard.process.is_alive():
+                shard.process.terminate()
+        for shard in self.shards.values():
+            if shard.process is not None:
+                shard.process.join(timeout=30)
+
+
+def _write_json_atomic(path: str, data):
+    """Пишет файл только при изменении содержимого, через временный файл и os.replace"""
+    body = json.dumps(data, ensure_ascii=False, indent=2)
+    try:
+        with open(path, encoding="utf-8") as f:
+            if f.read() == body:
+                return
+    except OSError:
+        pass
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(body)
+    os.replace(tmp, path)
+
+
+def main():
+    import logger  # noqa: F401 — лог супервизора в LOG_DIR
+
+    if not SESSIONS:
+        print("SESSIONS is empty: set SESSIONS=session1,session2,...", file=sys.stderr)
+        return 2
+    supervisor = Supervisor(SESSIONS)
+    try:
+        asyncio.run(supervisor.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,18 @@
 import re
+import copy
 import logging
+from functools import lru_cache
+from bisect import bisect_left, bisect_right
 from urllib.parse import urlparse
 from telethon.tl.types import MessageEntityTextUrl, MessageMediaWebPage
 
 # Регулярка для поиска "голых" ссылок
 URL_RE = re.compile(r"https?://[^\s\]\)]+", flags=re.IGNORECASE)
+# Символы вне BMP (эмодзи и т.п.) — в UTF‑16 занимают две единицы
+ASTRAL_RE = re.compile("[\U00010000-\U0010FFFF]")
 
 
+@lru_cache(maxsize=8192)
 def normalize_link(link: str) -> str:
     """Нормализует ссылку: убирает хвостовой /, query/fragment и приводит к нижнему регистру"""
     if not link:
@@ -15,140 +21,134 @@ def normalize_link(link: str) -> str:
     return f"{p.scheme}://{p.netloc}{p.path}".rstrip("/").lower()
 
 
-def replace_allowed_link_single(text: str, source_link: str, target_link: str) -> str:
-    """Заменяет все вхождения source_link в тексте на target_link"""
-    if not text:
-        return text
-    src_base = re.escape(source_link.rstrip("/"))
-    tgt = target_link.rstrip("/")
-    pattern = re.compile(rf"{src_base}/?(?:\?[^\s#]*)?", flags=re.IGNORECASE)
-    return pattern.sub(tgt, text)
-
-
-def update_entity_urls_single(entities: list, source_link: str, target_link: str) -> list:
-    """Обновляет url внутри MessageEntityTextUrl"""
-    if not entities:
-        return entities
-    src_norm = normalize_link(source_link)
-    tgt = target_link.rstrip("/")
-    updated = []
-    for ent in entities:
-        if isinstance(ent, MessageEntityTextUrl):
-            ent_url = getattr(ent, "url", "") or ""
-            if normalize_link(ent_url) == src_norm:
-                new_ent = MessageEntityTextUrl(offset=ent.offset, length=ent.length, url=tgt)
-                updated.append(new_ent)
-            else:
-                updated.append(ent)
-        else:
-            updated.append(ent)
-    return updated
-
-
-def replace_links_everywhere(text: str, entities: list, mappings: list) -> tuple[str, list]:
-    """Применяет все маппинги ссылок к тексту и entities"""
-    new_text = text or ""
-    new_entities = list(entities or [])
-    for m in mappings or []:
-        src = m.get("src")
-        tgt = m.get("tgt")
-        if not src or not tgt:
-            continue
-        new_text = replace_allowed_link_single(new_text, src, tgt)
-        new_entities = update_entity_urls_single(new_entities, src, tgt)
-    return new_text, new_entities
+def _astral_positions(text: str) -> list:
+    """Индексы символов вне BMP (в UTF‑16 они занимают две единицы)"""
+    return [m.start() for m in ASTRAL_RE.finditer(text)]
 
 
-def replace_name_outside_entities(message_text: str, entities: list, src_name: str, tgt_name: str) -> str:
-    """Заменяет source_name → target_name в plain‑тексте, игнорируя гиперссылки"""
-    if not message_text or not src_name or src_name == tgt_name:
-        return message_text
+def rewrite_text_and_entities(message_text: str, entities: list, pair) -> tuple[str, list]:
+    """Применяет все замены пары (ссылки, имя канала, url гиперссылок) за один проход.
 
-    protected_ranges = []
-    for ent in entities or []:
-        if isinstance(ent, MessageEntityTextUrl):
-            protected_ranges.append((ent.offset, ent.offset + ent.length))
+    Offsets/length entities считаются в UTF‑16, как их отдаёт и принимает Telegram.
+    Возвращает новый текст и новый список entities (исходные объекты не меняются).
+    """
+    text = message_text or ""
+    entities = list(entities or [])
+    if not text and not entities:
+        return text, entities
 
-    def overlaps_any(start: int, end: int) -> bool:
-        for a, b in protected_ranges:
-            if not (end <= a or start >= b):
-                return True
-        return False
-
-    result = []
-    i = 0
-    L = len(message_text)
-    s_len = len(src_name)
-    while i < L:
-        if message_text.startswith(src_name, i):
-            start = i
-            end = i + s_len
-            if overlaps_any(start, end):
-                result.append(message_text[i:end])
-            else:
-                result.append(tgt_name)
-            i = end
-        else:
-            result.append(message_text[i])
-            i += 1
-    return "".join(result)
+    # UTF‑16 offset → индекс в str. Без эмодзи и прочих astral-символов они совпадают
+    astral = _astral_positions(text)
+    astral_u16 = [pos + k for k, pos in enumerate(astral)]
 
+    def to_index(u: int) -> int:
+        return u - bisect_left(astral_u16, u) if astral_u16 else u
 
-def update_entities_with_name_and_url(message_text: str, entities: list, mappings: list,
-                                      src_name: str = None, tgt_name: str = None) -> tuple[str, list]:
-    """Обновляет гиперссылки: меняет url по mappings и видимый текст по src_name/tgt_name"""
-    if not entities:
-        return message_text, entities
+    spans = []
+    for ent in sorted(entities, key=lambda e: getattr(e, "offset", 0)):
+        if not hasattr(ent, "offset"):
+            spans.append((None, None, ent))
+            continue
+        spans.append((to_index(ent.offset), to_index(ent.offset + ent.length), ent))
 
-    map_by_norm = {}
-    for m in mappings or []:
-        s = m.get("src")
-        t = m.get("tgt")
-        if s and t:
-            map_by_norm[normalize_link(s)] = t.rstrip("/")
+    src_name = pair.source_name
+    tgt_name = pair.target_name
+    replace_name = pair.has_name
 
-    sorted_entities = sorted(entities, key=lambda e: getattr(e, "offset", 0))
+    # Гиперссылки защищены от замены имени; храним их слитыми и отсортированными для bisect
+    prot_starts, prot_ends = [], []
+    edits = []
+    for start, end, ent in spans:
+        if not isinstance(ent, MessageEntityTextUrl):
+            continue
+        if prot_starts and start <= prot_ends[-1]:
+            prot_ends[-1] = max(prot_ends[-1], end)
+        else:
+            prot_starts.append(start)
+            prot_ends.append(end)
+        if replace_name and text[start:end] == src_name:
+            edits.append((start, end, tgt_name))
+
+    def is_protected(start: int, end: int) -> bool:
+        i = bisect_left(prot_starts, end) - 1
+        return i >= 0 and prot_ends[i] > start
+
+    if pair.rewrite_re is not None:
+        link_by_src = pair.link_by_src
+        for m in pair.rewrite_re.finditer(text):
+            if m.lastgroup == "src":
+                edits.append((m.start(), m.end(), link_by_src[m.group("src").lower()]))
+            elif not is_protected(m.start(), m.end()):
+                edits.append((m.start(), m.end(), tgt_name))
+
+    # Собираем новый текст одним проходом; пересекающиеся правки отбрасываем (выигрывает левая)
+    edits.sort(key=lambda e: e[0])
+    old_starts, old_ends, new_starts, new_ends = [], [], [], []
+    pieces = []
+    pos = 0
+    new_pos = 0
+    for start, end, repl in edits:
+        if start < pos:
+            continue
+        pieces.append(text[pos:start])
+        new_pos += start - pos
+        pieces.append(repl)
+        old_starts.append(start)
+        old_ends.append(end)
+        new_starts.append(new_pos)
+        new_pos += len(repl)
+        new_ends.append(new_pos)
+        pos = end
+    pieces.append(text[pos:])
+    new_text = "".join(pieces) if old_starts else text
+
+    def shift(p: int, is_end: bool) -> int:
+        i = bisect_right(old_ends, p)
+        if i < len(old_starts) and old_starts[i] < p:
+            # Граница entity попала внутрь заменённого фрагмента — растягиваем на всю замену
+            return new_ends[i] if is_end else new_starts[i]
+        if i == 0:
+            return p
+        return new_ends[i - 1] + (p - old_ends[i - 1])
+
+    new_astral = _astral_positions(new_text) if astral or old_starts else astral
+
+    def to_u16(i: int) -> int:
+        return i + bisect_left(new_astral, i) if new_astral else i
+
+    url_by_norm = pair.url_by_norm
     updated_entities = []
-    shift = 0
+    for start, end, ent in spans:
+        if start is None:
+            updated_entities.append(ent)
+            continue
+        ns = shift(start, False)
+        ne = shift(end, True)
+        new_start = to_u16(ns)
+        new_length = to_u16(ne) - new_start
+        if new_length <= 0:
+            continue
 
-    for ent in sorted_entities:
         if isinstance(ent, MessageEntityTextUrl):
-            start = ent.offset + shift
-            end = start + ent.length
-            link_text = message_text[start:end] if 0 <= start <= len(message_text) else ""
-
             ent_url = getattr(ent, "url", "") or ""
-            ent_url_norm = normalize_link(ent_url)
-
-            new_url = map_by_norm.get(ent_url_norm, ent_url)
-
-            new_text = link_text
-            if src_name and tgt_name and link_text == src_name:
-                new_text = tgt_name
-
-            if new_text != link_text or new_url != ent_url:
-                logging.info(f"Гиперссылка заменена: [{link_text}]({ent_url}) → [{new_text}]({new_url})")
-
-            if new_text != link_text:
-                before = message_text[:start]
-                after = message_text[end:]
-                message_text = before + new_text + after
-                delta = len(new_text) - len(link_text)
-                new_ent = MessageEntityTextUrl(offset=ent.offset + shift, length=len(new_text), url=new_url)
-                updated_entities.append(new_ent)
-                shift += delta
+            new_url = url_by_norm.get(normalize_link(ent_url), ent_url)
+            link_text = text[start:end]
+            new_link_text = new_text[ns:ne]
+            if new_url != ent_url or new_link_text != link_text:
+                logging.info("Гиперссылка заменена: [%s](%s) → [%s](%s)", link_text, ent_url, new_link_text, new_url)
+            if new_url == ent_url and new_start == ent.offset and new_length == ent.length:
+                updated_entities.append(ent)  # тот же объект — unchanged() в handlers узнаёт нетронутый пост
             else:
-                new_ent = MessageEntityTextUrl(offset=ent.offset + shift, length=ent.length, url=new_url)
-                updated_entities.append(new_ent)
+                updated_entities.append(MessageEntityTextUrl(offset=new_start, length=new_length, url=new_url))
+        elif new_start != ent.offset or new_length != ent.length:
+            new_ent = copy.copy(ent)
+            new_ent.offset = new_start
+            new_ent.length = new_length
+            updated_entities.append(new_ent)
         else:
-            try:
-                if hasattr(ent, "offset"):
-                    ent.offset = ent.offset + shift
-                updated_entities.append(ent)
-            except Exception:
-                updated_entities.append(ent)
+            updated_entities.append(ent)
 
-    return message_text, updated_entities
+    return new_text, updated_entities
 
 
 def extract_links_from_text_and_entities(text: str, entities: list, media=None, reply_markup=None) -> set:
@@ -197,11 +197,90 @@ def extract_links_from_text_and_entities(text: str, entities: list, media=None,
     return found
 
 
-def links_allowed_by_whitelist(links: set, whitelist: list) -> tuple[bool, set]:
-    """Проверяет ссылки против whitelist"""
+class _Node:
+    __slots__ = ("children", "exact", "subtree")
+
+    def __init__(self):
+        self.children = {}
+        self.exact = None    # схемы ("https", "*"…), для которых разрешён ровно этот адрес
+        self.subtree = None  # схемы, для которых разрешено всё под этим узлом
+
+
+def _link_keys(host: str, path: str) -> list:
+    """Ключи пути в дереве: метки хоста справа налево, затем "/" и сегменты пути"""
+    keys = host.split(".")
+    keys.reverse()
+    keys.append("/")
+    keys.extend(seg for seg in path.split("/") if seg)
+    return keys
+
+
+class Whitelist:
+    """Скомпилированный white_list: дерево по хосту и пути, проверка ссылки — за её длину.
+
+    Записи:
+      https://t.me/channel  — ровно этот адрес (без схемы — для любой схемы)
+      *.example.com         — домен и все его поддомены, любой путь
+      t.me/boost/*          — префикс пути: t.me/boost и всё под ним (t.me/boost/ — ровно адрес)
+    """
+
+    def __init__(self, entries=()):
+        self.root = _Node()
+        self.entries = tuple(e for e in entries if e)
+        for entry in self.entries:
+            self._add(entry)
+
+    def _add(self, entry: str):
+        e = entry.strip().lower()
+        scheme = "*"
+        if "://" in e:
+            scheme, e = e.split("://", 1)
+        e = e.split("#", 1)[0].split("?", 1)[0]
+        host, _, path = e.partition("/")
+        domain = host.startswith("*.")
+        if domain:
+            host = host[2:]
+        # Префикс — только явный "/*": хвостовой "/" обычного адреса не должен расширять запись
+        prefix = path == "*" or path.endswith("/*")
+        path = (path[:-1] if prefix else path).rstrip("/")
+        if not host:
+            return
+
+        keys = _link_keys(host, path)
+        if domain:
+            keys = keys[:keys.index("/")]
+        node = self.root
+        for key in keys:
+            node = node.children.setdefault(key, _Node())
+        attr = "subtree" if domain or prefix else "exact"
+        schemes = getattr(node, attr)
+        if schemes is None:
+            schemes = set()
+            setattr(node, attr, schemes)
+        schemes.add(scheme)
+
+    def allows(self, link: str) -> bool:
+        """link — нормализованная ссылка (normalize_link)"""
+        scheme, sep, rest = link.partition("://")
+        if not sep:
+            return False
+        host, _, path = rest.partition("/")
+        node = self.root
+        for key in _link_keys(host, path):
+            node = node.children.get(key)
+            if node is None:
+                return False
+            if node.subtree and ("*" in node.subtree or scheme in node.subtree):
+                return True
+        return bool(node.exact) and ("*" in node.exact or scheme in node.exact)
+
+
+def links_allowed_by_whitelist(links: set, whitelist) -> tuple[bool, set]:
+    """Проверяет ссылки против whitelist (Whitelist или список записей)"""
     if not links:
         return True, set()
 
-    wl_norm = {normalize_link(u) for u in (whitelist or []) if u}
-    disallowed = {l for l in links if l not in wl_norm}
+    if not isinstance(whitelist, Whitelist):
+        whitelist = Whitelist(whitelist or ())
+    disallowed = {l for l in links if not whitelist.allows(l)}
     return (len(disallowed) == 0), disallowed